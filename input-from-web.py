@@ -1,38 +1,159 @@
 #!/usr/bin/env python3
 """input-from-web: Type on your phone, inject into focused desktop app."""
 
-import argparse
+import array
+import base64
+import bisect
+import codecs
+import collections
+import contextlib
+import errno
+import fcntl
+import hashlib
+import importlib.util
+import io
 import json
+import math
 import os
+import queue
+import re
 import secrets
+import select
+import signal
 import socket
+import struct
 import subprocess
 import sys
+import threading
 import time
+import urllib.parse
+import zlib
 
-import logging
+_STARTED = time.perf_counter()  # end of the stdlib imports, for --startup-trace
 
-from flask import Flask, Response, request, abort, send_from_directory
-import qrcode
 
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-app = Flask(__name__)
+def _lazy_import(name):
+    """The module name, imported for real on first attribute access."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named {name!r}", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)  # as a real import would
+    return module
+
+
+# Heavy imports are deferred so the QR code is on screen before they run:
+# asyncio only matters for --server async, concurrent.futures and http.client
+# only for relay.peers, qrcode only when the QR isn't
+# cached, and Flask (about 200 ms) is loaded by LazyApp once main() is done
+# with the terminal. tempfile, gzip and ctypes are only needed once a paste,
+# a QR cache write, the static assets or the config watcher use them; logging
+# comes with Flask, argparse with main() and brotli with the assets.
+asyncio = _lazy_import("asyncio")
+futures = _lazy_import("concurrent.futures")
+http_client = _lazy_import("http.client")
+qrcode = _lazy_import("qrcode")
+tempfile = _lazy_import("tempfile")
+gzip = _lazy_import("gzip")
+ctypes = _lazy_import("ctypes")
+Flask = Response = request = abort = None  # bound by load_flask()
+
+
+def load_flask():
+    """Import Flask and bind the names the handlers use."""
+    global Flask, Response, request, abort, _Detached
+    if Flask is not None:
+        return
+    import logging
+    from flask import Flask, Response, request, abort
+
+    class _PingFilter(logging.Filter):
+        """Keeps /ping and /metrics scrapes out of Werkzeug's request log."""
+
+        def filter(self, record):
+            message = record.getMessage()
+            return "/ping" not in message and "/metrics" not in message
+
+    logging.getLogger("werkzeug").addFilter(_PingFilter())
+
+    class _Detached(Response):
+        """Returned after a WebSocket session: the connection no longer speaks HTTP.
+
+        Werkzeug treats ConnectionError as the client going away and moves on
+        without writing a response.
+        """
+
+        def __call__(self, environ, start_response):
+            raise ConnectionError("websocket session finished")
+
+
+class LazyApp:
+    """Collects routes and hooks, and builds the Flask app on first real use."""
+
+    def __init__(self, import_name):
+        self.import_name = import_name
+        self.setup = []
+        self.flask_app = None
+
+    def route(self, rule, **options):
+        def register(view):
+            self.setup.append(lambda app: app.route(rule, **options)(view))
+            return view
+        return register
+
+    def before_request(self, hook):
+        self.setup.append(lambda app: app.before_request(hook))
+        return hook
 
-# Suppress Werkzeug request log for /ping
-_werkzeug_log = logging.getLogger("werkzeug")
-_orig_log_request = _werkzeug_log.handle
+    def after_request(self, hook):
+        self.setup.append(lambda app: app.after_request(hook))
+        return hook
 
-class _PingFilter(logging.Filter):
-    def filter(self, record):
-        return "/ping" not in record.getMessage()
+    def errorhandler(self, code_or_exception):
+        def register(handler):
+            self.setup.append(lambda app: app.errorhandler(code_or_exception)(handler))
+            return handler
+        return register
+
+    def load(self):
+        if self.flask_app is None:
+            load_flask()
+            flask_app = Flask(self.import_name)
+            for step in self.setup:
+                step(flask_app)
+            self.flask_app = flask_app
+        return self.flask_app
+
+    def __call__(self, environ, start_response):
+        return self.load()(environ, start_response)
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+app = LazyApp(__name__)
 
-_werkzeug_log.addFilter(_PingFilter())
 TOKEN = secrets.token_urlsafe(32)
 USE_TOKEN = True
 PERMANENT_LINK = False
 METHOD = "type"
 AUTO_PASTE = False
 PROFILE = {}
+HEARTBEAT_SECONDS = 15
+INJECTOR = None  # set in main(), see make_injector()
+INJECTOR_KIND = None
+CONFIG_VERSION = None  # changes whenever the page or its config does
+PROFILE_NAME = None
+CLI_OVERRIDES = {}  # --method / --injector, kept across config reloads
 
 CONFIG_PATH = os.path.expanduser("~/.input-from-web-conf.json")
 
@@ -45,6 +166,8 @@ DEFAULT_CONFIG = {
         "profiles.<name>.method:",
         "  'type'      - ydotool type, simulates keystrokes (default).",
         "  'clipboard' - wl-copy to clipboard, you paste manually.",
+        "  'auto'      - type what the keymap can and paste the rest (long runs, non-ASCII),",
+        "                picking whichever is quicker for each part. Always pastes with Ctrl+V.",
         "  Can be overridden with --method on the command line.",
         "",
         "profiles.<name>.auto_paste:",
@@ -52,6 +175,18 @@ DEFAULT_CONFIG = {
         "  false - clipboard only, you paste manually (default).",
         "  Ignored when method is 'type'. Useful for GUI apps, not terminals.",
         "",
+        "profiles.<name>.injector:",
+        "  'auto'       - talk to ydotoold's socket directly, fall back to spawning ydotool (default).",
+        "  'socket'     - only use the ydotoold socket (no fallback).",
+        "  'subprocess' - spawn ydotool for every send (original behaviour).",
+        "  Can be overridden with --injector on the command line.",
+        "",
+        "profiles.<name>.server:",
+        "  'werkzeug' - Flask's development server (default).",
+        "  'async'    - built-in asyncio server: HTTP/1.1 keep-alive, bounded thread pool,",
+        "               low idle cost. Better for sessions that run for hours.",
+        "  Can be overridden with --server on the command line.",
+        "",
         "profiles.<name>.port:",
         "  TCP port to listen on (default: 5123).",
         "  Can be overridden with --port on the command line.",
@@ -61,12 +196,93 @@ DEFAULT_CONFIG = {
         "  false - no token, anyone on the network can send input.",
         "          WARNING: only disable on a trusted private network!",
         "",
+        "profiles.<name>.heartbeat_seconds:",
+        "  How often the server pushes a heartbeat to connected pages (default 15).",
+        "  A page that misses heartbeats for ~2.5 intervals shows the red dot and reconnects.",
+        "",
+        "profiles.<name>.show_timings:",
+        "  true  - show where each send's time went (network, server, injection steps)",
+        "          under the status line, averaged over the last 20 sends.",
+        "  false - don't (default).",
+        "",
         "profiles.<name>.voice_send:",
         "  enabled       - true/false to toggle voice command detection.",
         "  delay_seconds - seconds to wait after last edit before auto-triggering.",
         "  send_words    - words that trigger auto-send when typed last (case insensitive).",
         "  clear_words   - words that trigger auto-clear when typed last (case insensitive).",
         "",
+        "profiles.<name>.streaming:",
+        "  enabled              - true/false. Push words to the desktop as you dictate instead",
+        "                         of only on SEND, over one WebSocket (default false).",
+        "  commit_delay_seconds - how long the text must stay unchanged before words are pushed.",
+        "  Best with method 'type' (or 'clipboard' with auto_paste).",
+        "",
+        "profiles.<name>.mirror:",
+        "  enabled            - true/false. SEND makes the desktop field match the text box by",
+        "                       typing only the difference (cursor moves, BackSpaces and the",
+        "                       new text) instead of the whole text (default false).",
+        "  sync_delay_seconds - also sync once the text has been unchanged this long,",
+        "                       0 for only on SEND (default 1). Ignored with streaming.",
+        "  jump_keys          - also move the cursor with Ctrl+Home / Ctrl+End when that is",
+        "                       shorter (default true). Turn off for apps without them.",
+        "",
+        "profiles.<name>.history:",
+        "  Sent texts are kept in ~/.local/share/input-from-web/history-<profile>.log, so",
+        "  the page's history survives reloads and is shared between devices.",
+        "  max_entries  - entries kept, 0 to keep no history on disk (default 10000).",
+        "  max_age_days - drop entries older than this, 0 for no limit (default 0).",
+        "",
+        "profiles.<name>.coalesce:",
+        "  max_batch   - sends waiting in the queue are injected together, up to this many",
+        "                at a time (default 16, 1 turns it off).",
+        "  max_wait_ms - how long the worker holds a send for more to join it (default 0:",
+        "                only sends that are already waiting are joined).",
+        "",
+        "profiles.<name>.clients:",
+        "  max_inflight_chars - characters one client may have queued or being typed",
+        "                       (default 1048576). Sends over it get 429 until some is typed;",
+        "                       a single larger paste is still taken when nothing else is queued.",
+        "",
+        "profiles.<name>.admission:",
+        "  Limits that keep a runaway script or a scanner from tying up the server.",
+        "  Requests over them get 429 with Retry-After. Rates are per second, 0 = no limit.",
+        "  address_rate / address_burst - requests per client address (default 20 / 60).",
+        "  token_rate / token_burst     - requests presenting the token, from all addresses",
+        "                                 together (default 60 / 120). Keep it well above",
+        "                                 address_rate so one address can't use it all up.",
+        "  max_queued          - sends waiting to be typed, over all clients (default 256).",
+        "  lockout_after       - wrong tokens in a row before an address is locked out, for",
+        "                        1 s and then twice as long per further miss (default 5).",
+        "  lockout_max_seconds - longest lockout (default 900).",
+        "",
+        "profiles.<name>.relay:",
+        "  Forward every /send to other input-from-web instances as well.",
+        "  peers      - their URLs, with ?token=... if they use one (default none).",
+        "  timeout_ms - how long to wait for each peer per attempt (default 2000).",
+        "  retries    - further attempts after a peer error or timeout (default 2).",
+        "  local      - also type here; false makes this instance only a relay (default true).",
+        "",
+        "profiles.<name>.typing:",
+        "  Pacing of the 'type' method, for apps that drop keys when typed into at full speed.",
+        "  keys_per_second  - average typing rate, 0 for as fast as possible (default).",
+        "  burst            - keystrokes that may go out back to back (default 64).",
+        "  mode             - 'steady': spread keys out evenly once the burst is used up.",
+        "                     'bursts': type in bursts of up to `burst` keys, pausing in",
+        "                     between to keep the average rate (fewer, longer pauses).",
+        "  newline_pause_ms - extra pause after each newline (default 0).",
+        "",
+        "profiles.<name>.macros:",
+        "  Named lists of steps, each shown as a button on the page and run as one job,",
+        "  with nothing else typed in between. A step is one of:",
+        "    {\"text\": \"...\"}                typed (or routed, with method 'auto')",
+        "    {\"key\": \"ctrl+a\", \"count\": 1}  a key or chord, pressed count times",
+        "    {\"wait_ms\": 200}               a pause (at most 10 s per macro)",
+        "    {\"paste\": \"...\"}               copied with wl-copy and pasted with Ctrl+V",
+        "    {\"input\": true}                the text box, typed; the button sends and",
+        "                                   clears it like SEND",
+        "  Example: {\"Run\": [{\"input\": true}, {\"key\": \"enter\"}],",
+        "            \"Next field\": [{\"key\": \"tab\"}]}",
+        "",
         "profiles.<name>.substitutions:",
         "  Keys are phrases to match (case insensitive), values are replacements.",
         "  Applied automatically as you type. Useful for voice dictation.",
@@ -77,14 +293,60 @@ DEFAULT_CONFIG = {
         "default": {
             "method": "type",
             "auto_paste": False,
+            "injector": "auto",
+            "server": "werkzeug",
             "port": 5123,
             "use_security_token": True,
+            "heartbeat_seconds": 15,
+            "show_timings": False,
             "voice_send": {
                 "enabled": True,
                 "delay_seconds": 1.5,
                 "send_words": ["send"],
                 "clear_words": ["clear"],
             },
+            "streaming": {
+                "enabled": False,
+                "commit_delay_seconds": 0.8,
+            },
+            "mirror": {
+                "enabled": False,
+                "sync_delay_seconds": 1.0,
+                "jump_keys": True,
+            },
+            "history": {
+                "max_entries": 10000,
+                "max_age_days": 0,
+            },
+            "coalesce": {
+                "max_batch": 16,
+                "max_wait_ms": 0,
+            },
+            "clients": {
+                "max_inflight_chars": 1 << 20,
+            },
+            "admission": {
+                "address_rate": 20,
+                "address_burst": 60,
+                "token_rate": 60,
+                "token_burst": 120,
+                "max_queued": 256,
+                "lockout_after": 5,
+                "lockout_max_seconds": 900,
+            },
+            "relay": {
+                "peers": [],
+                "timeout_ms": 2000,
+                "retries": 2,
+                "local": True,
+            },
+            "typing": {
+                "keys_per_second": 0,
+                "burst": 64,
+                "mode": "steady",
+                "newline_pause_ms": 0,
+            },
+            "macros": {},
             "substitutions": {
                 "full stop": ".",
                 "question mark": "?",
@@ -131,7 +393,7 @@ def save_config(config):
         json.dump(config, f, indent=2, ensure_ascii=False)
 
 
-HTML_TEMPLATE = r"""
+PAGE_TEMPLATE = r"""
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -141,10 +403,34 @@ HTML_TEMPLATE = r"""
 <meta name="apple-mobile-web-app-capable" content="yes">
 <meta name="apple-mobile-web-app-status-bar-style" content="black-translucent">
 <link rel="manifest" href="/manifest.json">
-<link rel="icon" href="/icon.png">
-<link rel="apple-touch-icon" href="/icon.png">
+<link rel="icon" href="__ICON_URL__">
+<link rel="apple-touch-icon" href="__ICON_URL__">
 <title>Input</title>
-<style>
+<link rel="stylesheet" href="__CSS_URL__">
+</head>
+<body>
+<div class="container">
+<div class="btn-row">
+  <button id="btn">SEND</button>
+  <button id="clear-btn">X</button>
+</div>
+<textarea id="txt" placeholder="Type here..." autofocus></textarea>
+<div class="macro-row" id="macros"></div>
+<div class="nav-row">
+  <button class="nav-btn" id="nav-left" disabled>&lt;</button>
+  <div class="nav-mid"><div class="nav-info" id="nav-info"></div><div class="status" id="status"></div><span class="ping" id="ping"></span><div class="timing" id="timing"></div></div>
+  <button class="nav-btn" id="nav-right" disabled>&gt;</button>
+</div>
+</div>
+<script src="/config.js"></script>
+<script src="__PIPELINE_URL__"></script>
+<script src="__OUTBOX_URL__"></script>
+<script src="__JS_URL__"></script>
+</body>
+</html>
+"""
+
+APP_CSS = r"""
 *{margin:0;padding:0;box-sizing:border-box}
 html,body{height:100%;font-family:system-ui,sans-serif;background:#1a1a1a;color:#fff}
 .container{display:flex;flex-direction:column;height:100dvh;padding:8px;gap:8px}
@@ -156,6 +442,11 @@ html,body{height:100%;font-family:system-ui,sans-serif;background:#1a1a1a;color:
 #clear-btn:active{background:#b91c1c}
 textarea{flex:1;width:100%;padding:12px;font-size:1rem;background:#262626;color:#fff;border:1px solid #444;border-radius:8px;resize:none}
 textarea:focus{outline:none;border-color:#2563eb}
+.macro-row{display:flex;flex-wrap:wrap;gap:8px;flex-shrink:0}
+.macro-row:empty{display:none}
+.macro-btn{flex:1;padding:12px;font-size:1rem;background:#444;color:#fff;border:none;border-radius:8px;cursor:pointer}
+.macro-btn:active{background:#666}
+.macro-btn:disabled{background:#2a2a2a;color:#555}
 .nav-row{display:flex;gap:8px;flex-shrink:0;align-items:center}
 .nav-btn{width:56px;padding:16px;font-size:1.2rem;font-weight:bold;background:#444;color:#fff;border:none;border-radius:8px;cursor:pointer;flex-shrink:0}
 .nav-btn:active:not(:disabled){background:#666}
@@ -163,25 +454,12 @@ textarea:focus{outline:none;border-color:#2563eb}
 .nav-mid{flex:1;text-align:center}
 .nav-info{font-size:0.8rem;color:#666}
 .status{font-size:0.85rem;color:#888}
+.timing{font-size:0.7rem;color:#666;font-variant-numeric:tabular-nums}
 .ping{display:inline-block;width:10px;height:10px;border-radius:50%;background:#555;vertical-align:middle;margin-left:6px}
-</style>
-</head>
-<body>
-<div class="container">
-<div class="btn-row">
-  <button id="btn">SEND</button>
-  <button id="clear-btn">X</button>
-</div>
-<textarea id="txt" placeholder="Type here..." autofocus></textarea>
-<div class="nav-row">
-  <button class="nav-btn" id="nav-left" disabled>&lt;</button>
-  <div class="nav-mid"><div class="nav-info" id="nav-info"></div><div class="status" id="status"></div><span class="ping" id="ping"></span></div>
-  <button class="nav-btn" id="nav-right" disabled>&gt;</button>
-</div>
-</div>
-<script>
-const CONFIG = __CONFIG__;
+"""
 
+# Expects CONFIG (the profile) from /config.js, loaded just before it.
+APP_JS = r"""
 /* --- Token: URL query > localStorage > null --- */
 const STORAGE_KEY = "input-from-web-token";
 let token = new URLSearchParams(location.search).get("token");
@@ -191,6 +469,30 @@ if (token) {
   token = localStorage.getItem(STORAGE_KEY);
 }
 
+/* --- Client id: lets the server give each device its own queue ---
+ * Issued once by /register. Until it arrives the server goes by address. */
+const CLIENT_KEY = "input-from-web-client";
+let clientId = localStorage.getItem(CLIENT_KEY);
+if (!clientId) registerClient();
+
+async function registerClient() {
+  try {
+    const res = await fetch("/register" + authQuery(), {
+      method: "POST",
+      headers: {"Content-Type": "application/json"},
+      body: JSON.stringify({name: navigator.platform || ""})
+    });
+    if (!res.ok) return;
+    clientId = (await res.json()).client;
+    localStorage.setItem(CLIENT_KEY, clientId);
+  } catch(e) {}
+}
+
+function authQuery() {
+  const query = "?token=" + encodeURIComponent(token || "");
+  return clientId ? query + "&client=" + encodeURIComponent(clientId) : query;
+}
+
 const txt = document.getElementById("txt");
 const btn = document.getElementById("btn");
 const clearBtn = document.getElementById("clear-btn");
@@ -205,71 +507,140 @@ navLeft.addEventListener("click", histBack);
 navRight.addEventListener("click", histForward);
 
 /* --- History ---
- * history[] holds sent messages. The user always edits a "draft" buffer.
- * histIdx points to the currently viewed entry:
- *   histIdx === history.length  =>  draft buffer (empty unsent)
- *   histIdx < history.length    =>  viewing a past message
- * Sending from a past entry: if text differs from original, a new entry
- * is appended; if identical, it still appends a new entry (re-send).
+ * Sent messages are kept by the server (/history), numbered histFirst to
+ * histLast, and shared by every device on the profile. Only the entries
+ * being looked at are fetched, a page at a time, and at most HIST_CACHE are
+ * kept here. histId is the entry in the text box, or null for the "draft"
+ * (unsent text). Sending a past entry, edited or not, adds a new one.
  */
-const history = [];
-let histIdx = 0;
+const HIST_PAGE = 20;
+const HIST_CACHE = 100;
+const histCache = new Map();  // entry id -> text
+let histFirst = 1;
+let histLast = 0;  // below histFirst: no history yet
+let histId = null;
 let draft = "";
 
 function updateNav() {
-  navLeft.disabled = (histIdx === 0 && history.length === 0) || histIdx === 0;
-  navRight.disabled = histIdx >= history.length;
-  if (history.length > 0) {
-    const pos = histIdx < history.length ? histIdx + 1 : history.length + 1;
-    navInfo.textContent = pos + " / " + (history.length + 1);
+  const total = histLast - histFirst + 1;
+  navLeft.disabled = total <= 0 || histId === histFirst;
+  navRight.disabled = histId === null;
+  if (total > 0) {
+    const pos = histId === null ? total + 1 : histId - histFirst + 1;
+    navInfo.textContent = pos + " / " + (total + 1);
   } else {
     navInfo.textContent = "";
   }
 }
 
-function histBack() {
-  if (histIdx <= 0) return;
-  if (histIdx === history.length) draft = txt.value;
-  histIdx--;
-  txt.value = history[histIdx];
+function histRemember(entries) {
+  for (const e of entries) histCache.set(e.id, e.text);
+  if (histCache.size <= HIST_CACHE) return;
+  const center = histId === null ? histLast : histId;
+  const far = [...histCache.keys()].sort((a, b) => Math.abs(b - center) - Math.abs(a - center));
+  for (const id of far.slice(0, histCache.size - HIST_CACHE)) histCache.delete(id);
+}
+
+/* One page of entries older than cursor (the newest without one). */
+async function histLoad(cursor) {
+  let url = "/history" + authQuery() + "&limit=" + HIST_PAGE;
+  if (cursor) url += "&cursor=" + cursor;
+  const res = await fetch(url, {signal: AbortSignal.timeout(8000)});
+  if (!res.ok) throw new Error("HTTP " + res.status);
+  const page = await res.json();
+  histFirst = page.first;
+  histLast = page.last;
+  histRemember(page.entries);
+}
+
+async function histShow(id) {
+  if (id !== null && !histCache.has(id)) {
+    try {
+      await histLoad(id + 1);
+    } catch(e) {
+      showStatus("History unavailable");
+      return;
+    }
+    if (!histCache.has(id)) return updateNav();  // dropped on the server meanwhile
+  }
+  if (histId === null) draft = txt.value;
+  histId = id;
+  txt.value = id === null ? draft : histCache.get(id);
   txt.focus();
   updateNav();
 }
 
+async function histBack() {
+  if (histId === null) {
+    // Leaving the draft: pick up what other devices sent in the meantime.
+    await histLoad().catch(() => {});
+    if (histLast >= histFirst) histShow(histLast);
+  } else if (histId > histFirst) {
+    histShow(histId - 1);
+  }
+}
+
 function histForward() {
-  if (histIdx >= history.length) return;
-  histIdx++;
-  txt.value = histIdx < history.length ? history[histIdx] : draft;
-  txt.focus();
+  if (histId !== null) histShow(histId < histLast ? histId + 1 : null);
+}
+
+function histNote(text, id) {
+  if (!id) return;
+  histLast = Math.max(histLast, id);
+  histRemember([{id: id, text: text}]);
   updateNav();
 }
 
-updateNav();
+/* After a send: back to the draft, noting the new entry if known. */
+function histSent(text, id) {
+  histId = null;
+  draft = "";
+  histNote(text, id);
+  updateNav();
+}
 
-/* --- Substitutions --- */
-function escapeRegex(s) {
-  return s.replace(/[.*+?^${}()|[\]\\]/g, "\\$&");
+/* Streaming and mirror sends don't go through /send, so record them here. */
+function histRecord(text) {
+  fetch("/history" + authQuery(), {
+    method: "POST",
+    headers: {"Content-Type": "application/json"},
+    body: JSON.stringify({text: text})
+  }).then(res => res.json()).then(body => histNote(text, body.id)).catch(() => {});
 }
 
-const subEntries = Object.entries(CONFIG.substitutions || {})
-  .sort((a, b) => b[0].length - a[0].length);
+histLoad().then(updateNav).catch(() => {});
+updateNav();
+
+/* --- Substitutions and voice commands ---
+ * See pipeline.js. Input is handled once per animation frame, and only the
+ * stretch of text around the edit is rescanned.
+ */
+const pipeline = makePipeline(CONFIG);
+let lengthBefore = 0;
+let editStart = Infinity;
+let inputFrame = 0;
 
-function applySubstitutions() {
-  let text = txt.value;
-  let changed = false;
-  for (const [phrase, replacement] of subEntries) {
-    const re = new RegExp("(^|\\s)" + escapeRegex(phrase) + "(?=\\s|$)", "gi");
-    if (re.test(text)) {
-      text = text.replace(re, function(m, before) { return before + replacement; });
-      changed = true;
-    }
-  }
-  if (changed) {
-    const pos = txt.selectionStart;
-    const diff = txt.value.length - text.length;
-    txt.value = text;
-    txt.selectionStart = txt.selectionEnd = Math.max(0, pos - diff);
+txt.addEventListener("beforeinput", () => {
+  lengthBefore = txt.value.length;
+});
+
+txt.addEventListener("input", (e) => {
+  const inserted = Math.max(txt.value.length - lengthBefore, e.data ? e.data.length : 0, 0);
+  editStart = Math.min(editStart, txt.selectionEnd - inserted);
+  if (!inputFrame) inputFrame = requestAnimationFrame(processInput);
+});
+
+function processInput() {
+  inputFrame = 0;
+  const caret = txt.selectionEnd;
+  const r = pipeline.substitute(txt.value, Math.max(0, Math.min(editStart, caret)), caret, caret);
+  editStart = Infinity;
+  if (r) {
+    txt.value = r.value;
+    txt.selectionStart = txt.selectionEnd = r.caret;
   }
+  checkVoiceCommand();
+  scheduleCommit();
 }
 
 /* --- Voice send --- */
@@ -280,70 +651,375 @@ function checkVoiceCommand() {
   if (!vs || !vs.enabled) return;
   if (voiceTimer) { clearTimeout(voiceTimer); voiceTimer = null; }
 
-  const text = txt.value.trimEnd();
-  if (!text) return;
-
-  const words = text.split(/\s+/);
-  const lastWord = words[words.length - 1].toLowerCase();
-
-  const sendWords = (vs.send_words || []).map(w => w.toLowerCase());
-  const clearWords = (vs.clear_words || []).map(w => w.toLowerCase());
-
-  let action = null;
-  if (sendWords.includes(lastWord)) action = "send";
-  else if (clearWords.includes(lastWord)) action = "clear";
-
-  if (action) {
+  const cmd = pipeline.command(txt.value);
+  if (cmd) {
     const delay = (vs.delay_seconds || 1.5) * 1000;
     voiceTimer = setTimeout(() => {
       voiceTimer = null;
-      const re = new RegExp("\\s*" + escapeRegex(lastWord) + "\\s*$", "i");
+      const re = new RegExp("\\s*" + escapeRegex(cmd.word) + "\\s*$", "i");
       txt.value = txt.value.replace(re, "");
-      if (action === "send") doSend();
+      if (cmd.action === "send") doSend();
       else clearText();
     }, delay);
   }
 }
 
-txt.addEventListener("input", () => {
-  applySubstitutions();
-  checkVoiceCommand();
-});
+/* --- Live streaming ---
+ * Words are pushed over one WebSocket once the text has been stable for
+ * commit_delay_seconds. `streamed` is the prefix of the textarea already
+ * handed to the server. Every push gets a sequence number; pushes stay in
+ * `pending` until acked, and are resent in order after a reconnect (the
+ * server skips any it has already typed).
+ */
+const streamCfg = CONFIG.streaming || {};
+const STREAMING = !!streamCfg.enabled && "WebSocket" in window;
+const streamSession = Math.random().toString(36).slice(2) + Date.now().toString(36);
+const pending = [];
+let ws = null;
+let wsReady = false;
+let wsBackoff = 1000;
+let streamSeq = 0;
+let streamed = "";
+let commitTimer = null;
+
+/* Trailing words that could still grow into a multi-word substitution
+ * ("full" before "stop") are held back. */
+const phrasePrefixes = new Set();
+let phraseWordsMax = 1;
+for (const phrase of Object.keys(CONFIG.substitutions || {})) {
+  const words = phrase.toLowerCase().split(/\s+/);
+  phraseWordsMax = Math.max(phraseWordsMax, words.length);
+  for (let i = 1; i < words.length; i++) phrasePrefixes.add(words.slice(0, i).join(" "));
+}
+
+const streamVs = CONFIG.voice_send || {};
+const commandWords = new Set([...(streamVs.send_words || []), ...(streamVs.clear_words || [])]
+  .map(w => w.toLowerCase()));
+
+function commitBoundary(text) {
+  let end = text.search(/\S*$/);  // the word still being typed is never committed
+  for (let held = 0; held < phraseWordsMax; held++) {
+    const head = text.slice(0, end).trimEnd();
+    const words = head.slice(-256).split(/\s+/).slice(-phraseWordsMax);
+    const last = words[words.length - 1];
+    if (!last) break;
+    let hold = held === 0 && commandWords.has(last.toLowerCase());
+    for (let i = 1; !hold && i <= words.length; i++) {
+      hold = phrasePrefixes.has(words.slice(-i).join(" ").toLowerCase());
+    }
+    if (!hold) break;
+    end = head.length - last.length;
+  }
+  return end;
+}
+
+function scheduleCommit() {
+  if (MIRROR) return scheduleMirror();
+  if (!STREAMING) return;
+  if (commitTimer) clearTimeout(commitTimer);
+  commitTimer = setTimeout(commitStream, (streamCfg.commit_delay_seconds || 0.8) * 1000);
+}
+
+function commitStream(flush) {
+  commitTimer = null;
+  const text = txt.value;
+  const end = flush ? text.length : commitBoundary(text);
+  if (!text.startsWith(streamed)) {
+    // The part already typed on the desktop was edited; it can't be taken back.
+    streamed = text.slice(0, end);
+    showStatus("Edit not streamed");
+    return;
+  }
+  if (end > streamed.length) {
+    streamPush(text.slice(streamed.length, end));
+    streamed = text.slice(0, end);
+  }
+}
+
+function streamPush(text) {
+  const item = {type: "text", seq: ++streamSeq, text: text};
+  pending.push(item);
+  if (wsReady) ws.send(JSON.stringify(item));
+}
+
+function streamResend(last) {
+  while (pending.length && pending[0].seq <= last) pending.shift();
+  if (wsReady) for (const item of pending) ws.send(JSON.stringify(item));
+}
+
+function streamConnect() {
+  const proto = location.protocol === "https:" ? "wss://" : "ws://";
+  ws = new WebSocket(proto + location.host + "/stream" + authQuery());
+  ws.onopen = () => {
+    wsBackoff = 1000;
+    ws.send(JSON.stringify({type: "hello", session: streamSession}));
+  };
+  ws.onmessage = (e) => {
+    const msg = JSON.parse(e.data);
+    if (msg.type === "hello") {
+      wsReady = true;
+      streamResend(msg.last);
+    } else if (msg.type === "ack") {
+      while (pending.length && pending[0].seq <= msg.seq) pending.shift();
+      reloadWhenIdle();
+    } else if (msg.type === "resync") {
+      streamResend(msg.last);
+    } else if (msg.type === "error") {
+      showStatus("Error: " + msg.error);
+      setTimeout(() => streamResend(msg.seq - 1), (msg.retry_after || 2) * 1000);
+    }
+  };
+  ws.onclose = () => {
+    wsReady = false;
+    setTimeout(streamConnect, wsBackoff);
+    wsBackoff = Math.min(wsBackoff * 2, 10000);
+  };
+}
+
+if (STREAMING) streamConnect();
 
 /* --- Actions --- */
 function clearText() {
+  if (MIRROR && txt.value) mirrorPost("", true).catch(() => {});
   txt.value = "";
+  streamed = "";
   txt.focus();
   showStatus("");
+  reloadWhenIdle();
+}
+
+function streamSend() {
+  commitStream(true);
+  const text = txt.value;
+  if (!text) return;
+  histSent(text);
+  histRecord(text);
+  txt.value = "";
+  streamed = "";
+  showStatus(wsReady ? "Sent!" : "Queued");
+  txt.focus();
+}
+
+/* --- Mirror mode ---
+ * The desktop field follows the text box: /mirror gets the whole text and
+ * types only what changed since the last sync, so a fixed typo costs a few
+ * keystrokes. The text stays in the box after SEND for further fixes. Clear
+ * tells the server to start over without deleting anything on the desktop.
+ */
+const mirrorCfg = CONFIG.mirror || {};
+const MIRROR = !!mirrorCfg.enabled && !STREAMING;
+let mirrorTimer = null;
+let mirrored = "";
+
+function mirrorPost(text, reset) {
+  return fetch("/mirror" + authQuery(), {
+    method: "POST",
+    headers: {"Content-Type": "application/json", "Idempotency-Key": newKey()},
+    body: JSON.stringify({text: text, reset: !!reset}),
+    signal: AbortSignal.timeout(8000)
+  }).then(res => {
+    if (!res.ok) throw new Error("HTTP " + res.status);
+    mirrored = reset ? "" : text;
+    return res.json();
+  });
+}
+
+function scheduleMirror() {
+  if (mirrorTimer) clearTimeout(mirrorTimer);
+  mirrorTimer = null;
+  const delay = mirrorCfg.sync_delay_seconds === undefined ? 1 : mirrorCfg.sync_delay_seconds;
+  if (delay > 0) mirrorTimer = setTimeout(mirrorSync, delay * 1000);
+}
+
+async function mirrorSync() {
+  mirrorTimer = null;
+  const text = txt.value;
+  if (text === mirrored) return true;
+  try {
+    const body = await mirrorPost(text);
+    myJobs.add(body.job);
+    return true;
+  } catch(e) {
+    showStatus("Not synced: " + e.message);
+    return false;
+  }
+}
+
+async function mirrorSend() {
+  if (mirrorTimer) clearTimeout(mirrorTimer);
+  const text = txt.value;
+  if (!await mirrorSync()) return;
+  if (text && histCache.get(histLast) !== text) histRecord(text);
+  histSent(text);
+  showStatus("Synced");
+  txt.focus();
+  reloadWhenIdle();
+}
+
+/* Long texts go to /paste as a raw (gzipped when supported) body, which the
+ * server spools and types in chunks instead of parsing one big JSON string. */
+const PASTE_THRESHOLD = 32768;
+
+async function postText(text, key) {
+  const query = authQuery();
+  if (text.length < PASTE_THRESHOLD) {
+    return fetch("/send" + query, {
+      method: "POST",
+      headers: {"Content-Type": "application/json", "Idempotency-Key": key},
+      body: JSON.stringify({text: text}),
+      signal: AbortSignal.timeout(8000)
+    });
+  }
+  const headers = {"Content-Type": "text/plain; charset=utf-8", "Idempotency-Key": key};
+  let body = text;
+  if ("CompressionStream" in window) {
+    body = await new Response(new Blob([text]).stream().pipeThrough(new CompressionStream("gzip"))).blob();
+    headers["Content-Encoding"] = "gzip";
+  }
+  const r = await fetch("/paste" + query, {method: "POST", headers: headers, body: body});
+  if (r.status !== 409) return r;
+  // A relay-only server can't forward /paste; /send goes to its peers.
+  return fetch("/send" + query, {
+    method: "POST",
+    headers: {"Content-Type": "application/json", "Idempotency-Key": key},
+    body: JSON.stringify({text: text})
+  });
+}
+
+/* --- Outbox ---
+ * Sends that can't reach the desktop go to the IndexedDB outbox (see
+ * outbox.js) and are replayed in order once the heartbeat is back. While
+ * anything is queued, new sends queue behind it to keep the order. */
+let outboxPending = 0;
+Outbox.size().then(n => { outboxPending = n; flushOutbox(); }).catch(() => {});
+
+function newKey() {
+  return Date.now().toString(36) + "-" + Math.random().toString(36).slice(2, 12);
+}
+
+async function queueSend(text, key) {
+  await Outbox.add({url: "/send" + authQuery(), key: key, text: text});
+  outboxPending++;
+  if ("serviceWorker" in navigator) {
+    navigator.serviceWorker.ready.then(r => r.sync && r.sync.register("outbox")).catch(() => {});
+  }
+}
+
+async function flushOutbox() {
+  if (!outboxPending) return;
+  const delivered = await Outbox.flush();
+  outboxPending = await Outbox.size().catch(() => 0);
+  if (delivered && !outboxPending) showStatus("Queued sends delivered");
 }
 
 async function doSend() {
+  if (STREAMING) return streamSend();
+  if (MIRROR) return mirrorSend();
   const text = txt.value;
   if (!text) return;
   btn.disabled = true;
   btn.textContent = "Sending...";
+  const key = newKey();
+  const queueable = text.length < PASTE_THRESHOLD;
+  let status = null;
+  let historyId = null;
+  try {
+    if (queueable && outboxPending) {
+      await queueSend(text, key);
+      flushOutbox();
+      status = "Queued";
+    } else {
+      const t0 = performance.now();
+      const res = await postText(text, key);
+      if (res.ok) {
+        status = "Sent!";
+        if (res.status === 202 || res.status === 200) {
+          const body = await res.json();
+          historyId = body.history;
+          if (body.job) {
+            myJobs.add(body.job);
+            noteTiming(body, performance.now() - t0);
+          }
+          const failed = (body.peers || []).filter(p => !p.ok).map(p => p.peer);
+          if (failed.length) status = "Sent, but not to " + failed.join(", ");
+        }
+      } else if (res.status === 429) {
+        showStatus("Busy: still typing your earlier sends");
+      } else {
+        showStatus("Error: " + res.status);
+      }
+    }
+  } catch(e) {
+    try {
+      if (!queueable) throw e;
+      await queueSend(text, key);
+      status = "Offline: queued";
+    } catch(e2) {
+      showStatus("Network error");
+    }
+  }
+  if (status) {
+    histSent(text, historyId);
+    txt.value = "";
+    showStatus(status);
+    txt.focus();
+  }
+  btn.disabled = false;
+  btn.textContent = "SEND";
+  reloadWhenIdle();
+}
+
+/* --- Macros ---
+ * A button for each macro in the profile; /macro runs all its steps as one
+ * job. Input steps type the text box, which is then cleared like SEND. In
+ * streaming and mirror mode the box is sent the usual way first instead, so
+ * its text lands before the macro's keys.
+ */
+const macroRow = document.getElementById("macros");
+for (const name of Object.keys(CONFIG.macros || {})) {
+  const b = document.createElement("button");
+  b.className = "macro-btn";
+  b.textContent = name;
+  b.addEventListener("click", () => runMacro(name, b));
+  macroRow.appendChild(b);
+}
+
+async function runMacro(name, button) {
+  button.disabled = true;
+  let text = "";
+  if (STREAMING || MIRROR) {
+    await doSend();
+    if (MIRROR) clearText();  // the desktop field is no longer the one mirrored
+    for (let i = 0; pending.length && i < 30; i++) await new Promise(r => setTimeout(r, 100));
+  } else if (CONFIG.macros[name].some(step => step.input === true)) {
+    text = txt.value;
+  }
   try {
-    const res = await fetch("/send?token=" + encodeURIComponent(token), {
+    const res = await fetch("/macro" + authQuery(), {
       method: "POST",
-      headers: {"Content-Type": "application/json"},
-      body: JSON.stringify({text: text})
+      headers: {"Content-Type": "application/json", "Idempotency-Key": newKey()},
+      body: JSON.stringify({name: name, input: text}),
+      signal: AbortSignal.timeout(8000)
     });
     if (res.ok) {
-      history.push(text);
-      histIdx = history.length;
-      draft = "";
-      txt.value = "";
-      updateNav();
-      showStatus("Sent!");
-      txt.focus();
+      const body = await res.json();
+      myJobs.add(body.job);
+      if (text) {
+        histSent(text, body.history);
+        txt.value = "";
+      }
+      showStatus(name + ": sent");
+    } else if (res.status === 429) {
+      showStatus("Busy: still typing your earlier sends");
     } else {
       showStatus("Error: " + res.status);
     }
   } catch(e) {
     showStatus("Network error");
   }
-  btn.disabled = false;
-  btn.textContent = "SEND";
+  button.disabled = false;
+  txt.focus();
+  reloadWhenIdle();
 }
 
 function showStatus(msg) {
@@ -351,126 +1027,4062 @@ function showStatus(msg) {
   if (msg) setTimeout(() => { statusEl.textContent = ""; }, 2000);
 }
 
-/* --- Ping --- */
-const pingEl = document.getElementById("ping");
-setInterval(async () => {
-  try {
-    const r = await fetch("/ping", {signal: AbortSignal.timeout(3000)});
-    pingEl.style.background = r.ok ? "#22c55e" : "#ef4444";
-  } catch(e) {
-    pingEl.style.background = "#ef4444";
+/* --- Latency display (profile show_timings) ---
+ * Round trip of each /send against the server's own time for it, then the
+ * injection steps from the job event, averaged over the last TIMING_WINDOW
+ * sends. Network time is the round trip minus the server total. */
+const timingEl = document.getElementById("timing");
+const TIMING_WINDOW = 20;
+const timingSamples = [];
+const timingPending = new Map();  // job id -> sample waiting for its job event
+const jobStages = new Map();      // job events that beat their /send response
+
+function noteTiming(body, rtt) {
+  if (!CONFIG.show_timings || !body.timings) return;
+  const server = body.timings.total || 0;
+  const sample = {rtt: rtt, net: Math.max(0, rtt - server), server: server};
+  const job = jobStages.get(body.job);
+  if (job) {
+    jobStages.delete(body.job);
+    addTiming(Object.assign(sample, job));
+  } else {
+    timingPending.set(body.job, sample);
+  }
+}
+
+function noteJobTiming(job) {
+  if (!CONFIG.show_timings || job.status !== "done") return;
+  const stages = Object.assign({queue: job.queued_ms || 0}, job.stages);
+  const sample = timingPending.get(job.id);
+  if (sample) {
+    timingPending.delete(job.id);
+    addTiming(Object.assign(sample, stages));
+  } else {
+    jobStages.set(job.id, stages);
+    if (jobStages.size > TIMING_WINDOW) jobStages.delete(jobStages.keys().next().value);
+  }
+}
+
+function addTiming(sample) {
+  timingSamples.push(sample);
+  if (timingSamples.length > TIMING_WINDOW) timingSamples.shift();
+  const sums = {};
+  for (const s of timingSamples) {
+    for (const k in s) sums[k] = (sums[k] || 0) + s[k];
   }
-}, 1000);
+  const n = timingSamples.length;
+  const avg = (k) => Math.round(sums[k] / n);
+  const steps = Object.keys(sums).filter(k => !["rtt", "net", "server"].includes(k));
+  timingEl.textContent = "rtt " + avg("rtt") + " = net " + avg("net") + " + server " + avg("server") +
+    " | " + steps.map(k => k.replace("_", " ") + " " + avg(k)).join(" · ") +
+    " ms (avg of " + n + ")";
+}
+
+/* --- Heartbeat ---
+ * One EventSource on /events. The server pushes a heartbeat every `keepalive`
+ * seconds when nothing else is sent; if no event arrives for 2.5 intervals
+ * the connection is presumed dead (e.g. half-open after a Wi-Fi drop), the
+ * dot turns red and we reconnect. Coming back flushes the outbox.
+ * Browsers without EventSource fall back to polling /ping.
+ */
+const pingEl = document.getElementById("ping");
+const myJobs = new Set();
+let events = null;
+let watchdog = null;
+let alive = false;
+
+function setAlive(ok) {
+  pingEl.style.background = ok ? "#22c55e" : "#ef4444";
+  if (ok && !alive) flushOutbox();
+  alive = ok;
+}
+
+function armWatchdog(keepalive) {
+  if (watchdog) clearTimeout(watchdog);
+  watchdog = setTimeout(() => {
+    setAlive(false);
+    events.close();
+    connectEvents();
+  }, keepalive * 2500 + 2000);
+}
+
+function connectEvents() {
+  events = new EventSource("/events" + authQuery());
+  let keepalive = 15;
+  armWatchdog(keepalive);
+  const beat = () => { setAlive(true); armWatchdog(keepalive); };
+  events.addEventListener("heartbeat", (e) => {
+    const state = JSON.parse(e.data);
+    keepalive = state.keepalive || keepalive;
+    beat();
+    checkConfig(state.config);
+  });
+  events.addEventListener("state", beat);
+  events.addEventListener("config", (e) => checkConfig(JSON.parse(e.data).version));
+  events.addEventListener("job", (e) => {
+    beat();
+    const job = JSON.parse(e.data);
+    noteJobTiming(job);
+    if (!myJobs.has(job.id)) return;
+    myJobs.delete(job.id);
+    if (job.status === "failed") showStatus("Injection failed");
+  });
+  events.onerror = () => setAlive(false);
+}
+
+if ("EventSource" in window) {
+  connectEvents();
+} else {
+  setInterval(async () => {
+    try {
+      const r = await fetch("/ping", {signal: AbortSignal.timeout(3000)});
+      setAlive(r.ok);
+    } catch(e) {
+      setAlive(false);
+    }
+  }, 1000);
+}
 
 if ("serviceWorker" in navigator) {
   navigator.serviceWorker.register("/sw.js");
 }
-</script>
-</body>
-</html>
+
+/* --- Config reload ---
+ * Heartbeats carry the server's config version, and a "config" event
+ * announces a change. The new service worker precaches the new page and
+ * config, then the page reloads itself once the text box is empty, so
+ * nothing typed is lost. */
+let configVersion = null;
+let reloadWanted = false;
+
+function checkConfig(version) {
+  if (!version) return;
+  if (configVersion === null) configVersion = version;
+  if (version === configVersion || reloadWanted) return;
+  configVersion = version;
+  const sw = navigator.serviceWorker;
+  const installed = sw && sw.controller
+    ? new Promise(resolve => {
+        sw.addEventListener("controllerchange", resolve, {once: true});
+        setTimeout(resolve, 5000);
+        sw.getRegistration().then(r => r && r.update()).catch(resolve);
+      })
+    : Promise.resolve();
+  installed.then(() => { reloadWanted = true; reloadWhenIdle(); });
+}
+
+function reloadWhenIdle() {
+  if (!reloadWanted || txt.value || btn.disabled || outboxPending || pending.length) return;
+  location.reload();
+}
 """
 
 
-def get_lan_ip():
-    """Get LAN IP via UDP socket trick (no traffic actually sent)."""
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+SIOCGIFADDR = 0x8915
+VIRTUAL_IFACES = ("docker", "br-", "veth", "virbr", "vmnet", "tun", "tap", "wg")
+
+
+def _default_route_iface():
+    """Name of the interface holding the IPv4 default route, or None."""
     try:
-        s.connect(("8.8.8.8", 80))
-        return s.getsockname()[0]
-    finally:
-        s.close()
+        with open("/proc/net/route") as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if len(fields) > 1 and fields[1] == "00000000":
+                    return fields[0]
+    except (OSError, StopIteration):
+        pass
+    return None
 
 
-def inject_text(text):
-    """Inject text using the chosen method."""
-    if METHOD == "type":
-        subprocess.run(
-            ["ydotool", "type", "--key-delay", "0", "--", text],
-            check=True,
-            timeout=30,
-        )
-    else:
-        subprocess.run(
-            ["wl-copy", "-o", "--", text],
-            stdin=subprocess.DEVNULL,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            check=True,
-            timeout=5,
-        )
-        if AUTO_PASTE:
-            time.sleep(0.1)
-            subprocess.run(
-                ["ydotool", "key", "--delay", "100", "ctrl+v"],
-                check=True,
-                timeout=5,
-            )
+def get_lan_ip():
+    """LAN IPv4 address, read from the local interfaces (no traffic, works offline).
 
+    The default route's interface comes first, virtual bridges and tunnels
+    last. Falls back to 127.0.0.1 when nothing else has an address.
+    """
+    try:
+        names = [name for _, name in socket.if_nameindex() if name != "lo"]
+    except OSError:
+        names = []
+    default = _default_route_iface()
+    names.sort(key=lambda n: (n != default, n.startswith(VIRTUAL_IFACES)))
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        for name in names:
+            try:
+                ifreq = fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack("256s", name.encode()[:15]))
+            except OSError:
+                continue  # down, or no IPv4 address
+            return socket.inet_ntoa(ifreq[20:24])
+    return "127.0.0.1"
 
-def check_token():
-    if USE_TOKEN and request.args.get("token") != TOKEN:
-        abort(403)
 
+QR_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                            "input-from-web")
 
-@app.route("/ping")
-def ping():
-    return {"ok": True}
 
+def render_qr(url, cache=False):
+    """The QR code for url as terminal text.
+
+    With cache, it's rendered once per URL and then read from QR_CACHE_DIR.
+    Only cache URLs without the token in them.
+    """
+    path = os.path.join(QR_CACHE_DIR, hashlib.sha256(url.encode()).hexdigest()[:32] + ".txt")
+    if cache:
+        try:
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            pass
+    qr = qrcode.QRCode(box_size=1, border=1)
+    qr.add_data(url)
+    qr.make(fit=True)
+    out = io.StringIO()
+    qr.print_ascii(out=out, invert=True)
+    text = out.getvalue()
+    if cache:
+        try:
+            os.makedirs(QR_CACHE_DIR, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=QR_CACHE_DIR,
+                                             delete=False) as f:
+                f.write(text)
+            os.replace(f.name, path)
+        except OSError:
+            pass  # just slower next time
+    return text
+
+
+def _process_age():
+    """Seconds since this process started, from /proc; None where unavailable."""
+    try:
+        with open("/proc/self/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class StartupTrace:
+    """Time spent in each phase of startup, printed with --startup-trace."""
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        now = time.perf_counter()
+        age = _process_age()
+        self.phases = []
+        if age is not None:
+            # /proc counts in clock ticks, so this one is only good to ~10 ms.
+            self.phases.append(("interpreter + stdlib", max(0.0, age - (now - _STARTED))))
+        self.phases.append(("module", now - _STARTED))
+        self.last = now
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        if not self.enabled:
+            return
+        print("  Startup trace:")
+        for phase, seconds in self.phases:
+            print(f"    {phase:22} {seconds * 1000:8.1f} ms")
+        total = sum(seconds for _, seconds in self.phases)
+        print(f"    {'total':22} {total * 1000:8.1f} ms")
+        print()
+
+
+# --- Metrics ---
+#
+# Prometheus text format on /metrics, without the client library. Every
+# series is created on first use and then only updated in place, so
+# recording a sample costs a lock and a few additions.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Series:
+    """One label combination of a metric: a value, or histogram buckets."""
+
+    __slots__ = ("lock", "value", "counts", "sum", "buckets")
+
+    def __init__(self, buckets):
+        self.lock = threading.Lock()
+        self.value = 0.0
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) if buckets else None  # last is +Inf
+        self.sum = 0.0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class Metric:
+    """A counter, gauge or histogram, optionally with labels.
+
+    A gauge can be given a function instead, read at scrape time.
+    """
+
+    def __init__(self, kind, name, help, labels=(), buckets=None, func=None):
+        self.kind = kind
+        self.name = "input_from_web_" + name
+        self.help = help
+        self.label_names = labels
+        self.buckets = buckets if kind == "histogram" else None
+        self.func = func
+        self.series = {}
+        self.lock = threading.Lock()
+        if not labels and func is None:
+            self.labels()  # exported as 0 before the first update
+        METRICS.append(self)
+
+    def labels(self, *values):
+        series = self.series.get(values)
+        if series is None:
+            with self.lock:
+                series = self.series.setdefault(values, _Series(self.buckets))
+        return series
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if self.func is not None:
+            lines.append(f"{self.name} {self.func()}")
+        for values, series in list(self.series.items()):
+            pairs = [f'{k}="{v}"' for k, v in zip(self.label_names, values)]
+            if self.buckets is None:
+                lines.append(f"{self.name}{_label_set(pairs)} {series.value:g}")
+                continue
+            with series.lock:
+                counts, total = list(series.counts), series.sum
+            running = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                running += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket_pairs = pairs + [f'le="{le}"']
+                lines.append(f"{self.name}_bucket{_label_set(bucket_pairs)} {running}")
+            lines.append(f"{self.name}_sum{_label_set(pairs)} {total:g}")
+            lines.append(f"{self.name}_count{_label_set(pairs)} {running}")
+        return "\n".join(lines)
+
+
+def _label_set(pairs):
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+METRICS = []
+
+INJECT_SECONDS = Metric("histogram", "inject_seconds", "Time to inject one text or paste.",
+                        ("method",), LATENCY_BUCKETS)
+SUBPROCESS_SECONDS = Metric("histogram", "subprocess_seconds",
+                            "ydotool / wl-copy runs, from spawn to exit.",
+                            ("command",), LATENCY_BUCKETS)
+INJECTED_CHARS = Metric("counter", "injected_chars_total", "Characters injected.", ("method",))
+INJECTED_MESSAGES = Metric("counter", "injected_messages_total",
+                           "Sends, stream pushes and pastes injected.", ("method",))
+INJECT_FAILURES = Metric("counter", "inject_failures_total", "Failed injections.", ("reason",))
+REQUEST_SECONDS = Metric("histogram", "request_seconds",
+                         "Time to produce a response, per route.", ("route",), LATENCY_BUCKETS)
+STREAM_CLIENTS = Metric("gauge", "stream_clients", "Open live streaming connections.")
+RELAY_SECONDS = Metric("histogram", "relay_seconds",
+                       "Time to forward a send to a relay peer, retries included.",
+                       ("peer",), LATENCY_BUCKETS)
+RELAY_FAILURES = Metric("counter", "relay_failures_total",
+                        "Sends a relay peer did not accept.", ("peer",))
+TYPING_RATE = Metric("gauge", "chars_per_second",
+                     "Effective characters per second of the last injection.")
+ADMISSION_REJECTED = Metric("counter", "rejected_total",
+                            "Requests turned away with 429, by reason.", ("reason",))
+BAD_TOKENS = Metric("counter", "bad_tokens_total", "Requests with a wrong token.")
+Metric("gauge", "locked_out_addresses", "Addresses locked out for bad tokens.",
+       func=lambda: len(ADMISSION.lockout.locked()))
+Metric("gauge", "event_clients", "Pages connected to /events.", func=lambda: HUB.count())
+Metric("gauge", "queue_depth", "Jobs waiting for the injection worker.",
+       func=lambda: QUEUE.depth())
+
+
+def run_tool(args, **kwargs):
+    """subprocess.run(), timed into the subprocess_seconds metric."""
+    t0 = time.perf_counter()
+    try:
+        return subprocess.run(args, **kwargs)
+    finally:
+        SUBPROCESS_SECONDS.labels(args[0]).observe(time.perf_counter() - t0)
+
+
+def failure_reason(exc):
+    """Short label for why an injection failed."""
+    if isinstance(exc, subprocess.TimeoutExpired):
+        return "timeout"
+    if isinstance(exc, subprocess.CalledProcessError):
+        return "exit_status"
+    if isinstance(exc, OSError):
+        return "os_error"
+    return "other"
+
+
+# Stage timings of one /send and the injection behind it, for the
+# Server-Timing header and the page's latency display.
+
+_STAGES = threading.local()  # .timings: Timings of the job being injected
+
+
+class Timings:
+    """Named stage durations, in milliseconds, in the order they happened."""
+
+    def __init__(self):
+        self.stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, (time.perf_counter() - t0) * 1000))
+
+    def add(self, name, ms):
+        self.stages.append((name, ms))
+
+    def to_dict(self):
+        out = {}
+        for name, ms in self.stages:
+            out[name] = round(out.get(name, 0) + ms, 2)
+        return out
+
+    def header(self):
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.to_dict().items())
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time a step of the injection in progress, if the worker is timing one."""
+    timings = getattr(_STAGES, "timings", None)
+    if timings is None:
+        yield
+        return
+    with timings.stage(name):
+        yield
+
+
+# --- Key injection ---
+#
+# ydotool itself is only a thin client: it translates text into Linux input
+# events and hands them to ydotoold over a unix socket. Spawning it for every
+# send costs a fork/exec, a socket connect and a keymap build each time, so the
+# resident injector keeps the connection open and writes the events itself.
+# Two daemon protocols exist in the wild:
+#   ydotool >= 1.0  SOCK_DGRAM, one struct input_event per datagram
+#   ydotool 0.1.x   SOCK_STREAM, packed {u16 type, u16 code, s32 value} records
+
+YDOTOOL_SOCKET = os.environ.get("YDOTOOL_SOCKET", "/tmp/.ydotool_socket")
+
+EV_SYN = 0
+EV_KEY = 1
+SYN_REPORT = 0
+
+_INPUT_EVENT = struct.Struct("llHHi")   # struct input_event (timeval + type, code, value)
+_RAW_EVENT = struct.Struct("HHi")       # ydotool 0.1.x uInputRawData
+
+KEY_CODES = {
+    "esc": 1, "minus": 12, "equal": 13, "backspace": 14, "tab": 15,
+    "leftbrace": 26, "rightbrace": 27, "enter": 28, "ctrl": 29,
+    "semicolon": 39, "apostrophe": 40, "grave": 41, "shift": 42,
+    "backslash": 43, "comma": 51, "dot": 52, "slash": 53, "rightshift": 54,
+    "alt": 56, "space": 57, "capslock": 58,
+    "f1": 59, "f2": 60, "f3": 61, "f4": 62, "f5": 63, "f6": 64,
+    "f7": 65, "f8": 66, "f9": 67, "f10": 68, "f11": 87, "f12": 88,
+    "rightctrl": 97, "rightalt": 100, "home": 102, "up": 103, "pageup": 104,
+    "left": 105, "right": 106, "end": 107, "down": 108, "pagedown": 109,
+    "insert": 110, "delete": 111, "super": 125,
+}
+KEY_CODES.update(zip("1234567890", range(2, 12)))
+KEY_CODES.update(zip("qwertyuiop", range(16, 26)))
+KEY_CODES.update(zip("asdfghjkl", range(30, 39)))
+KEY_CODES.update(zip("zxcvbnm", range(44, 51)))
+KEY_ALIASES = {
+    "control": "ctrl", "leftctrl": "ctrl", "leftshift": "shift",
+    "leftalt": "alt", "meta": "super", "win": "super", "return": "enter",
+    "escape": "esc", "del": "delete", "pgup": "pageup", "pgdn": "pagedown",
+}
+
+
+def _build_keymap():
+    """Map each typable character to (keycode, needs_shift) for a US layout."""
+    keymap = {" ": (57, False), "\n": (28, False), "\t": (15, False)}
+    for c in "abcdefghijklmnopqrstuvwxyz":
+        keymap[c] = (KEY_CODES[c], False)
+        keymap[c.upper()] = (KEY_CODES[c], True)
+    for plain, shifted, name in zip("1234567890-=[];'`\\,./",
+                                    "!@#$%^&*()_+{}:\"~|<>?",
+                                    list("1234567890") + [
+                                        "minus", "equal", "leftbrace", "rightbrace",
+                                        "semicolon", "apostrophe", "grave",
+                                        "backslash", "comma", "dot", "slash"]):
+        keymap[plain] = (KEY_CODES[name], False)
+        keymap[shifted] = (KEY_CODES[name], True)
+    return keymap
+
+
+KEYMAP = _build_keymap()
+
+
+def parse_chord(chord):
+    """Turn 'ctrl+shift+t' into a list of keycodes, modifiers first."""
+    codes = []
+    for name in chord.lower().split("+"):
+        name = KEY_ALIASES.get(name.strip(), name.strip())
+        if name not in KEY_CODES:
+            raise ValueError(f"unknown key: {name!r}")
+        codes.append(KEY_CODES[name])
+    return codes
+
+
+class YdotoolSocket:
+    """Persistent connection to ydotoold that writes key events itself."""
+
+    def __init__(self, path=YDOTOOL_SOCKET):
+        self.path = path
+        self.sock = None
+        self.stream = False
+        self._cache = {}  # char -> encoded event bytes (or tuple of datagrams)
+        self.done = 0  # characters / key presses of the last call fully written
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.connect(self.path)
+            self.stream = False
+        except OSError as e:
+            sock.close()
+            if e.errno != errno.EPROTOTYPE:
+                raise
+            # Old ydotoold listens on a stream socket.
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            self.stream = True
+        self.sock = sock
+        self._cache.clear()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _encode(self, events):
+        """Encode (type, code, value) triples for the connected protocol."""
+        if self.stream:
+            return b"".join(_RAW_EVENT.pack(t, c, v) for t, c, v in events)
+        return tuple(_INPUT_EVENT.pack(0, 0, t, c, v) for t, c, v in events)
+
+    def _write(self, data):
+        if self.stream:
+            self.sock.sendall(data)
+        else:
+            for datagram in data:
+                self.sock.send(datagram)
+
+    @staticmethod
+    def _press(codes):
+        """Key events for pressing codes in order and releasing in reverse."""
+        events = []
+        for code in codes:
+            events += [(EV_KEY, code, 1), (EV_SYN, SYN_REPORT, 0)]
+        for code in reversed(codes):
+            events += [(EV_KEY, code, 0), (EV_SYN, SYN_REPORT, 0)]
+        return events
+
+    def _char(self, c):
+        data = self._cache.get(c)
+        if data is None:
+            code, shift = KEYMAP[c]
+            data = self._encode(self._press([KEY_CODES["shift"], code] if shift else [code]))
+            self._cache[c] = data
+        return data
+
+    def type_text(self, text, key_delay=0.0):
+        self.done = 0
+        if self.sock is None:
+            self.connect()
+        # Like `ydotool type`, characters without a key on the layout are skipped.
+        for c in text:
+            if c in KEYMAP:
+                self._write(self._char(c))
+                if key_delay:
+                    time.sleep(key_delay)
+            self.done += 1
+
+    def key(self, chord, count=1):
+        self.done = 0
+        if self.sock is None:
+            self.connect()
+        data = self._encode(self._press(parse_chord(chord)))
+        for _ in range(count):
+            self._write(data)
+            self.done += 1
+
+
+class SubprocessInjector:
+    """Spawns the ydotool CLI for every call."""
+
+    KEY_DELAY_SECONDS = 0.1  # ydotool key --delay, before it presses anything
+    spawns = True  # a process per call, see type_paced()
+
+    def type_text(self, text, key_delay=0.0):
+        run_tool(
+            ["ydotool", "type", "--key-delay", str(round(key_delay * 1000)), "--", text],
+            check=True,
+            timeout=30 + len(text) * key_delay,
+        )
+
+    def key(self, chord, count=1):
+        run_tool(
+            ["ydotool", "key", "--delay", str(int(self.KEY_DELAY_SECONDS * 1000)),
+             *[chord] * count],
+            check=True,
+            timeout=5 + count // 50,
+        )
+
+    def type_chunks(self, chunks):
+        """Type text arriving in pieces through one ydotool reading stdin."""
+        t0 = time.perf_counter()
+        proc = subprocess.Popen(
+            ["ydotool", "type", "--key-delay", "0", "--file", "-"],
+            stdin=subprocess.PIPE,
+        )
+        try:
+            for chunk in chunks:
+                proc.stdin.write(chunk.encode())
+                proc.stdin.flush()
+            proc.stdin.close()
+            if proc.wait() != 0:
+                raise subprocess.CalledProcessError(proc.returncode, proc.args)
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            SUBPROCESS_SECONDS.labels("ydotool").observe(time.perf_counter() - t0)
+
+
+class ResidentInjector:
+    """Writes to ydotoold directly, falling back to the ydotool CLI.
+
+    A failed connection is retried at most every RETRY_SECONDS so a missing
+    daemon doesn't add a connect() attempt to every send.
+    """
+
+    RETRY_SECONDS = 5.0
+
+    def __init__(self, path=YDOTOOL_SOCKET, fallback=None):
+        self.conn = YdotoolSocket(path)
+        self.fallback = fallback
+        self.lock = threading.Lock()
+        self._down_until = 0.0
+
+    def _run(self, op, *args):
+        with self.lock:
+            if time.monotonic() >= self._down_until:
+                try:
+                    return getattr(self.conn, op)(*args)
+                except OSError as e:
+                    self.conn.close()
+                    self._down_until = time.monotonic() + self.RETRY_SECONDS
+                    if self.fallback is None:
+                        raise
+                    print(f"ydotoold socket unavailable ({e}), spawning ydotool instead",
+                          file=sys.stderr)
+                    # Only what didn't reach ydotoold, or the fallback types it twice.
+                    args = self._rest(op, args, self.conn.done)
+                    if args is None:
+                        return None
+            elif self.fallback is None:
+                raise ConnectionError(f"ydotoold socket {self.conn.path} unavailable")
+        return getattr(self.fallback, op)(*args)
+
+    @staticmethod
+    def _rest(op, args, done):
+        """args for the part of op after its first `done` characters / presses, or None."""
+        if op == "type_text":
+            rest = args[0][done:]
+            return (rest, *args[1:]) if rest else None
+        chord, count = args
+        return (chord, count - done) if count > done else None
+
+    @property
+    def spawns(self):
+        """Whether calls go to the spawning fallback for now."""
+        return self.fallback is not None and time.monotonic() < self._down_until
+
+    def type_text(self, text, key_delay=0.0):
+        self._run("type_text", text, key_delay)
+
+    def key(self, chord, count=1):
+        self._run("key", chord, count)
+
+    def type_chunks(self, chunks):
+        for chunk in chunks:
+            self.type_text(chunk)
+
+
+class TypingPacer:
+    """Token bucket pacing keystrokes (profile 'typing').
+
+    Holds up to `burst` tokens, refilled at `rate` per second; each character
+    typed takes one. Unlimited when rate is 0.
+    """
+
+    def __init__(self, rate=0, burst=64, bursts=False, newline_pause=0.0):
+        self.rate = rate
+        self.burst = burst
+        self.bursts = bursts
+        self.newline_pause = newline_pause
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+
+    @property
+    def unlimited(self):
+        return not self.rate and not self.newline_pause
+
+    def _take(self, wanted):
+        """Wait for tokens, then take up to wanted of them. Return how many."""
+        need = min(wanted, self.burst) if self.bursts else 1
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens >= need:
+                break
+            time.sleep((need - self.tokens) / self.rate)
+        n = min(wanted, int(self.tokens))
+        self.tokens -= n
+        return n
+
+    def pace(self, text):
+        """Split text into pieces to type back to back, sleeping in between."""
+        pos = 0
+        while pos < len(text):
+            end = text.find("\n", pos) + 1 or len(text)
+            while pos < end:
+                n = self._take(end - pos) if self.rate else end - pos
+                yield text[pos:pos + n]
+                pos += n
+            if self.newline_pause and text[end - 1] == "\n":
+                time.sleep(self.newline_pause)
+
+    def lines(self, text):
+        """Like pace(), for an injector that spawns a process per call.
+
+        Yields (line, key_delay): each line goes out in one call with its
+        keys key_delay seconds apart, so the rate holds without a process
+        per keystroke. The burst allowance is not used.
+        """
+        key_delay = 1 / self.rate if self.rate else 0.0
+        for line in text.splitlines(keepends=True):
+            yield line, key_delay
+            if self.rate:
+                self.tokens, self.stamp = 0.0, time.monotonic()  # spent at exactly the rate
+            if self.newline_pause and line.endswith("\n"):
+                time.sleep(self.newline_pause)
+
+
+PACER = TypingPacer()  # set from the profile, see apply_profile()
+
+
+def make_injector(kind, path=YDOTOOL_SOCKET):
+    """Build the injector for --injector / profile 'injector'."""
+    if kind == "subprocess":
+        return SubprocessInjector()
+    if kind == "socket":
+        return ResidentInjector(path)
+    return ResidentInjector(path, fallback=SubprocessInjector())
+
+
+def inject_text(text):
+    """Inject text using the chosen method."""
+    if METHOD == "type":
+        with stage("type"):
+            type_paced(text)
+    elif METHOD == "auto":
+        inject_routed(text)
+    else:
+        copy_clipboard(text)
+        if AUTO_PASTE:
+            paste_clipboard()
+
+
+def copy_clipboard(text):
+    with stage("wl_copy"):
+        run_tool(
+            ["wl-copy", "-o", "--", text],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            timeout=5,
+        )
+
+
+def type_paced(text):
+    """Type text at the rate PACER allows."""
+    if PACER.unlimited:
+        INJECTOR.type_text(text)
+        return
+    if getattr(INJECTOR, "spawns", False):
+        # pace() would cost a fork+exec per keystroke; ydotool spaces the keys instead.
+        for line, key_delay in PACER.lines(text):
+            INJECTOR.type_text(line, key_delay)
+        return
+    for piece in PACER.pace(text):
+        INJECTOR.type_text(piece)
+
+
+def paste_clipboard():
+    """Ctrl+V, after giving the compositor time to take the new selection."""
+    with stage("paste_delay"):
+        time.sleep(PASTE_DELAY_SECONDS)
+    with stage("paste_key"):
+        INJECTOR.key("ctrl+v")
+
+
+def inject_stream(chunks):
+    """Like inject_text(), for text arriving in pieces that shouldn't be joined."""
+    if METHOD == "type":
+        with stage("type"):
+            if PACER.unlimited:
+                INJECTOR.type_chunks(chunks)
+            else:
+                for chunk in chunks:
+                    type_paced(chunk)
+        return
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        ["wl-copy", "-o"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        with stage("wl_copy"):
+            for chunk in chunks:
+                proc.stdin.write(chunk.encode())
+            proc.stdin.close()
+            if proc.wait(timeout=5) != 0:
+                raise subprocess.CalledProcessError(proc.returncode, proc.args)
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        SUBPROCESS_SECONDS.labels("wl-copy").observe(time.perf_counter() - t0)
+    if AUTO_PASTE or METHOD == "auto":
+        paste_clipboard()
+
+
+# --- Injection router (method "auto") ---
+#
+# Splits each text into runs the keymap can type and runs it can't, and
+# picks typing or pasting for each run to minimise the estimated time.
+# Runs it can't type must be pasted. Pasting pays a fixed cost each time
+# (wl-copy, the paste delay, Ctrl+V), so neighbouring pastes are merged
+# whenever retyping the short run between them would cost more than a
+# second paste. That also keeps clipboard churn down. The estimates start
+# from a measurement of the tools' fixed costs, taken at startup without
+# typing or pasting anything, and follow the injections actually made.
+
+PASTE_DELAY_SECONDS = 0.1
+ROUTER_SMOOTHING = 0.2  # weight of each new observation in the running estimates
+_UNTYPABLE = re.compile("[^" + re.escape("".join(KEYMAP)) + "]+")
+
+
+class CostModel:
+    """Running estimates of what typing and pasting cost, in seconds."""
+
+    def __init__(self):
+        self.type_call = 0.001  # per typed run
+        self.type_char = 0.0005
+        self.paste_call = 0.12  # wl-copy, PASTE_DELAY_SECONDS and Ctrl+V
+        self.paste_char = 0.000005
+        self.calibrated = False
+        self.lock = threading.Lock()
+
+    def char_cost(self):
+        """Seconds per typed character, the pacer's rate included."""
+        if PACER.unlimited:
+            return self.type_char
+        return max(self.type_char, 1 / PACER.rate)
+
+    def type_cost(self, chars):
+        return self.type_call + chars * self.char_cost()
+
+    def calibrate(self):
+        """Time the fixed cost of each tool once, with calls that inject nothing."""
+        try:
+            t0 = time.perf_counter()
+            INJECTOR.type_text("")
+            type_call = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            run_tool(["wl-copy", "--version"], stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, check=True, timeout=5)
+            copy_call = time.perf_counter() - t0
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"  Router calibration skipped ({e}), using default costs.", file=sys.stderr)
+            return
+        # Ctrl+V goes through the same path as typing, and the ydotool CLI
+        # waits SubprocessInjector.KEY_DELAY_SECONDS before pressing it.
+        key_call = type_call
+        if isinstance(INJECTOR, SubprocessInjector):
+            key_call += SubprocessInjector.KEY_DELAY_SECONDS
+        with self.lock:
+            self.type_call = type_call
+            self.paste_call = copy_call + PASTE_DELAY_SECONDS + key_call
+            self.calibrated = True
+
+    def observe_type(self, chars, seconds):
+        if chars < 16 or not PACER.unlimited:
+            return  # too short to say much, or slowed down on purpose
+        per_char = max(0.0, seconds - self.type_call) / chars
+        with self.lock:
+            self.type_char += ROUTER_SMOOTHING * (per_char - self.type_char)
+
+    def observe_paste(self, chars, seconds):
+        call = max(PASTE_DELAY_SECONDS, seconds - chars * self.paste_char)
+        with self.lock:
+            self.paste_call += ROUTER_SMOOTHING * (call - self.paste_call)
+
+    def to_dict(self):
+        return {
+            "type_call_ms": round(self.type_call * 1000, 3),
+            "type_char_ms": round(self.char_cost() * 1000, 4),
+            "paste_call_ms": round(self.paste_call * 1000, 3),
+            "paste_char_ms": round(self.paste_char * 1000, 5),
+            "calibrated": self.calibrated,
+        }
+
+
+COSTS = CostModel()
+
+
+def route(text, costs=COSTS):
+    """Split text into ("type" | "paste", part) segments, cheapest overall.
+
+    Dynamic programming over the runs, keeping the best cost so far with
+    the latest run typed and with it pasted (so the next run can join that
+    paste for just its characters).
+    """
+    runs = []  # (part, typable)
+    pos = 0
+    for m in _UNTYPABLE.finditer(text):
+        if m.start() > pos:
+            runs.append((text[pos:m.start()], True))
+        runs.append((m.group(), False))
+        pos = m.end()
+    if pos < len(text):
+        runs.append((text[pos:], True))
+    inf = float("inf")
+    typed, pasted = 0.0, inf
+    back = []  # per run: (typed after a paste?, pasted by joining the previous paste?)
+    for part, typable in runs:
+        join = pasted + len(part) * costs.paste_char
+        fresh = typed + costs.paste_call + len(part) * costs.paste_char
+        after_paste = pasted < typed
+        new_typed = min(typed, pasted) + costs.type_cost(len(part)) if typable else inf
+        back.append((after_paste, join <= fresh))
+        typed, pasted = new_typed, min(join, fresh)
+    segments = []
+    state = "type" if typed <= pasted else "paste"
+    for (part, _), (after_paste, joined) in zip(reversed(runs), reversed(back)):
+        if segments and segments[-1][0] == state:
+            segments[-1] = (state, part + segments[-1][1])
+        else:
+            segments.append((state, part))
+        if state == "type":
+            state = "paste" if after_paste else "type"
+        else:
+            state = "paste" if joined else "type"
+    segments.reverse()
+    return segments
+
+
+def inject_routed(text):
+    """Type or paste each segment route() picks, feeding back how long they took."""
+    for method, part in route(text):
+        t0 = time.perf_counter()
+        if method == "type":
+            with stage("type"):
+                type_paced(part)
+            COSTS.observe_type(len(part), time.perf_counter() - t0)
+        else:
+            copy_clipboard(part)
+            paste_clipboard()
+            COSTS.observe_paste(len(part), time.perf_counter() - t0)
+
+
+# --- Push events ---
+#
+# Pages keep one server-sent-events connection open to /events instead of
+# polling /ping. The server pushes a heartbeat with its state every
+# HEARTBEAT_SECONDS, and job/state events as they happen.
+
+class EventHub:
+    """Fan-out of events to every connected /events stream."""
+
+    SUBSCRIBER_BACKLOG = 64
+    MAX_SUBSCRIBERS = 64  # each one holds a server thread
+
+    def __init__(self):
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        """A queue of events to read, or None with MAX_SUBSCRIBERS already reading."""
+        q = queue.Queue(self.SUBSCRIBER_BACKLOG)
+        with self.lock:
+            if len(self.subscribers) >= self.MAX_SUBSCRIBERS:
+                return None
+            self.subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+
+    def count(self):
+        with self.lock:
+            return len(self.subscribers)
+
+    def publish(self, event, data):
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                pass  # a stalled client misses events, it'll get the next heartbeat
+
+
+HUB = EventHub()
+
+
+# --- Admission control ---
+#
+# Cheap checks before a request does any work: a token bucket per address
+# (every request) and per token (requests that present one), a cap on the
+# injection backlog, and a lockout for addresses that keep presenting a
+# wrong token, doubling with every further miss. All of them answer 429
+# with Retry-After, which the page's outbox already backs off on.
+
+ADMISSION_KEYS_KEEP = 4096  # addresses / tokens tracked, least recently seen dropped first
+QUEUE_MAX_JOBS = 256  # set from the profile in main()
+
+
+class RateLimited(Exception):
+    """A request turned away for now. retry_after is in seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"{reason}, retry in {retry_after:.1f} s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class KeyedBuckets:
+    """A token bucket per key, holding up to burst and refilled at rate per second.
+
+    Unlimited when rate is 0.
+    """
+
+    def __init__(self, rate=0, burst=1, keep=ADMISSION_KEYS_KEEP):
+        self.rate = rate
+        self.burst = burst
+        self.keep = keep
+        self.buckets = collections.OrderedDict()  # key -> [tokens, time of last refill]
+        self.lock = threading.Lock()
+
+    def take(self, key):
+        """0 if key may go ahead now, otherwise the seconds until it may."""
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [self.burst, now]
+                if len(self.buckets) > self.keep:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / self.rate
+
+
+class Lockout:
+    """Bad token counts per address, locking it out once they reach `after`.
+
+    The lock lasts 1 s at `after` misses and doubles with each further one,
+    up to max_seconds. A good token clears the count.
+    """
+
+    def __init__(self, after=5, max_seconds=900, keep=ADMISSION_KEYS_KEEP):
+        self.after = after
+        self.max_seconds = max_seconds
+        self.keep = keep
+        self.misses = collections.OrderedDict()  # address -> [count, locked until]
+        self.lock = threading.Lock()
+
+    def remaining(self, addr):
+        """Seconds addr is still locked out for, 0 if it isn't."""
+        entry = self.misses.get(addr)
+        return max(0.0, entry[1] - time.monotonic()) if entry else 0.0
+
+    def failed(self, addr):
+        with self.lock:
+            entry = self.misses.pop(addr, None) or [0, 0.0]
+            self.misses[addr] = entry
+            if len(self.misses) > self.keep:
+                self.misses.popitem(last=False)
+            entry[0] += 1
+            if self.after and entry[0] >= self.after:
+                entry[1] = time.monotonic() + min(self.max_seconds, 2.0 ** (entry[0] - self.after))
+
+    def succeeded(self, addr):
+        if addr in self.misses:
+            with self.lock:
+                self.misses.pop(addr, None)
+
+    def locked(self):
+        now = time.monotonic()
+        with self.lock:
+            return [{"address": addr, "bad_tokens": count, "seconds": round(until - now, 1)}
+                    for addr, (count, until) in self.misses.items() if until > now]
+
+
+class Admission:
+    """The per-address and per-token limits and the bad token lockout."""
+
+    def __init__(self):
+        self.by_addr = KeyedBuckets()
+        self.by_token = KeyedBuckets()
+        self.lockout = Lockout()
+
+    def configure(self, addr_rate, addr_burst, token_rate, token_burst, lockout_after,
+                  lockout_max_seconds):
+        """Apply new limits, keeping the state built up so far."""
+        self.by_addr.rate, self.by_addr.burst = addr_rate, addr_burst
+        self.by_token.rate, self.by_token.burst = token_rate, token_burst
+        self.lockout.after, self.lockout.max_seconds = lockout_after, lockout_max_seconds
+
+    def admit(self, addr):
+        """Raise RateLimited unless a request from addr may go ahead."""
+        wait = self.lockout.remaining(addr)
+        if wait:
+            reject("locked_out", wait)
+        wait = self.by_addr.take(addr)
+        if wait:
+            reject("address_rate", wait)
+
+    def check_token(self, addr, given, expected):
+        """Whether given is the token, in constant time; raises RateLimited over the rate.
+
+        No token at all (a page opened without one) isn't a guess, so it
+        doesn't count towards the lockout.
+        """
+        if not given:
+            return False
+        if not secrets.compare_digest(given.encode(), expected.encode()):
+            self.lockout.failed(addr)
+            BAD_TOKENS.inc()
+            return False
+        self.lockout.succeeded(addr)
+        wait = self.by_token.take(given)
+        if wait:
+            reject("token_rate", wait)
+        return True
+
+    def stats(self):
+        return {
+            "rejected": {values[0]: int(series.value)
+                         for values, series in list(ADMISSION_REJECTED.series.items())},
+            "bad_tokens": int(BAD_TOKENS.labels().value),
+            "locked_out": self.lockout.locked(),
+            "queue": QUEUE.depth(),
+            "queue_max": QUEUE_MAX_JOBS,
+        }
+
+
+def reject(reason, retry_after):
+    ADMISSION_REJECTED.labels(reason).inc()
+    raise RateLimited(reason, retry_after)
+
+
+ADMISSION = Admission()  # configured from the profile, see apply_profile()
+
+
+# --- Injection queue ---
+#
+# All injection goes through one worker thread so that two phones (or a
+# double tap) can never interleave keystrokes. Requests only enqueue a job and
+# return its id; /jobs/<id> reports how it went. Each client has its own
+# queue, and the worker takes turns between them one message (or coalesced
+# batch) at a time, so a busy sender can't starve the others.
+
+JOBS_KEEP = 500  # finished jobs remembered for /jobs/<id>
+SEND_WAIT_SECONDS = 30  # longest a /send with "wait": true is held
+COALESCE_MAX_BATCH = 16  # set from the profile in main()
+COALESCE_WAIT_SECONDS = 0.0
+CLIENTS_KEEP = 64  # idle clients beyond this are forgotten, oldest first
+CLIENT_MAX_INFLIGHT_CHARS = 1 << 20  # set from the profile in main()
+
+
+class Client:
+    """A sender (phone, tablet, script) with its own queue and counters."""
+
+    def __init__(self, client_id, name=None):
+        self.id = client_id
+        self.name = name
+        self.created = time.time()
+        self.last_seen = self.created
+        self.sent = 0       # jobs accepted
+        self.injected = 0   # jobs done
+        self.failed = 0
+        self.chars = 0      # characters injected
+        self.inflight = 0   # characters queued or being injected
+        self.rejected = 0   # sends refused for going over the in-flight limit
+        self.mirror_text = ""  # what mirror mode has typed, as far as it knows
+        self.mirror_cursor = 0
+
+    def to_dict(self, queued=0):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "created": self.created,
+            "last_seen": self.last_seen,
+            "sent": self.sent,
+            "injected": self.injected,
+            "failed": self.failed,
+            "chars": self.chars,
+            "inflight_chars": self.inflight,
+            "rejected": self.rejected,
+            "queued": queued,
+        }
+
+
+class ClientRegistry:
+    """Known clients by id, most recently seen last."""
+
+    def __init__(self, keep=CLIENTS_KEEP):
+        self.keep = keep
+        self.clients = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def register(self, name=None):
+        """Issue a new client id."""
+        return self.get(secrets.token_urlsafe(12), name)
+
+    def get(self, client_id, name=None):
+        """The client with this id, created on first sight."""
+        with self.lock:
+            client = self.clients.get(client_id)
+            if client is None:
+                client = self.clients[client_id] = Client(client_id, name)
+                for old in list(self.clients.values()):
+                    if len(self.clients) <= self.keep:
+                        break
+                    if not old.inflight and old is not client:
+                        del self.clients[old.id]
+            else:
+                self.clients.move_to_end(client_id)
+                client.last_seen = time.time()
+                if name:
+                    client.name = name
+            return client
+
+    def all(self):
+        with self.lock:
+            return list(self.clients.values())
+
+
+CLIENTS = ClientRegistry()
+
+
+class ClientBusy(Exception):
+    """A client already has CLIENT_MAX_INFLIGHT_CHARS queued."""
+
+    def __init__(self, client):
+        super().__init__(f"client {client.id} has {client.inflight} characters in flight")
+        self.client = client
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """One unit of work for the injection worker."""
+
+    def __init__(self, text, client=None):
+        self.id = secrets.token_urlsafe(8)
+        self.text = text
+        self.chars = len(text)
+        self.progress = 0
+        self.status = "queued"  # queued -> typing -> done | failed | cancelled
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = threading.Event()
+        self.done = threading.Event()
+        self.batch = 1  # jobs injected together with this one, itself included
+        self.timings = None  # Timings of the injection, shared by the batch
+        self.chars_per_second = None  # effective rate of the injection it went out in
+        self.client = client  # Client that sent it, "local" if none was given
+
+    def run(self):
+        inject_text(self.text)
+        self.progress = self.chars
+
+    def coalescable(self):
+        """Whether the worker may join this job's text with its neighbours'."""
+        return type(self) is Job and not self.cancel_requested.is_set()
+
+    def cancel(self):
+        """Skip the job if still queued, or stop it at the next chunk."""
+        self.cancel_requested.set()
+
+    def close(self):
+        """Release anything the job holds once it's finished."""
+
+    def to_dict(self):
+        def ms(a, b):
+            return round((b - a) * 1000, 1) if a and b else None
+        return {
+            "id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "chars": self.chars,
+            "progress": self.progress,
+            "created": self.created,
+            "queued_ms": ms(self.created, self.started or time.time()),
+            "inject_ms": ms(self.started, self.finished),
+            "batch": self.batch,
+            "client": self.client.id if self.client else None,
+            "chars_per_second": self.chars_per_second,
+            "stages": self.timings.to_dict() if self.timings else {},
+        }
+
+
+class InjectionQueue:
+    """Per-client FIFOs of jobs, drained in turns by a single worker thread."""
+
+    def __init__(self, keep=JOBS_KEEP):
+        self.keep = keep
+        self.pending = collections.OrderedDict()  # client id -> deque of jobs, next turn first
+        self.jobs = collections.OrderedDict()  # id -> Job, oldest first
+        self.cond = threading.Condition()
+        self.worker = None
+        self.last = None  # outcome of the most recent job, for state events
+        self.keys = collections.OrderedDict()  # Idempotency-Key -> Job
+
+    def submit(self, job, key=None):
+        """Queue job. A key seen before returns the earlier job instead.
+
+        Raises ClientBusy when the client already has too much in flight
+        (a job bigger than the limit is still taken when nothing else is),
+        and RateLimited when QUEUE_MAX_JOBS are waiting.
+        """
+        if job.client is None:
+            job.client = CLIENTS.get("local")
+        client = job.client
+        with self.cond:
+            if key is not None and key in self.keys:
+                job.close()
+                return self.keys[key]
+            if client.inflight and client.inflight + job.chars > CLIENT_MAX_INFLIGHT_CHARS:
+                client.rejected += 1
+                job.close()
+                ADMISSION_REJECTED.labels("client_busy").inc()
+                raise ClientBusy(client)
+            if sum(len(jobs) for jobs in self.pending.values()) >= QUEUE_MAX_JOBS:
+                client.rejected += 1
+                job.close()
+                reject("queue_full", 1.0)
+            if key is not None:
+                self.keys[key] = job
+                while len(self.keys) > self.keep:
+                    self.keys.popitem(last=False)
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._work, name="injector", daemon=True)
+                self.worker.start()
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.keep:
+                oldest = next(iter(self.jobs.values()))
+                if not oldest.done.is_set():
+                    break
+                self.jobs.popitem(last=False)
+            client.sent += 1
+            client.inflight += job.chars
+            self.pending.setdefault(client.id, collections.deque()).append(job)
+            self.cond.notify()
+        HUB.publish("state", self.state())
+        return job
+
+    def get(self, job_id):
+        with self.cond:
+            return self.jobs.get(job_id)
+
+    def forget(self, key, job):
+        """Drop key if it still names job, so a retry after a failure runs again."""
+        with self.cond:
+            if self.keys.get(key) is job:
+                del self.keys[key]
+
+    def depth(self):
+        with self.cond:
+            return sum(len(jobs) for jobs in self.pending.values())
+
+    def client_stats(self):
+        with self.cond:
+            queued = {client_id: len(jobs) for client_id, jobs in self.pending.items()}
+            return [c.to_dict(queued.get(c.id, 0)) for c in CLIENTS.all()]
+
+    def state(self):
+        return {"queue": self.depth(), "last": self.last}
+
+    def _next_batch(self):
+        """Wait for the next client's turn. Return its next job, plus any
+        text jobs it queued right behind it."""
+        with self.cond:
+            while not self.pending:
+                self.cond.wait()
+            client_id, jobs = next(iter(self.pending.items()))
+            batch = [jobs.popleft()]
+            if batch[0].coalescable():
+                deadline = time.monotonic() + COALESCE_WAIT_SECONDS
+                while len(batch) < COALESCE_MAX_BATCH:
+                    if jobs:
+                        if not jobs[0].coalescable():
+                            break
+                        batch.append(jobs.popleft())
+                        continue
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or len(self.pending) > 1:
+                        break  # don't hold other clients up for it
+                    self.cond.wait(remaining)
+            # Round robin: back of the line, or out of it when nothing is left.
+            if jobs:
+                self.pending.move_to_end(client_id)
+            else:
+                del self.pending[client_id]
+        return batch
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+            started = time.time()
+            t0 = time.perf_counter()
+            timings = _STAGES.timings = Timings()
+            for job in batch:
+                job.status = "typing"
+                job.started = started
+                job.batch = len(batch)
+                job.timings = timings
+            try:
+                if len(batch) > 1:
+                    # One injection for the lot: one wl-copy and paste instead
+                    # of one per message.
+                    inject_text("".join(job.text for job in batch))
+                    for job in batch:
+                        job.progress = job.chars
+                else:
+                    if batch[0].cancel_requested.is_set():
+                        raise JobCancelled()
+                    batch[0].run()
+                status, error = "done", None
+            except JobCancelled:
+                status, error = "cancelled", None
+            except Exception as e:
+                print(f"Injection failed: {e}", file=sys.stderr)
+                status, error = "failed", "injection failed"
+                INJECT_FAILURES.labels(failure_reason(e)).inc()
+            _STAGES.timings = None
+            INJECT_SECONDS.labels(METHOD).observe(time.perf_counter() - t0)
+            finished = time.time()
+            if status == "done":
+                chars = sum(job.chars for job in batch)
+                INJECTED_MESSAGES.labels(METHOD).inc(len(batch))
+                INJECTED_CHARS.labels(METHOD).inc(chars)
+                rate = round(chars / max(finished - started, 1e-6), 1)
+                TYPING_RATE.set(rate)
+                for job in batch:
+                    job.chars_per_second = rate
+            with self.cond:
+                for job in batch:
+                    job.client.inflight -= job.chars
+                    if status == "done":
+                        job.client.injected += 1
+                        job.client.chars += job.chars
+                    elif status == "failed":
+                        job.client.failed += 1
+            for job in batch:
+                job.close()
+                job.status = status
+                job.error = error
+                job.finished = finished
+                job.done.set()
+                HUB.publish("job", job.to_dict())
+            self.last = {"job": batch[-1].id, "status": status, "at": finished}
+            HUB.publish("state", self.state())
+
+
+# --- Large pastes ---
+#
+# /paste takes a raw (optionally gzip/deflate compressed) body and spools it to
+# a temporary file block by block, so neither the request nor the job ever
+# holds the whole text. The worker then feeds it to the injector in bounded
+# chunks through stdin or the ydotoold socket instead of argv.
+
+PASTE_READ_BYTES = 64 * 1024
+PASTE_CHUNK_CHARS = 2048
+PASTE_SPOOL_CHARS = 1 << 20  # kept in memory below this, on disk above
+PASTE_MAX_CHARS = 64 << 20
+
+
+class PasteTooLarge(Exception):
+    pass
+
+
+def spool_body(stream, encoding, out):
+    """Decode a request body into the text file out. Return the char count."""
+    inflate = None
+    if encoding == "gzip":
+        inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == "deflate":
+        inflate = zlib.decompressobj()
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    chars = 0
+
+    def write(data, final=False):
+        nonlocal chars
+        text = decoder.decode(data, final)
+        chars += len(text)
+        if chars > PASTE_MAX_CHARS:
+            raise PasteTooLarge()
+        out.write(text)
+
+    while True:
+        block = stream.read(PASTE_READ_BYTES)
+        if inflate is None:
+            write(block, final=not block)
+        else:
+            # Cap each step's output so a small compressed body can't balloon.
+            data = inflate.decompress(block, PASTE_READ_BYTES)
+            write(data)
+            while inflate.unconsumed_tail:
+                write(inflate.decompress(inflate.unconsumed_tail, PASTE_READ_BYTES))
+            if not block:
+                write(inflate.flush(), final=True)
+        if not block:
+            return chars
+
+
+class PasteJob(Job):
+    """Injects a spooled paste chunk by chunk, reporting progress."""
+
+    def __init__(self, source, chars, client=None):
+        super().__init__("", client)
+        self.source = source
+        self.chars = chars
+
+    def chunks(self):
+        self.source.seek(0)
+        while True:
+            if self.cancel_requested.is_set():
+                raise JobCancelled()
+            chunk = self.source.read(PASTE_CHUNK_CHARS)
+            if not chunk:
+                return
+            yield chunk
+            # Resumed: the injector has taken the previous chunk.
+            self.progress += len(chunk)
+
+    def run(self):
+        inject_stream(self.chunks())
+
+    def close(self):
+        self.source.close()
+
+
+QUEUE = InjectionQueue()
+
+
+# --- Mirror mode ---
+#
+# The page sends its whole text, and the server types only the difference
+# from what it typed for that client last time: a move of the cursor to
+# each changed span (Left / Right), BackSpaces for what went away, and the
+# new text. Spans are edited right to left, so earlier offsets stay valid.
+# This assumes nothing else edits that field, or moves its cursor, in
+# between; "reset" starts over from an empty record.
+
+MIRROR_MAX_EDITS = 256  # past this many, the whole changed stretch is retyped
+MIRROR_JUMPS = True  # set from the profile in main()
+
+
+def diff_hunks(old, new):
+    """Edits turning old into new, as (start, end, replacement) spans of old.
+
+    The common prefix and suffix are cut off first, which is all a typical
+    correction needs; the rest goes through Myers' O((N+M)D) diff.
+    """
+    start, limit = 0, min(len(old), len(new))
+    while start < limit and old[start] == new[start]:
+        start += 1
+    end_old, end_new = len(old), len(new)
+    while end_old > start and end_new > start and old[end_old - 1] == new[end_new - 1]:
+        end_old -= 1
+        end_new -= 1
+    a, b = old[start:end_old], new[start:end_new]
+    if not a or not b:
+        return [(start, end_old, b)] if a or b else []
+    hunks = _myers(a, b, MIRROR_MAX_EDITS)
+    if hunks is None:
+        return [(start, end_old, b)]
+    return [(start + s, start + e, text) for s, e, text in hunks]
+
+
+def _myers(a, b, max_edits):
+    """Shortest edit script from a to b as hunks, or None if over max_edits."""
+    n, m = len(a), len(b)
+    v = {1: 0}
+    trace = []
+    for d in range(max_edits + 1):
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]  # down: insert b[y - 1]
+            else:
+                x = v[k - 1] + 1  # right: delete a[x - 1]
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return _hunks(b, trace, n, m)
+    return None
+
+
+def _hunks(b, trace, x, y):
+    """Walk the Myers trace back from (x, y) and group the edits into hunks."""
+    edits = []  # (position in a, character to insert or None to delete)
+    for d in range(len(trace) - 1, 0, -1):
+        v = trace[d]
+        k = x - y
+        prev_k = k + 1 if k == -d or (k != d and v[k - 1] < v[k + 1]) else k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+        edits.append((prev_x, b[prev_y]) if x == prev_x else (prev_x, None))
+        x, y = prev_x, prev_y
+    hunks = []
+    for pos, char in reversed(edits):
+        if hunks and hunks[-1][1] == pos:
+            start, end, text = hunks[-1]
+        else:
+            start = end = pos
+            text = ""
+            hunks.append(None)
+        if char is None:
+            end += 1
+        else:
+            text += char
+        hunks[-1] = (start, end, text)
+    return hunks
+
+
+def edit_keys(hunks, cursor, length, jumps=True):
+    """Steps applying hunks to a field of length chars, and where the cursor ends up.
+
+    Steps are ("key", name, count) and ("type", text). With jumps, the
+    cursor may also go via Ctrl+Home or Ctrl+End when that is fewer keys.
+    """
+    steps = []
+    for start, end, text in reversed(hunks):
+        moves = [(abs(cursor - end), "", "left" if end < cursor else "right")]
+        if jumps:
+            moves += [(1 + end, "ctrl+home", "right"), (1 + length - end, "ctrl+end", "left")]
+        count, jump, arrow = min(moves)
+        if jump:
+            steps.append(("key", jump, 1))
+        if count - bool(jump):
+            steps.append(("key", arrow, count - bool(jump)))
+        if end > start:
+            steps.append(("key", "backspace", end - start))
+        if text:
+            steps.append(("type", text))
+        cursor = start + len(text)
+        length += len(text) - (end - start)
+    return steps, cursor
+
+
+class MirrorJob(Job):
+    """Makes the field the client mirrors into hold exactly its text."""
+
+    def __init__(self, text, client=None, reset=False):
+        super().__init__(text, client)
+        self.reset = reset
+        self.keystrokes = None
+
+    def run(self):
+        client = self.client
+        if self.reset:
+            client.mirror_text, client.mirror_cursor = "", 0
+        # Characters without a key are skipped when typed, so leave them out
+        # of the record too.
+        target = "".join(c for c in self.text if c in KEYMAP)
+        with stage("diff"):
+            steps, cursor = edit_keys(diff_hunks(client.mirror_text, target),
+                                      client.mirror_cursor, len(client.mirror_text),
+                                      MIRROR_JUMPS)
+        try:
+            with stage("type"):
+                for step in steps:
+                    if step[0] == "type":
+                        type_paced(step[1])
+                    else:
+                        INJECTOR.key(step[1], step[2])
+        except BaseException:
+            # The field is in some state in between; retype from scratch next time.
+            client.mirror_text, client.mirror_cursor = "", 0
+            raise
+        client.mirror_text, client.mirror_cursor = target, cursor
+        self.keystrokes = sum(len(step[1]) if step[0] == "type" else step[2] for step in steps)
+        self.progress = self.chars
+
+    def to_dict(self):
+        d = super().to_dict()
+        d["keystrokes"] = self.keystrokes
+        return d
+
+
+# --- Macros ---
+#
+# A macro is a list of steps run as one job, so a multi-step action (type a
+# command and press Enter, fill a form field and Tab on) is one request, one
+# queue slot and one ack, with nothing else typed in between. Steps:
+#
+#   {"text": "..."}               typed (routed, with method "auto")
+#   {"key": "ctrl+a", "count": 1} a key or chord, pressed count times
+#   {"wait_ms": 200}              a pause, e.g. for a dialog to open
+#   {"paste": "..."}              put on the clipboard and pasted with Ctrl+V
+#   {"input": true}               the "input" text sent along with the request
+#
+# Named macros come from the profile's "macros" section, and the page shows
+# a button for each.
+
+MACRO_MAX_STEPS = 100
+MACRO_MAX_COUNT = 100  # presses of one key step
+MACRO_MAX_WAIT_SECONDS = 10.0  # over all wait steps of a macro
+
+
+def parse_macro(steps):
+    """Check a macro's steps and turn them into tuples for MacroJob.
+
+    Runs of the same key are merged into one step. Raises ValueError.
+    """
+    if not isinstance(steps, list) or not steps:
+        raise ValueError("steps must be a non-empty list")
+    if len(steps) > MACRO_MAX_STEPS:
+        raise ValueError(f"at most {MACRO_MAX_STEPS} steps")
+    parsed = []
+    waited = 0.0
+    for i, step in enumerate(steps):
+        kinds = [k for k in ("text", "key", "wait_ms", "paste", "input") if k in step] \
+            if isinstance(step, dict) else []
+        if len(kinds) != 1:
+            raise ValueError(f"step {i + 1}: needs exactly one of text, key, wait_ms, paste, input")
+        kind, value = kinds[0], step[kinds[0]]
+        if kind in ("text", "paste"):
+            if not isinstance(value, str):
+                raise ValueError(f"step {i + 1}: {kind} must be a string")
+            if value:
+                parsed.append((kind, value))
+        elif kind == "key":
+            count = step.get("count", 1)
+            if not isinstance(value, str):
+                raise ValueError(f"step {i + 1}: key must be a string")
+            if not isinstance(count, int) or isinstance(count, bool) \
+                    or not 1 <= count <= MACRO_MAX_COUNT:
+                raise ValueError(f"step {i + 1}: count must be 1-{MACRO_MAX_COUNT}")
+            try:
+                parse_chord(value)
+            except ValueError as e:
+                raise ValueError(f"step {i + 1}: {e}") from None
+            if parsed and parsed[-1][:2] == ("key", value):
+                count += parsed.pop()[2]
+            parsed.append(("key", value, count))
+        elif kind == "wait_ms":
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise ValueError(f"step {i + 1}: wait_ms must be 0 or more")
+            waited += value / 1000
+            if waited > MACRO_MAX_WAIT_SECONDS:
+                raise ValueError(f"waits add up to more than {MACRO_MAX_WAIT_SECONDS:g} s")
+            parsed.append(("wait", value / 1000))
+        else:
+            if value is not True:
+                raise ValueError(f"step {i + 1}: input must be true")
+            parsed.append(("input",))
+    return parsed
+
+
+class MacroJob(Job):
+    """Runs a parsed macro's steps in order, stopping early if cancelled."""
+
+    def __init__(self, steps, client=None, input_text="", name=None):
+        steps = [("text", input_text) if step == ("input",) else step
+                 for step in steps if step != ("input",) or input_text]
+        super().__init__(input_text, client)
+        self.steps = steps
+        self.name = name
+        self.chars = sum(len(step[1]) for step in steps if step[0] in ("text", "paste"))
+        self.step = 0  # steps finished
+
+    def run(self):
+        for step in self.steps:
+            if self.cancel_requested.is_set():
+                raise JobCancelled()
+            kind = step[0]
+            if kind == "text":
+                if METHOD == "auto":
+                    inject_routed(step[1])
+                else:
+                    with stage("type"):
+                        type_paced(step[1])
+            elif kind == "paste":
+                copy_clipboard(step[1])
+                paste_clipboard()
+            elif kind == "key":
+                with stage("key"):
+                    INJECTOR.key(step[1], step[2])
+            elif self.cancel_requested.wait(step[1]):
+                raise JobCancelled()
+            if kind in ("text", "paste"):
+                self.progress += len(step[1])
+            self.step += 1
+
+    def to_dict(self):
+        d = super().to_dict()
+        d["macro"] = self.name
+        d["steps"] = len(self.steps)
+        d["step"] = self.step
+        return d
+
+
+MACROS = {}  # name -> parsed steps, from the profile, see apply_profile()
+
+
+# --- Send history ---
+#
+# Sent texts are appended to a log per profile, one JSON line each, next to
+# an index of 8-byte line offsets, so any page of history is one seek and
+# one read however long the log gets. Entries are numbered from 1 and keep
+# their number; once there are a quarter more than max_entries, or the
+# oldest is past max_age_days, the oldest are dropped by rewriting both
+# files. A crash between the two appends is caught on load and the index
+# rebuilt from the log.
+
+HISTORY_DIR = os.path.join(os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share"),
+                           "input-from-web")
+HISTORY_PAGE_MAX = 200
+HISTORY_AGE_CHECK_SECONDS = 3600
+_OFFSET_SIZE = 8
+
+
+def _private(path, flags):
+    return os.open(path, flags, 0o600)
+
+
+class HistoryLog:
+    """Append-only log of sent texts with an offset index for paging."""
+
+    def __init__(self, path, max_entries=10000, max_age=0):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.max_entries = max_entries
+        self.max_age = max_age  # seconds, 0 for no limit
+        self.lock = threading.Lock()
+        self.offsets = None  # array of line offsets, loaded on first use
+        self.first = 1  # number of the entry at offsets[0]
+        self.size = 0  # bytes in the log
+        self.age_checked = 0.0
+
+    def _load(self):
+        if self.offsets is not None:
+            return
+        try:
+            self.size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            self.size = 0
+        offsets = array.array("Q")
+        try:
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+            offsets.frombytes(data[:len(data) - len(data) % _OFFSET_SIZE])
+            if sys.byteorder != "little":
+                offsets.byteswap()
+        except FileNotFoundError:
+            pass
+        self.offsets = offsets
+        if not self._index_matches():
+            self._rebuild_index()
+        self.first = self._read(0)["id"] if self.offsets else 1
+
+    def _index_matches(self):
+        """Whether the index ends exactly at the last line of the log."""
+        if not self.offsets:
+            return self.size == 0
+        if self.offsets[0] != 0 or self.offsets[-1] >= self.size:
+            return False
+        with open(self.path, "rb") as f:
+            f.seek(self.offsets[-1])
+            tail = f.read()
+        return tail.endswith(b"\n") and tail.count(b"\n") == 1
+
+    def _rebuild_index(self):
+        offsets = array.array("Q")
+        with contextlib.suppress(FileNotFoundError), open(self.path, "rb") as f:
+            pos = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn last write
+                offsets.append(pos)
+                pos += len(line)
+            if pos != self.size:
+                os.truncate(self.path, pos)
+                self.size = pos
+        self.offsets = offsets
+        self._write_index(self.index_path)
+
+    def _write_index(self, path):
+        data = array.array("Q", self.offsets)
+        if sys.byteorder != "little":
+            data.byteswap()
+        with open(path, "wb", opener=_private) as f:
+            f.write(data.tobytes())
+
+    def _read(self, i, f=None):
+        end = self.offsets[i + 1] if i + 1 < len(self.offsets) else self.size
+        if f is None:
+            with open(self.path, "rb") as f:
+                f.seek(self.offsets[i])
+                return json.loads(f.read(end - self.offsets[i]))
+        f.seek(self.offsets[i])
+        return json.loads(f.read(end - self.offsets[i]))
+
+    def append(self, text, client=None):
+        """Add an entry and return its number."""
+        with self.lock:
+            self._load()
+            entry_id = self.first + len(self.offsets)
+            line = json.dumps({"id": entry_id, "time": round(time.time(), 3), "text": text,
+                               "client": client}, ensure_ascii=False) + "\n"
+            data = line.encode()
+            os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+            with open(self.path, "ab", opener=_private) as f:
+                f.write(data)
+            with open(self.index_path, "ab", opener=_private) as f:
+                f.write(self.size.to_bytes(_OFFSET_SIZE, "little"))
+            self.offsets.append(self.size)
+            self.size += len(data)
+            self._retain()
+            return entry_id
+
+    def _retain(self):
+        """Drop entries past the limits, in a batch once it's worth a rewrite."""
+        drop = 0
+        if len(self.offsets) > self.max_entries + self.max_entries // 4:
+            drop = len(self.offsets) - self.max_entries
+        now = time.time()
+        if self.max_age and now - self.age_checked > HISTORY_AGE_CHECK_SECONDS:
+            self.age_checked = now
+            cutoff = now - self.max_age
+            lo, hi = drop, len(self.offsets) - 1  # the newest entry always stays
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._read(mid)["time"] < cutoff:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            drop = lo
+        if drop:
+            self._drop(drop)
+
+    def _drop(self, count):
+        start = self.offsets[count]
+        tmp = self.path + ".tmp"
+        with open(self.path, "rb") as src, open(tmp, "wb", opener=_private) as dst:
+            src.seek(start)
+            while True:
+                block = src.read(1 << 20)
+                if not block:
+                    break
+                dst.write(block)
+        self.offsets = array.array("Q", (o - start for o in self.offsets[count:]))
+        self._write_index(self.index_path + ".tmp")
+        os.replace(tmp, self.path)
+        os.replace(self.index_path + ".tmp", self.index_path)
+        self.size -= start
+        self.first += count
+
+    def page(self, cursor=None, limit=20, query=None, prefix=False):
+        """Entries numbered below cursor, newest first, matching query if given.
+
+        Without a query this reads exactly the entries returned. A search
+        reads back from cursor until it has limit matches; "next" is where
+        to carry on from, None once the oldest entry has been looked at.
+        """
+        limit = max(1, min(limit, HISTORY_PAGE_MAX))
+        with self.lock:
+            self._load()
+            count = len(self.offsets)
+            end = count if cursor is None else max(0, min(cursor - self.first, count))
+            entries = []
+            if end:
+                with open(self.path, "rb") as f:
+                    if query is None:
+                        start = max(0, end - limit)
+                        f.seek(self.offsets[start])
+                        stop = self.offsets[end] if end < count else self.size
+                        lines = f.read(stop - self.offsets[start]).splitlines()
+                        entries = [json.loads(line) for line in reversed(lines)]
+                        end = start
+                    else:
+                        needle = query.casefold()
+                        while end and len(entries) < limit:
+                            end -= 1
+                            entry = self._read(end, f)
+                            text = entry["text"].casefold()
+                            if text.startswith(needle) if prefix else needle in text:
+                                entries.append(entry)
+            return {
+                "entries": entries,
+                "next": self.first + end if end else None,
+                "first": self.first,
+                "last": self.first + count - 1,
+            }
+
+
+HISTORY = None  # HistoryLog of the running profile, see apply_profile()
+
+
+def history_log(profile_name, max_entries, max_age):
+    """The HistoryLog for a profile, reusing the loaded one if it's the same file."""
+    safe = re.sub(r"[^A-Za-z0-9_.-]", "_", profile_name or "default")
+    path = os.path.join(HISTORY_DIR, f"history-{safe}.log")
+    log = HISTORY if HISTORY is not None and HISTORY.path == path else HistoryLog(path)
+    log.max_entries = max_entries
+    log.max_age = max_age
+    return log
+
+
+# --- WebSocket (live streaming mode) ---
+#
+# A minimal RFC 6455 server side, enough for the page's text frames. It runs
+# on the raw connection Werkzeug exposes as environ["werkzeug.socket"], so no
+# extra dependency is needed.
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WS_MAX_MESSAGE = 1 << 20
+
+
+class WebSocketClosed(Exception):
+    pass
+
+
+class WebSocket:
+    def __init__(self, sock):
+        self.sock = sock
+        self.closed = False
+        self.lock = threading.Lock()  # serialises writers
+
+    @classmethod
+    def accept(cls, environ):
+        """Complete the upgrade handshake, or return None if this isn't one."""
+        key = environ.get("HTTP_SEC_WEBSOCKET_KEY")
+        sock = environ.get("werkzeug.socket")
+        if (not key or sock is None
+                or "websocket" not in environ.get("HTTP_UPGRADE", "").lower()):
+            return None
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        sock.sendall((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode())
+        sock.settimeout(None)
+        return cls(sock)
+
+    def _read_exact(self, n):
+        buf = b""
+        while len(buf) < n:
+            chunk = self.sock.recv(n - len(buf))
+            if not chunk:
+                raise WebSocketClosed()
+            buf += chunk
+        return buf
+
+    def _read_frame(self):
+        b0, b1 = self._read_exact(2)
+        length = b1 & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self._read_exact(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self._read_exact(8))[0]
+        if length > WS_MAX_MESSAGE:
+            raise WebSocketClosed()
+        mask = self._read_exact(4) if b1 & 0x80 else None
+        payload = self._read_exact(length)
+        if mask and length:
+            key = (mask * (length // 4 + 1))[:length]
+            payload = (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(length, "big")
+        return b0 & 0x80, b0 & 0x0F, payload
+
+    def _write_frame(self, opcode, payload):
+        n = len(payload)
+        if n < 126:
+            header = struct.pack("!BB", 0x80 | opcode, n)
+        elif n < 1 << 16:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, n)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+        with self.lock:
+            self.sock.sendall(header + payload)
+
+    def receive(self):
+        """Return the next text message, or None once the peer has closed."""
+        parts = []
+        try:
+            while True:
+                fin, opcode, payload = self._read_frame()
+                if opcode == 0x8:  # close
+                    self.close()
+                    return None
+                if opcode == 0x9:  # ping
+                    self._write_frame(0xA, payload)
+                    continue
+                if opcode == 0xA:  # pong
+                    continue
+                parts.append(payload)
+                if sum(map(len, parts)) > WS_MAX_MESSAGE:
+                    raise WebSocketClosed()
+                if fin:
+                    return b"".join(parts).decode("utf-8", "replace")
+        except (WebSocketClosed, OSError):
+            self.closed = True
+            return None
+
+    def send(self, text):
+        if isinstance(text, dict):
+            text = json.dumps(text)
+        self._write_frame(0x1, text.encode())
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._write_frame(0x8, struct.pack("!H", 1000))
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+_Detached = None  # Response subclass, defined by load_flask()
+
+
+# Highest sequence number injected per streaming session. Lets a reconnecting
+# page resend whatever wasn't acked without anything being typed twice.
+STREAM_SESSIONS_MAX = 256
+_stream_sessions = collections.OrderedDict()
+_stream_lock = threading.Lock()
+
+
+def _stream_last(session):
+    with _stream_lock:
+        last = _stream_sessions.setdefault(session, 0)
+        _stream_sessions.move_to_end(session)
+        while len(_stream_sessions) > STREAM_SESSIONS_MAX:
+            _stream_sessions.popitem(last=False)
+        return last
+
+
+def serve_stream(ws, client=None):
+    """Handle one streaming connection.
+
+    Client messages: {"type": "hello", "session": id} once, then
+    {"type": "text", "seq": n, "text": "..."} with n counting up from 1.
+    Each text message is queued like a /send and acked once it has been
+    typed. Server replies: "hello" with the last injected seq, "ack" per injected
+    (or already injected) seq, "resync" when a seq arrives out of order and
+    "error" when injection failed or the send was turned away (the client
+    retries later, after "retry_after" seconds if given).
+    """
+    try:
+        _serve_stream(ws, client)
+    except OSError:
+        pass  # the phone went away mid-reply
+
+
+def _serve_stream(ws, client):
+    session = None
+    while True:
+        raw = ws.receive()
+        if raw is None:
+            return
+        try:
+            msg = json.loads(raw)
+        except ValueError:
+            continue
+        if not isinstance(msg, dict):
+            continue
+        kind = msg.get("type")
+        if kind == "hello":
+            session = str(msg.get("session", ""))[:64] or secrets.token_hex(8)
+            ws.send({"type": "hello", "session": session, "last": _stream_last(session)})
+            continue
+        if kind != "text" or session is None:
+            continue
+        seq = msg.get("seq")
+        if not isinstance(seq, int):
+            continue
+        last = _stream_last(session)
+        if seq <= last:
+            ws.send({"type": "ack", "seq": seq})
+        elif seq != last + 1:
+            ws.send({"type": "resync", "last": last})
+        elif not isinstance(msg.get("text", ""), str):
+            ws.send({"type": "error", "seq": seq, "error": "text must be a string"})
+        else:
+            if msg.get("text"):
+                # Keyed, so a push resent by a reconnected page while the
+                # first copy is still being typed waits on that copy.
+                key = f"stream:{session}:{seq}"
+                try:
+                    job = QUEUE.submit(Job(msg["text"], client), key)
+                except ClientBusy:
+                    ws.send({"type": "error", "seq": seq, "error": "busy"})
+                    continue
+                except RateLimited as e:
+                    ws.send({"type": "error", "seq": seq, "error": e.reason,
+                             "retry_after": max(1, math.ceil(e.retry_after))})
+                    continue
+                job.done.wait()
+                if job.status != "done":
+                    QUEUE.forget(key, job)
+                    ws.send({"type": "error", "seq": seq, "error": job.error})
+                    continue
+            with _stream_lock:
+                _stream_sessions[session] = max(seq, _stream_sessions.get(session, 0))
+            ws.send({"type": "ack", "seq": seq})
+
+
+# --- Relay ---
+#
+# With relay.peers set, each accepted /send is also forwarded to other
+# input-from-web instances, to type the same text on several desktops.
+# Peers are sent to in parallel, each over its own pool of kept-alive
+# connections, and the phone gets one response covering all of them.
+# Forwarded requests carry RELAY_HEADER so a peer never relays them on.
+
+RELAY_HEADER = "X-Input-From-Web-Relay"
+RELAY_IDLE_KEEP = 4  # idle connections kept open per peer
+RELAY_BACKOFF_SECONDS = 0.05  # before the first retry, doubling after
+
+
+class Peer:
+    """Another input-from-web instance, and idle connections to it."""
+
+    def __init__(self, url, timeout, retries):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"peer URL must be http(s)://host:port/, not {url!r}")
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.name = parts.netloc
+        self.path = parts.path.rstrip("/") + "/send"
+        self.token = urllib.parse.parse_qs(parts.query).get("token", [None])[0]
+        self.timeout = timeout
+        self.retries = retries
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        cls = http_client.HTTPSConnection if self.https else http_client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def _post(self, path, body, headers):
+        """(status, headers, body) of one POST, on an idle connection if there is one.
+
+        A kept-alive connection the peer has closed in the meantime fails
+        before any response; that is retried once on a fresh connection.
+        """
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+        fresh = conn is None
+        while True:
+            if conn is None:
+                conn = self._connect()
+            try:
+                conn.request("POST", path, body, headers)
+                response = conn.getresponse()
+                data = response.read()
+                break
+            except (http_client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if fresh:
+                    raise
+                conn, fresh = None, True
+            except BaseException:
+                conn.close()
+                raise
+        if response.will_close:
+            conn.close()
+        else:
+            with self.lock:
+                if len(self.idle) < RELAY_IDLE_KEEP:
+                    self.idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+        return response.status, response.headers, data
+
+    def send(self, text, key, client_id, wait):
+        """Forward one /send. The outcome, as reported back to the phone."""
+        query = {"client": client_id}
+        if self.token:
+            query["token"] = self.token
+        path = self.path + "?" + urllib.parse.urlencode(query)
+        body = json.dumps({"text": text, "wait": wait}).encode()
+        headers = {"Content-Type": "application/json", "Idempotency-Key": key,
+                   RELAY_HEADER: "1"}
+        result = {"peer": self.name, "ok": False}
+        t0 = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(RELAY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+            result["attempts"] = attempt + 1
+            try:
+                status, _, data = self._post(path, body, headers)
+            except (OSError, http_client.HTTPException) as e:
+                result.update(status=None, error=failure_reason(e))
+                continue
+            result["status"] = status
+            try:
+                reply = json.loads(data)
+            except ValueError:
+                reply = {}
+            if 200 <= status < 300:
+                result.update(ok=True, job=reply.get("job"), error=None)
+                break
+            result["error"] = reply.get("error") or f"HTTP {status}"
+            if status < 500 and status != 429:
+                break  # retrying won't change the answer
+        elapsed = time.perf_counter() - t0
+        result["ms"] = round(elapsed * 1000, 1)
+        RELAY_SECONDS.labels(self.name).observe(elapsed)
+        if not result["ok"]:
+            RELAY_FAILURES.labels(self.name).inc()
+        return result
+
+
+class Relay:
+    """The peers a profile forwards to."""
+
+    def __init__(self, urls=(), timeout=2.0, retries=2, local=True):
+        self.peers = [Peer(url, timeout, retries) for url in urls]
+        self.local = local or not self.peers
+
+    def start(self, text, key, client_id, wait):
+        """Start forwarding to every peer. Call the result for their outcomes."""
+        client_id = re.sub(r"[^A-Za-z0-9_-]", "-", client_id)[:64]
+        pending = [_relay_pool().submit(peer.send, text, key, client_id, wait)
+                   for peer in self.peers]
+        return lambda: [f.result() for f in pending]
+
+
+RELAY = Relay()  # set from the profile, see apply_profile()
+
+
+class RelayOnly(Exception):
+    """This instance doesn't type (relay.local is false) and the route can't be relayed."""
+
+
+_relay_executor = None
+_relay_executor_lock = threading.Lock()
+
+
+def _relay_pool():
+    global _relay_executor
+    with _relay_executor_lock:
+        if _relay_executor is None:
+            _relay_executor = futures.ThreadPoolExecutor(max_workers=16,
+                                                         thread_name_prefix="relay")
+        return _relay_executor
+
+
+# --- Substitutions ---
+#
+# The page applies the profile's substitutions as you type. The same rules are
+# available server-side (POST /substitute, or "substitute": true on /send) for
+# scripts and for dictionaries too large to rescan in the browser.
+
+_PHRASE_END = None  # trie key marking the end of a phrase
+_WORD_START = re.compile(r"(?<!\S)\S")
+
+
+def _fold(text):
+    """Lowercase without changing the length (a few characters grow when lowered)."""
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        lowered = "".join(c.lower()[0] for c in text)
+    return lowered
+
+
+class SubstitutionEngine:
+    """Applies a substitution dictionary in one left-to-right pass.
+
+    Matches like the page: case-insensitive, a phrase has to start at the
+    beginning of the text or after whitespace and end at whitespace or the
+    end of the text, and the longest phrase wins. Phrases are compiled once
+    into a character trie; matching is only attempted at word starts, so the
+    cost is linear in the text (times the longest phrase at worst) no matter
+    how many phrases there are.
+    """
+
+    def __init__(self, substitutions):
+        self.root = {}
+        self.size = 0
+        for phrase, replacement in substitutions.items():
+            if not phrase:
+                continue
+            node = self.root
+            for c in _fold(phrase):
+                node = node.setdefault(c, {})
+            if _PHRASE_END not in node:
+                self.size += 1
+            node[_PHRASE_END] = replacement
+
+    def apply(self, text):
+        if not self.root:
+            return text
+        lowered = _fold(text)
+        n = len(text)
+        out = []
+        done = 0  # text[:done] has been copied or replaced
+        for m in _WORD_START.finditer(lowered):
+            i = m.start()
+            if i < done or lowered[i] not in self.root:
+                continue
+            node = self.root
+            match = None
+            j = i
+            while j < n:
+                node = node.get(lowered[j])
+                if node is None:
+                    break
+                j += 1
+                if _PHRASE_END in node and (j == n or lowered[j].isspace()):
+                    match = j, node[_PHRASE_END]
+            if match:
+                out.append(text[done:i])
+                out.append(match[1])
+                done = match[0]
+        out.append(text[done:])
+        return "".join(out)
+
+
+SUBSTITUTIONS = None  # SubstitutionEngine for the profile, see get_substitutions()
+
+
+def get_substitutions():
+    global SUBSTITUTIONS
+    if SUBSTITUTIONS is None:
+        SUBSTITUTIONS = SubstitutionEngine(PROFILE.get("substitutions", {}))
+    return SUBSTITUTIONS
+
+
+# --- Static assets ---
+#
+# Everything the page needs is rendered and compressed once, when the profile
+# is loaded, rather than per request. Script, style and icons live under
+# content-hashed /assets/ URLs that browsers may cache forever; the page,
+# /config.js (the profile), the manifest and the service worker keep stable
+# URLs and are revalidated, which costs a 304 with no body when unchanged.
+
+_brotli = None  # the brotli module once imported, False if it isn't installed
+
+
+def brotli_module():
+    """The optional brotli module, or None; gzip is always available."""
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli as _brotli
+        except ImportError:
+            _brotli = False
+    return _brotli or None
+
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDATE = "no-cache"
+ICON_SIZES = (192, 512)
+
+# Profile keys the page never needs to see.
+PRIVATE_PROFILE_KEYS = ("permanent_token", "relay")  # relay peer URLs carry their tokens
+
+# Substitutions and voice command detection, shared by the page and /bench.
+PIPELINE_JS = r"""
+/* Compiled once from the profile: one combined matcher for all phrases and
+ * Sets for the command words. Each edit only rescans the text within one
+ * phrase length of the edit, so the cost per keystroke doesn't grow with the
+ * length of the text. */
+function escapeRegex(s) {
+  return s.replace(/[.*+?^${}()|[\]\\]/g, "\\$&");
+}
+
+function makePipeline(config) {
+  const WS = /\s/;
+  const entries = Object.entries(config.substitutions || {}).filter(e => e[0]);
+  const replacements = new Map(entries.map(e => [e[0].toLowerCase(), e[1]]));
+  const maxLen = entries.reduce((m, e) => Math.max(m, e[0].length), 0);
+  // Longest first, so the alternation prefers the longest phrase at a position.
+  const alternation = entries.map(e => e[0]).sort((a, b) => b.length - a.length)
+    .map(escapeRegex).join("|");
+  const matcher = alternation
+    ? new RegExp("(^|\\s)(" + alternation + ")(?=\\s|$)", "gi") : null;
+  const vs = config.voice_send || {};
+  const sendWords = new Set((vs.send_words || []).map(w => w.toLowerCase()));
+  const clearWords = new Set((vs.clear_words || []).map(w => w.toLowerCase()));
+
+  /* Substitute phrases an edit of value[start, end) could have completed.
+   * Returns {value, caret} with the caret kept in place, or null. */
+  function substitute(value, start, end, caret) {
+    if (!matcher) return null;
+    let from = Math.max(0, start - maxLen - 1);
+    while (from > 0 && !WS.test(value[from])) from--;
+    let to = Math.min(value.length, end + maxLen + 1);
+    while (to < value.length && !WS.test(value[to])) to++;
+    const slice = value.slice(from, to);
+    let shift = 0;
+    let moved = -1;
+    const out = slice.replace(matcher, (m, before, phrase, offset) => {
+      const rep = before + replacements.get(phrase.toLowerCase());
+      const at = from + offset;
+      if (at + m.length <= caret) shift += rep.length - m.length;
+      else if (at < caret) moved = at + shift + rep.length;  // caret was inside the phrase
+      return rep;
+    });
+    if (out === slice) return null;
+    return {
+      value: value.slice(0, from) + out + value.slice(to),
+      caret: moved >= 0 ? moved : caret + shift
+    };
+  }
+
+  /* The voice command the text ends with, as {action, word}, or null. */
+  function command(value) {
+    const tail = value.slice(-64);
+    const m = tail.match(/(\S+)\s*$/);
+    if (!m) return null;
+    const cut = value.length - tail.length;
+    if (m.index === 0 && cut > 0 && !WS.test(value[cut - 1])) return null;  // longer word
+    const word = m[1].toLowerCase();
+    if (sendWords.has(word)) return {action: "send", word: m[1]};
+    if (clearWords.has(word)) return {action: "clear", word: m[1]};
+    return null;
+  }
+
+  return {substitute: substitute, command: command};
+}
+"""
+
+# /bench: per-input cost of the pipeline at growing text sizes, next to the
+# previous full-text approach. Uses the running profile's substitutions.
+BENCH_TEMPLATE = r"""
+<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>Input pipeline benchmark</title>
+<style>
+body{font-family:system-ui,sans-serif;background:#1a1a1a;color:#fff;padding:12px}
+table{border-collapse:collapse;margin:12px 0}
+td,th{border:1px solid #444;padding:4px 8px;text-align:right}
+pre{font-size:0.75rem;color:#aaa;white-space:pre-wrap}
+button{padding:12px 16px;font-size:1rem;background:#2563eb;color:#fff;border:none;border-radius:8px}
+</style>
+</head>
+<body>
+<button id="run">Run</button>
+<table><thead><tr><th>chars</th><th>incremental µs/input</th><th>full rescan µs/input</th></tr></thead>
+<tbody id="rows"></tbody></table>
+<pre id="json"></pre>
+<script src="/config.js"></script>
+<script src="__PIPELINE_URL__"></script>
+<script>
+const SIZES = [1000, 10000, 100000];
+const KEYS = 200;
+const TYPED = "and then full stop comma new line some more words ";
+
+/* The previous approach: one regex per phrase over the whole text, then a
+ * split of the whole text for the last word. */
+function fullRescan(config) {
+  const entries = Object.entries(config.substitutions || {})
+    .sort((a, b) => b[0].length - a[0].length);
+  const vs = config.voice_send || {};
+  return function(text) {
+    for (const [phrase, replacement] of entries) {
+      const re = new RegExp("(^|\\s)" + escapeRegex(phrase) + "(?=\\s|$)", "gi");
+      if (re.test(text)) text = text.replace(re, (m, before) => before + replacement);
+    }
+    const words = text.trimEnd().split(/\s+/);
+    const last = words[words.length - 1].toLowerCase();
+    (vs.send_words || []).map(w => w.toLowerCase()).includes(last);
+    (vs.clear_words || []).map(w => w.toLowerCase()).includes(last);
+    return text;
+  };
+}
 
-@app.route("/manifest.json")
-def manifest():
-    return {
+function seedText(n) {
+  let t = "";
+  while (t.length < n) t += TYPED;
+  return t.slice(0, n);
+}
+
+function measure(n, step) {
+  let text = seedText(n);
+  const t0 = performance.now();
+  for (let k = 0; k < KEYS; k++) text = step(text + TYPED[k % TYPED.length]);
+  return Math.round((performance.now() - t0) / KEYS * 1000);
+}
+
+document.getElementById("run").onclick = () => {
+  const pipeline = makePipeline(CONFIG);
+  const legacy = fullRescan(CONFIG);
+  const incremental = (text) => {
+    const r = pipeline.substitute(text, text.length - 1, text.length, text.length);
+    if (r) text = r.value;
+    pipeline.command(text);
+    return text;
+  };
+  const results = [];
+  const rows = document.getElementById("rows");
+  rows.textContent = "";
+  for (const n of SIZES) {
+    const row = {chars: n, incremental_us: measure(n, incremental), full_rescan_us: measure(n, legacy)};
+    results.push(row);
+    const tr = rows.insertRow();
+    for (const v of [row.chars, row.incremental_us, row.full_rescan_us]) tr.insertCell().textContent = v;
+  }
+  document.getElementById("json").textContent = JSON.stringify({
+    userAgent: navigator.userAgent,
+    phrases: Object.keys(CONFIG.substitutions || {}).length,
+    results: results
+  }, null, 2);
+};
+</script>
+</body>
+</html>
+"""
+
+# Persistent outbox shared by the page and the service worker.
+OUTBOX_JS = r"""
+/* Sends made while the desktop is unreachable are stored in IndexedDB in
+ * order and replayed oldest first. Each carries an Idempotency-Key, so a
+ * replay of something the server did receive isn't typed twice. Both the page
+ * and the service worker may flush; the keys make that harmless too. */
+const Outbox = (() => {
+  const STORE = "outbox";
+  let dbPromise = null;
+  let flushing = null;
+
+  function db() {
+    if (!dbPromise) {
+      dbPromise = new Promise((resolve, reject) => {
+        const req = indexedDB.open("input-from-web", 1);
+        req.onupgradeneeded = () => req.result.createObjectStore(STORE, {autoIncrement: true});
+        req.onsuccess = () => resolve(req.result);
+        req.onerror = () => reject(req.error);
+      });
+    }
+    return dbPromise;
+  }
+
+  async function run(mode, op) {
+    const conn = await db();
+    return new Promise((resolve, reject) => {
+      const req = op(conn.transaction(STORE, mode).objectStore(STORE));
+      req.onsuccess = () => resolve(req.result);
+      req.onerror = () => reject(req.error);
+    });
+  }
+
+  const add = (item) => run("readwrite", s => s.add(item));
+  const size = () => run("readonly", s => s.count());
+  const remove = (id) => run("readwrite", s => s.delete(id));
+  const oldest = () => run("readonly", s => s.openCursor())
+    .then(c => c ? {id: c.key, item: c.value} : null);
+
+  /* Resolves true once the outbox is empty, false if delivery must wait. */
+  function flush() {
+    if (!flushing) {
+      flushing = (async () => {
+        try {
+          for (let e = await oldest(); e; e = await oldest()) {
+            const res = await fetch(e.item.url, {
+              method: "POST",
+              headers: {"Content-Type": "application/json", "Idempotency-Key": e.item.key},
+              body: JSON.stringify({text: e.item.text}),
+              signal: AbortSignal.timeout(8000)
+            });
+            if (res.status >= 500 || res.status === 429) return false;
+            await remove(e.id);  // delivered, or rejected for good (e.g. bad token)
+          }
+          return true;
+        } catch (err) {
+          return false;
+        } finally {
+          flushing = null;
+        }
+      })();
+    }
+    return flushing;
+  }
+
+  return {add: add, size: size, flush: flush};
+})();
+"""
+
+# The app shell is precached at install and answered from the cache, so the
+# PWA opens instantly (and offline). Hashed assets never change; the page,
+# config and manifest are refreshed in the background for the next launch.
+SW_TEMPLATE = r"""
+importScripts("__OUTBOX_URL__");
+const CACHE = "input-from-web-__VERSION__";
+const SHELL = __SHELL__;
+const REFRESHED = new Set(["/", "/config.js", "/manifest.json"]);
+
+self.addEventListener("install", e => {
+  e.waitUntil(caches.open(CACHE).then(c => c.addAll(SHELL)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener("activate", e => {
+  e.waitUntil(caches.keys()
+    .then(keys => Promise.all(keys.filter(k => k !== CACHE).map(k => caches.delete(k))))
+    .then(() => self.clients.claim())
+    .then(() => Outbox.flush()));
+});
+
+self.addEventListener("fetch", e => {
+  const url = new URL(e.request.url);
+  if (e.request.method !== "GET" || url.origin !== location.origin) return;
+  if (url.pathname.startsWith("/assets/")) {
+    e.respondWith(caches.match(url.pathname).then(r => r || fetch(e.request)));
+  } else if (REFRESHED.has(url.pathname)) {
+    e.respondWith(caches.open(CACHE).then(async cache => {
+      const cached = await cache.match(url.pathname);
+      const fresh = fetch(e.request).then(res => {
+        if (res.ok) cache.put(url.pathname, res.clone());
+        return res;
+      });
+      if (!cached) return fresh;
+      e.waitUntil(fresh.catch(() => {}));
+      return cached;
+    }));
+  }
+});
+
+self.addEventListener("sync", e => {
+  if (e.tag === "outbox") e.waitUntil(Outbox.flush());
+});
+"""
+
+ASSETS = None  # {url path: StaticAsset}, see get_assets()
+
+
+class StaticAsset:
+    """A prerendered response body with its ETag and compressed variants."""
+
+    def __init__(self, body, content_type, cache_control=CACHE_REVALIDATE):
+        self.body = body
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.encoded = {}  # content-encoding -> body, only where it's smaller
+        if not content_type.startswith("image/"):
+            candidates = {"gzip": gzip.compress(body, 9, mtime=0)}
+            brotli = brotli_module()
+            if brotli is not None:
+                candidates["br"] = brotli.compress(body)
+            for encoding, data in candidates.items():
+                if len(data) < len(body):
+                    self.encoded[encoding] = data
+
+    def response(self):
+        encoding = None
+        for candidate in ("br", "gzip"):
+            if candidate in self.encoded and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+        headers = {
+            # Each encoding is a different byte sequence, so a different strong ETag.
+            "ETag": f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"',
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = request.headers.get("If-None-Match", "")
+        if if_none_match == "*" or self.digest in if_none_match:
+            return Response(status=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            return Response(self.encoded[encoding], content_type=self.content_type, headers=headers)
+        return Response(self.body, content_type=self.content_type, headers=headers)
+
+
+def _read_icon(name):
+    try:
+        with open(os.path.join(SCRIPT_DIR, name), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def build_assets(profile):
+    """Render everything static for a profile. Return {url path: StaticAsset}."""
+    js_type = "application/javascript; charset=utf-8"
+    css = StaticAsset(APP_CSS.encode(), "text/css; charset=utf-8", CACHE_IMMUTABLE)
+    js = StaticAsset(APP_JS.encode(), js_type, CACHE_IMMUTABLE)
+    outbox = StaticAsset(OUTBOX_JS.encode(), js_type, CACHE_IMMUTABLE)
+    pipeline = StaticAsset(PIPELINE_JS.encode(), js_type, CACHE_IMMUTABLE)
+    css_url = f"/assets/app.{css.digest}.css"
+    js_url = f"/assets/app.{js.digest}.js"
+    outbox_url = f"/assets/outbox.{outbox.digest}.js"
+    pipeline_url = f"/assets/pipeline.{pipeline.digest}.js"
+    assets = {css_url: css, js_url: js, outbox_url: outbox, pipeline_url: pipeline}
+
+    original = _read_icon("icon.png")
+    icon_urls = {}
+    for size in ICON_SIZES:
+        # Older installs may only ship icon.png; serve it for every size then.
+        icon = StaticAsset(_read_icon(f"icon-{size}.png") or original, "image/png", CACHE_IMMUTABLE)
+        icon_urls[size] = f"/assets/icon-{size}.{icon.digest}.png"
+        assets[icon_urls[size]] = icon
+    assets["/icon.png"] = StaticAsset(original, "image/png", "public, max-age=86400")
+
+    page = (PAGE_TEMPLATE.replace("__CSS_URL__", css_url)
+            .replace("__JS_URL__", js_url)
+            .replace("__OUTBOX_URL__", outbox_url)
+            .replace("__PIPELINE_URL__", pipeline_url)
+            .replace("__ICON_URL__", icon_urls[ICON_SIZES[0]]))
+    assets["/"] = StaticAsset(page.encode(), "text/html; charset=utf-8")
+    bench = BENCH_TEMPLATE.replace("__PIPELINE_URL__", pipeline_url)
+    assets["/bench"] = StaticAsset(bench.encode(), "text/html; charset=utf-8")
+
+    public = {k: v for k, v in profile.items() if k not in PRIVATE_PROFILE_KEYS}
+    config = f"var CONFIG = {json.dumps(public, ensure_ascii=False)};\n"
+    assets["/config.js"] = StaticAsset(config.encode(), js_type)
+
+    manifest = {
         "name": "Input from Web",
         "short_name": "Input",
         "start_url": "/",
         "display": "standalone",
         "background_color": "#1a1a1a",
         "theme_color": "#1a1a1a",
-        "icons": [{"src": "/icon.png", "sizes": "512x512", "type": "image/png"}],
+        "icons": [{"src": icon_urls[size], "sizes": f"{size}x{size}", "type": "image/png"}
+                  for size in ICON_SIZES],
     }
+    assets["/manifest.json"] = StaticAsset(json.dumps(manifest).encode(), "application/manifest+json")
+
+    shell = ["/", "/config.js", "/manifest.json", css_url, js_url, pipeline_url, outbox_url,
+             *icon_urls.values()]
+    version = hashlib.sha256("".join(assets[path].digest for path in shell).encode()).hexdigest()[:16]
+    sw = (SW_TEMPLATE.replace("__OUTBOX_URL__", outbox_url)
+          .replace("__VERSION__", version)
+          .replace("__SHELL__", json.dumps(shell)))
+    assets["/sw.js"] = StaticAsset(sw.encode(), js_type)
+    return assets
+
+
+def get_assets():
+    global ASSETS
+    if ASSETS is None:
+        ASSETS = build_assets(PROFILE)
+    return ASSETS
+
+
+def serve_asset(path):
+    asset = get_assets().get(path)
+    if asset is None:
+        abort(404)
+    return asset.response()
+
+
+def check_token():
+    """Admission control and the token check, for every API route.
+
+    The page, its assets and /ping skip both, so a locked out phone can
+    still load the page and see why its sends are refused.
+    """
+    ADMISSION.admit(request.remote_addr)
+    if USE_TOKEN and not ADMISSION.check_token(request.remote_addr,
+                                                request.args.get("token", ""), TOKEN):
+        abort(403)
+
+
+def check_local():
+    """For routes that only type here: refuse them on a relay-only instance."""
+    if not RELAY.local and RELAY_HEADER not in request.headers:
+        raise RelayOnly()
+
+
+_CLIENT_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def current_client():
+    """The Client a request comes from: its ?client= id, or else its address."""
+    client_id = request.args.get("client", "")
+    if not _CLIENT_ID.fullmatch(client_id):
+        client_id = f"addr-{request.remote_addr}"
+    return CLIENTS.get(client_id)
+
+
+@app.errorhandler(ClientBusy)
+def client_busy(e):
+    # Counted in the rejected_total metric by InjectionQueue.submit().
+    return ({"error": "busy", "inflight_chars": e.client.inflight,
+             "limit": CLIENT_MAX_INFLIGHT_CHARS}, 429, {"Retry-After": "1"})
+
+
+@app.errorhandler(RateLimited)
+def rate_limited(e):
+    retry = max(1, math.ceil(e.retry_after))
+    return {"error": e.reason, "retry_after": retry}, 429, {"Retry-After": str(retry)}
+
+
+@app.errorhandler(RelayOnly)
+def relay_only(e):
+    return {"error": "relay only, use /send"}, 409
+
+
+@app.before_request
+def _start_timer():
+    request.environ["input_from_web.start"] = time.perf_counter()
+
+
+@app.after_request
+def _record_latency(response):
+    start = request.environ.get("input_from_web.start")
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.labels(route).observe(time.perf_counter() - start)
+    return response
+
+
+@app.route("/ping")
+def ping():
+    return {"ok": True}
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus text exposition of the METRICS registry."""
+    check_token()
+    body = "\n".join(m.render() for m in METRICS) + "\n"
+    return Response(body, mimetype="text/plain; version=0.0.4",
+                    headers={"Cache-Control": "no-store"})
+
+
+@app.route("/events")
+def events():
+    """Server-sent events: heartbeats with server state, plus job/state events.
+
+    Kept for the lifetime of the page; replaces polling /ping.
+    """
+    check_token()
+    sub = HUB.subscribe()
+    if sub is None:
+        return {"error": "too many event streams"}, 503, {"Retry-After": "5"}
+
+    def stream():
+        try:
+            hello = dict(QUEUE.state(), keepalive=HEARTBEAT_SECONDS, config=CONFIG_VERSION)
+            yield f"retry: 2000\nevent: heartbeat\ndata: {json.dumps(hello)}\n\n"
+            while True:
+                try:
+                    yield sub.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    beat = dict(QUEUE.state(), keepalive=HEARTBEAT_SECONDS, config=CONFIG_VERSION)
+                    yield f"event: heartbeat\ndata: {json.dumps(beat)}\n\n"
+        finally:
+            HUB.unsubscribe(sub)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/manifest.json")
+def manifest():
+    return serve_asset("/manifest.json")
 
 
 @app.route("/icon.png")
 def icon():
-    return send_from_directory(SCRIPT_DIR, "icon.png", mimetype="image/png")
+    return serve_asset("/icon.png")
 
 
 @app.route("/sw.js")
 def service_worker():
-    return Response(
-        'self.addEventListener("fetch", e => e.respondWith(fetch(e.request)));',
-        mimetype="application/javascript",
-    )
+    return serve_asset("/sw.js")
+
+
+@app.route("/config.js")
+def config_js():
+    return serve_asset("/config.js")
+
+
+@app.route("/assets/<name>")
+def asset(name):
+    return serve_asset(f"/assets/{name}")
+
+
+@app.route("/bench")
+def bench():
+    return serve_asset("/bench")
 
 
 @app.route("/")
 def index():
     # Page is always served — token security is on POST /send.
     # Client gets token from URL query (first visit) or localStorage (PWA / bookmark).
-    profile_json = json.dumps(PROFILE, ensure_ascii=False)
-    return HTML_TEMPLATE.replace("__CONFIG__", profile_json)
+    return serve_asset("/")
+
+
+@app.route("/stream", websocket=True)
+def stream():
+    check_token()
+    check_local()
+    client = current_client()
+    ws = WebSocket.accept(request.environ)
+    if ws is None:
+        abort(400)
+    STREAM_CLIENTS.inc()
+    try:
+        serve_stream(ws, client)
+    finally:
+        STREAM_CLIENTS.dec()
+        ws.close()
+    return _Detached()
 
 
 @app.route("/send", methods=["POST"])
 def send():
+    """Queue text for injection, here and on any relay peers.
+
+    The response carries the time each step took, as a Server-Timing header
+    and a "timings" field. With "wait": true it only returns once the text
+    has been injected (or after SEND_WAIT_SECONDS), including those steps.
+    With relay peers, "peers" holds each one's outcome and "ok" is only true
+    if all of them took the text. The text is added to the send history
+    unless "history" is false; "history" in the response is its entry.
+    """
+    timings = Timings()
+    with timings.stage("token"):
+        check_token()
+    with timings.stage("parse"):
+        data = request.get_json(force=True)
+    if not isinstance(data, dict):
+        return {"error": "body must be a JSON object"}, 400
+    text = data.get("text", "")
+    if not isinstance(text, str):
+        return {"error": "text must be a string"}, 400
+    if data.get("substitute"):
+        with timings.stage("substitute"):
+            text = get_substitutions().apply(text)
+    if not text:
+        return {"error": "empty"}, 400
+    key = request.headers.get("Idempotency-Key")
+    client = current_client()
+    relayed = RELAY_HEADER in request.headers
+    job = None
+    if RELAY.local or relayed:
+        # Before relaying: a send refused here (429) mustn't reach the peers,
+        # or the phone's retry would have them type it twice.
+        with timings.stage("enqueue"):
+            new = Job(text, client)
+            job = QUEUE.submit(new, key)
+    collect = None
+    if RELAY.peers and not relayed:
+        # Peers dedupe retries by key, so they need one even if the phone sent none.
+        collect = RELAY.start(text, key or secrets.token_urlsafe(12), client.id,
+                              bool(data.get("wait")))
+    history_id = None
+    if HISTORY is not None and data.get("history", True) and (job is None or job is new):
+        with timings.stage("history"):
+            history_id = HISTORY.append(text, client.id)
+    code = 202
+    if job and data.get("wait") and job.done.wait(SEND_WAIT_SECONDS):
+        code = 200
+        timings.add("queue", (job.started - job.created) * 1000)
+        timings.stages.extend(job.timings.stages if job.timings else ())
+    body = {"ok": True, "job": job.id if job else None, "status": job.status if job else None,
+            "history": history_id}
+    headers = {"Location": f"/jobs/{job.id}"} if job else {}
+    if collect:
+        with timings.stage("relay"):
+            body["peers"] = peers = collect()
+        body["ok"] = all(p["ok"] for p in peers)
+        if not job:
+            code = 200 if any(p["ok"] for p in peers) else 502
+    timings.add("total", (time.perf_counter() - request.environ["input_from_web.start"]) * 1000)
+    body["timings"] = timings.to_dict()
+    headers["Server-Timing"] = timings.header()
+    return body, code, headers
+
+
+@app.route("/register", methods=["POST"])
+def register():
+    """Issue a client id, for the client to pass as ?client= from then on."""
+    check_token()
+    data = request.get_json(force=True, silent=True) or {}
+    if not isinstance(data, dict):
+        return {"error": "body must be a JSON object"}, 400
+    name = data.get("name") or ""
+    if not isinstance(name, str):
+        return {"error": "name must be a string"}, 400
+    client = CLIENTS.register(name[:64] or None)
+    return {"client": client.id}
+
+
+@app.route("/clients")
+def clients():
+    check_token()
+    return {"clients": QUEUE.client_stats()}
+
+
+@app.route("/admission")
+def admission():
+    check_token()
+    return ADMISSION.stats()
+
+
+@app.route("/route", methods=["POST"])
+def route_preview():
+    """How method "auto" would inject a text, without injecting it."""
     check_token()
     data = request.get_json(force=True)
+    if not isinstance(data, dict):
+        return {"error": "body must be a JSON object"}, 400
     text = data.get("text", "")
-    if not text:
+    if not isinstance(text, str):
+        return {"error": "text must be a string"}, 400
+    segments = route(text)
+    estimate = sum(COSTS.type_cost(len(part)) if method == "type"
+                   else COSTS.paste_call + len(part) * COSTS.paste_char
+                   for method, part in segments)
+    return {
+        "segments": [{"method": method, "text": part} for method, part in segments],
+        "estimate_ms": round(estimate * 1000, 1),
+        "costs": COSTS.to_dict(),
+    }
+
+
+@app.route("/substitute", methods=["POST"])
+def substitute():
+    check_token()
+    data = request.get_json(force=True)
+    if not isinstance(data, dict):
+        return {"error": "body must be a JSON object"}, 400
+    text = data.get("text", "")
+    if not isinstance(text, str):
+        return {"error": "text must be a string"}, 400
+    return {"text": get_substitutions().apply(text)}
+
+
+@app.route("/paste", methods=["POST"])
+def paste():
+    check_token()
+    check_local()
+    encoding = request.headers.get("Content-Encoding", "identity").lower()
+    if encoding not in ("identity", "gzip", "deflate"):
+        return {"error": "unsupported encoding"}, 415
+    source = tempfile.SpooledTemporaryFile(max_size=PASTE_SPOOL_CHARS, mode="w+", encoding="utf-8")
+    try:
+        chars = spool_body(request.stream, encoding, source)
+    except PasteTooLarge:
+        source.close()
+        return {"error": "too large"}, 413
+    except zlib.error:
+        source.close()
+        return {"error": "bad compressed body"}, 400
+    if not chars:
+        source.close()
+        return {"error": "empty"}, 400
+    job = QUEUE.submit(PasteJob(source, chars, current_client()),
+                       request.headers.get("Idempotency-Key"))
+    return {"ok": True, "job": job.id, "status": job.status}, 202, {"Location": f"/jobs/{job.id}"}
+
+
+@app.route("/mirror", methods=["POST"])
+def mirror():
+    """Make the field this client mirrors into hold exactly the given text."""
+    check_token()
+    check_local()
+    data = request.get_json(force=True)
+    if not isinstance(data, dict):
+        return {"error": "body must be a JSON object"}, 400
+    text = data.get("text", "")
+    if not isinstance(text, str):
+        return {"error": "text must be a string"}, 400
+    job = QUEUE.submit(MirrorJob(text, current_client(), bool(data.get("reset"))),
+                       request.headers.get("Idempotency-Key"))
+    return {"ok": True, "job": job.id, "status": job.status}, 202, {"Location": f"/jobs/{job.id}"}
+
+
+@app.route("/macro", methods=["POST"])
+def macro():
+    """Run a macro as one job: the profile's macro "name", or the given "steps".
+
+    "input" is the text for the macro's input steps (after substitutions, with
+    "substitute": true), and goes into the send history unless "history" is
+    false. "wait": true holds the response until the macro has run, as /send.
+    """
+    check_token()
+    check_local()
+    data = request.get_json(force=True)
+    if not isinstance(data, dict):
+        return {"error": "body must be a JSON object"}, 400
+    name = data.get("name")
+    if name is not None:
+        if not isinstance(name, str):
+            return {"error": "name must be a string"}, 400
+        if name not in MACROS:
+            return {"error": "no such macro"}, 404
+        steps = MACROS[name]
+    else:
+        try:
+            steps = parse_macro(data.get("steps"))
+        except ValueError as e:
+            return {"error": str(e)}, 400
+    text = data.get("input", "")
+    if not isinstance(text, str):
+        return {"error": "input must be a string"}, 400
+    if text and data.get("substitute"):
+        text = get_substitutions().apply(text)
+    new = MacroJob(steps, current_client(), text, name)
+    if not new.steps:
         return {"error": "empty"}, 400
+    job = QUEUE.submit(new, request.headers.get("Idempotency-Key"))
+    history_id = None
+    if HISTORY is not None and text and data.get("history", True) and job is new:
+        history_id = HISTORY.append(text, job.client.id)
+    code = 202
+    if data.get("wait") and job.done.wait(SEND_WAIT_SECONDS):
+        code = 200
+    return ({"ok": True, "job": job.id, "status": job.status, "history": history_id},
+            code, {"Location": f"/jobs/{job.id}"})
+
+
+@app.route("/history")
+def history():
+    """A page of send history, newest first; see HistoryLog.page()."""
+    check_token()
+    if HISTORY is None:
+        return {"entries": [], "next": None, "first": 1, "last": 0}
     try:
-        inject_text(text)
-    except subprocess.CalledProcessError as e:
-        print(f"Injection failed: {e}", file=sys.stderr)
-        return {"error": "injection failed"}, 500
-    return {"ok": True}
+        cursor = int(request.args["cursor"]) if "cursor" in request.args else None
+        limit = int(request.args.get("limit", 20))
+    except ValueError:
+        return {"error": "cursor and limit must be numbers"}, 400
+    query = request.args.get("q") or None
+    return HISTORY.page(cursor, limit, query, request.args.get("match") == "prefix")
+
+
+@app.route("/history", methods=["POST"])
+def history_add():
+    """Record a send the server can't tell apart itself (streaming, mirror mode)."""
+    check_token()
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict):
+        return {"error": "body must be a JSON object"}, 400
+    text = data.get("text")
+    if not isinstance(text, str) or not text:
+        return {"error": "empty"}, 400
+    if HISTORY is None:
+        return {"id": None}
+    return {"id": HISTORY.append(text, current_client().id)}
+
+
+def _get_job(job_id):
+    check_token()
+    job = QUEUE.get(job_id)
+    if job is None:
+        abort(404)
+    return job
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    return _get_job(job_id).to_dict()
+
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def job_cancel(job_id):
+    job = _get_job(job_id)
+    job.cancel()
+    return job.to_dict()
+
+
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    """Server-sent events with the job's status every half second until it ends."""
+    job = _get_job(job_id)
+
+    def events():
+        while True:
+            finished = job.done.is_set()
+            yield f"data: {json.dumps(job.to_dict())}\n\n"
+            if finished:
+                return
+            job.done.wait(0.5)
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"})
+
+
+# --- Config reload ---
+#
+# The config file is watched (inotify, or mtime polling where that isn't
+# available) and re-read when it changes or on SIGHUP. The active profile
+# is validated and compiled (substitution matcher, rendered page) on the
+# side and only then swapped in, and pages are told to reload. A broken
+# file is reported and the running config kept.
+
+# Kept at their running values until a restart.
+RESTART_KEYS = ("port", "server", "use_security_token", "permanent_token")
+COMPILED_KEEP = 4
+
+
+class ConfigError(Exception):
+    pass
+
+
+def validate_profile(profile):
+    """Raise ConfigError if profile holds a value the server can't use."""
+    def check(ok, message):
+        if not ok:
+            raise ConfigError(message)
+
+    def number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    def integer(value):
+        return isinstance(value, int) and not isinstance(value, bool)  # true is an int too
+
+    def words(value):
+        return isinstance(value, list) and all(isinstance(w, str) for w in value)
+
+    check(isinstance(profile, dict), "profile must be an object")
+    check(profile.get("method", "type") in ("type", "clipboard", "auto"),
+          "method must be 'type', 'clipboard' or 'auto'")
+    check(profile.get("injector", "auto") in ("auto", "socket", "subprocess"),
+          "injector must be 'auto', 'socket' or 'subprocess'")
+    check(profile.get("server", "werkzeug") in ("werkzeug", "async"),
+          "server must be 'werkzeug' or 'async'")
+    port = profile.get("port", 5123)
+    check(integer(port) and 0 < port < 65536, "port must be 1-65535")
+    check(number(profile.get("heartbeat_seconds", 15)) and profile.get("heartbeat_seconds", 15) > 0,
+          "heartbeat_seconds must be a positive number")
+    for section in ("voice_send", "streaming", "mirror", "history", "coalesce"):
+        check(isinstance(profile.get(section, {}), dict), f"{section} must be an object")
+    voice = profile.get("voice_send", {})
+    for key in ("send_words", "clear_words"):
+        check(words(voice.get(key, [])), f"voice_send.{key} must be a list of strings")
+    check(number(voice.get("delay_seconds", 1.5)), "voice_send.delay_seconds must be a number")
+    check(number(profile.get("streaming", {}).get("commit_delay_seconds", 0.8)),
+          "streaming.commit_delay_seconds must be a number")
+    sync_delay = profile.get("mirror", {}).get("sync_delay_seconds", 1.0)
+    check(number(sync_delay) and sync_delay >= 0, "mirror.sync_delay_seconds must be 0 or more")
+    check(isinstance(profile.get("mirror", {}).get("jump_keys", True), bool),
+          "mirror.jump_keys must be true or false")
+    history = profile.get("history", {})
+    max_entries = history.get("max_entries", 10000)
+    check(integer(max_entries) and max_entries >= 0, "history.max_entries must be 0 or more")
+    max_age = history.get("max_age_days", 0)
+    check(number(max_age) and max_age >= 0, "history.max_age_days must be 0 or more")
+    coalesce = profile.get("coalesce", {})
+    max_batch = coalesce.get("max_batch", 16)
+    check(integer(max_batch) and max_batch >= 1, "coalesce.max_batch must be at least 1")
+    max_wait = coalesce.get("max_wait_ms", 0)
+    check(number(max_wait) and max_wait >= 0, "coalesce.max_wait_ms must be 0 or more")
+    clients = profile.get("clients", {})
+    check(isinstance(clients, dict), "clients must be an object")
+    inflight = clients.get("max_inflight_chars", 1 << 20)
+    check(integer(inflight) and inflight >= 1, "clients.max_inflight_chars must be at least 1")
+    admission = profile.get("admission", {})
+    check(isinstance(admission, dict), "admission must be an object")
+    for key, default in ADMISSION_DEFAULTS.items():
+        value = admission.get(key, default)
+        if key.endswith("_burst"):
+            check(integer(value) and value >= 1, f"admission.{key} must be at least 1")
+        elif isinstance(default, int):
+            check(integer(value) and value >= 0,
+                  f"admission.{key} must be a whole number, 0 or more")
+        else:
+            check(number(value) and value >= 0, f"admission.{key} must be 0 or more")
+    relay = profile.get("relay", {})
+    check(isinstance(relay, dict), "relay must be an object")
+    peers = relay.get("peers", [])
+    check(words(peers) and all(urllib.parse.urlsplit(p).scheme in ("http", "https") for p in peers),
+          "relay.peers must be a list of http:// or https:// URLs")
+    timeout = relay.get("timeout_ms", 2000)
+    check(number(timeout) and timeout > 0, "relay.timeout_ms must be a positive number")
+    retries = relay.get("retries", 2)
+    check(integer(retries) and retries >= 0, "relay.retries must be 0 or more")
+    check(isinstance(relay.get("local", True), bool), "relay.local must be true or false")
+    check(relay.get("local", True) or not peers
+          or not any(profile.get(mode, {}).get("enabled") for mode in ("streaming", "mirror")),
+          "relay.local can't be false with streaming or mirror enabled: they only type here")
+    typing = profile.get("typing", {})
+    check(isinstance(typing, dict), "typing must be an object")
+    rate = typing.get("keys_per_second", 0)
+    check(number(rate) and rate >= 0, "typing.keys_per_second must be 0 or more")
+    burst = typing.get("burst", 64)
+    check(integer(burst) and burst >= 1, "typing.burst must be at least 1")
+    check(typing.get("mode", "steady") in ("steady", "bursts"),
+          "typing.mode must be 'steady' or 'bursts'")
+    pause = typing.get("newline_pause_ms", 0)
+    check(number(pause) and pause >= 0, "typing.newline_pause_ms must be 0 or more")
+    macros = profile.get("macros", {})
+    check(isinstance(macros, dict), "macros must be an object")
+    for name, steps in macros.items():
+        try:
+            parse_macro(steps)
+        except ValueError as e:
+            raise ConfigError(f"macros.{name}: {e}") from None
+    subs = profile.get("substitutions", {})
+    check(isinstance(subs, dict) and all(isinstance(v, str) for v in subs.values()),
+          "substitutions must map phrases to strings")
+
+
+ADMISSION_DEFAULTS = {
+    "address_rate": 20.0, "address_burst": 60, "token_rate": 60.0, "token_burst": 120,
+    "max_queued": 256, "lockout_after": 5, "lockout_max_seconds": 900.0,
+}
+
+
+class CompiledProfile:
+    """Everything derived from one profile, built before it goes live."""
+
+    def __init__(self, profile, overrides):
+        validate_profile(profile)
+        self.profile = profile
+        self.method = overrides.get("method") or profile.get("method", "type")
+        self.injector = overrides.get("injector") or profile.get("injector", "auto")
+        self.auto_paste = profile.get("auto_paste", False)
+        self.heartbeat_seconds = profile.get("heartbeat_seconds", 15)
+        coalesce = profile.get("coalesce", {})
+        self.coalesce_max_batch = coalesce.get("max_batch", 16)
+        self.coalesce_wait_seconds = coalesce.get("max_wait_ms", 0) / 1000
+        history = profile.get("history", {})
+        self.history_max_entries = history.get("max_entries", 10000)
+        self.history_max_age = history.get("max_age_days", 0) * 86400
+        self.mirror_jumps = profile.get("mirror", {}).get("jump_keys", True)
+        self.client_max_inflight_chars = profile.get("clients", {}).get("max_inflight_chars", 1 << 20)
+        self.admission = dict(ADMISSION_DEFAULTS, **profile.get("admission", {}))
+        relay = profile.get("relay", {})
+        self.relay = Relay(relay.get("peers", []), relay.get("timeout_ms", 2000) / 1000,
+                           relay.get("retries", 2), relay.get("local", True))
+        typing = profile.get("typing", {})
+        self.pacer = TypingPacer(typing.get("keys_per_second", 0), typing.get("burst", 64),
+                                 typing.get("mode", "steady") == "bursts",
+                                 typing.get("newline_pause_ms", 0) / 1000)
+        self.macros = {name: parse_macro(steps) for name, steps in profile.get("macros", {}).items()}
+        self.substitutions = SubstitutionEngine(profile.get("substitutions", {}))
+        self.assets = build_assets(profile)
+        self.version = self.assets["/sw.js"].digest
+
+
+_compiled = collections.OrderedDict()  # profile JSON -> CompiledProfile
+
+
+def compile_profile(profile):
+    """CompiledProfile for profile, reusing one built from identical settings."""
+    key = json.dumps([profile, CLI_OVERRIDES], sort_keys=True)
+    compiled = _compiled.get(key)
+    if compiled is None:
+        compiled = CompiledProfile(profile, CLI_OVERRIDES)
+        _compiled[key] = compiled
+        while len(_compiled) > COMPILED_KEEP:
+            _compiled.popitem(last=False)
+    _compiled.move_to_end(key)
+    return compiled
+
+
+def apply_profile(compiled):
+    """Make compiled the running configuration."""
+    global PROFILE, METHOD, AUTO_PASTE, HEARTBEAT_SECONDS, COALESCE_MAX_BATCH
+    global COALESCE_WAIT_SECONDS, SUBSTITUTIONS, ASSETS, CONFIG_VERSION, INJECTOR, INJECTOR_KIND
+    global PACER, CLIENT_MAX_INFLIGHT_CHARS, RELAY, MIRROR_JUMPS, HISTORY, QUEUE_MAX_JOBS, MACROS
+    if compiled.injector != INJECTOR_KIND:
+        INJECTOR = make_injector(compiled.injector)
+        INJECTOR_KIND = compiled.injector
+    PROFILE = compiled.profile
+    METHOD = compiled.method
+    AUTO_PASTE = compiled.auto_paste
+    HEARTBEAT_SECONDS = compiled.heartbeat_seconds
+    COALESCE_MAX_BATCH = compiled.coalesce_max_batch
+    COALESCE_WAIT_SECONDS = compiled.coalesce_wait_seconds
+    PACER = compiled.pacer
+    CLIENT_MAX_INFLIGHT_CHARS = compiled.client_max_inflight_chars
+    RELAY = compiled.relay
+    limits = compiled.admission
+    ADMISSION.configure(limits["address_rate"], limits["address_burst"], limits["token_rate"],
+                        limits["token_burst"], limits["lockout_after"],
+                        limits["lockout_max_seconds"])
+    QUEUE_MAX_JOBS = limits["max_queued"] or float("inf")
+    MIRROR_JUMPS = compiled.mirror_jumps
+    if METHOD == "auto" and not COSTS.calibrated:
+        threading.Thread(target=COSTS.calibrate, name="calibrate", daemon=True).start()
+    HISTORY = history_log(PROFILE_NAME, compiled.history_max_entries,
+                          compiled.history_max_age) if compiled.history_max_entries else None
+    MACROS = compiled.macros
+    SUBSTITUTIONS = compiled.substitutions
+    ASSETS = compiled.assets
+    CONFIG_VERSION = compiled.version
+
+
+def reload_config():
+    """Re-read the config file and switch to its version of the profile."""
+    try:
+        with open(CONFIG_PATH) as f:
+            config = json.load(f)
+        profile = config.get("profiles", {}).get(PROFILE_NAME)
+        if not isinstance(profile, dict):
+            raise ConfigError(f"profile '{PROFILE_NAME}' is missing")
+        for key in RESTART_KEYS:
+            if profile.get(key) != PROFILE.get(key):
+                print(f"  Config: '{key}' only changes on restart.", file=sys.stderr)
+                profile[key] = PROFILE.get(key)
+                if profile[key] is None:
+                    del profile[key]
+        compiled = compile_profile(profile)
+    except (OSError, ValueError, ConfigError) as e:
+        print(f"  Config not reloaded: {e}", file=sys.stderr)
+        return
+    if compiled.profile == PROFILE:
+        return
+    old_version = CONFIG_VERSION
+    apply_profile(compiled)
+    print(f"  Config reloaded (profile {PROFILE_NAME}).")
+    if CONFIG_VERSION != old_version:
+        HUB.publish("config", {"version": CONFIG_VERSION})
+
+
+# struct inotify_event {int wd; uint32_t mask, cookie, len; char name[];}
+_INOTIFY_EVENT = struct.Struct("iIII")
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+
+
+class ConfigWatcher:
+    """Calls on_change when the file at path changes, or on notify()."""
+
+    POLL_SECONDS = 1.0
+    SETTLE_SECONDS = 0.1  # editors save in several steps
+
+    def __init__(self, path, on_change):
+        self.path = path
+        self.name = os.fsencode(os.path.basename(path))
+        self.on_change = on_change
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_w, False)
+        self.inotify = self._inotify(os.path.dirname(path))
+        self.stamp = self._stamp()
+
+    @staticmethod
+    def _inotify(directory):
+        """An inotify fd watching directory, or None where that's unavailable.
+
+        The directory rather than the file: editors replace it by renaming.
+        """
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(directory),
+                                  IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _drain_inotify(self):
+        """Read pending events. Return whether any was about our file."""
+        hit = False
+        while True:
+            try:
+                data = os.read(self.inotify, 4096)
+            except BlockingIOError:
+                return hit
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+                start = offset + _INOTIFY_EVENT.size
+                hit = hit or data[start:start + length].rstrip(b"\0") == self.name
+                offset = start + length
+
+    def notify(self, *_):
+        """Request a reload; safe to call from a signal handler."""
+        try:
+            os.write(self.wake_w, b"x")
+        except BlockingIOError:
+            pass
+
+    def start(self):
+        threading.Thread(target=self._run, name="config-watcher", daemon=True).start()
+        return self
+
+    def _run(self):
+        fds = [self.wake_r] if self.inotify is None else [self.wake_r, self.inotify]
+        timeout = self.POLL_SECONDS if self.inotify is None else None
+        while True:
+            ready, _, _ = select.select(fds, [], [], timeout)
+            changed = False
+            if self.wake_r in ready:
+                os.read(self.wake_r, 512)
+                changed = True
+            if self.inotify is not None and self.inotify in ready:
+                changed = self._drain_inotify() or changed
+            if self.inotify is None and self._stamp() != self.stamp:
+                changed = True
+            if not changed:
+                continue
+            time.sleep(self.SETTLE_SECONDS)
+            if self.inotify is not None:
+                self._drain_inotify()
+            self.stamp = self._stamp()
+            try:
+                self.on_change()
+            except Exception as e:
+                print(f"  Config reload failed: {e}", file=sys.stderr)
+
+
+# --- Async HTTP server ---
+#
+# An alternative to Werkzeug's development server for long sessions. One
+# asyncio event loop owns every connection: it parses requests, keeps idle
+# HTTP/1.1 connections open without a thread each, and hands each request to
+# the Flask app on a pool of ASYNC_WORKERS threads. Streaming responses
+# (/events, job events) are pulled, and WebSocket upgrades served on their
+# detached socket, by a second pool, so long-lived streams can't take the
+# app's threads. A detached socket still counts as a connection until its
+# thread is done, so neither pool can grow past ASYNC_MAX_CONNECTIONS.
+
+ASYNC_WORKERS = 8             # concurrent app calls; more requests wait their turn
+ASYNC_MAX_CONNECTIONS = 128   # further connections get a 503
+ASYNC_KEEPALIVE_SECONDS = 75  # idle keep-alive connections are closed after this
+ASYNC_MAX_HEADER_BYTES = 64 * 1024
+ASYNC_DRAIN_BYTES = 1 << 20   # unread body left by the app; above this, close instead
+
+
+class _AsyncBody:
+    """Blocking, file-like request body for the app thread, read on the loop."""
+
+    def __init__(self, loop, reader, length, chunked):
+        self.loop = loop
+        self.reader = reader
+        self.remaining = length      # bytes left (identity) or in this chunk (chunked)
+        self.chunked = chunked
+        self.eof = not chunked and not length
+
+    async def _read(self, size):
+        if self.eof:
+            return b""
+        if self.chunked and self.remaining == 0:
+            line = await self.reader.readline()
+            self.remaining = int(line.split(b";")[0].strip() or b"0", 16)
+            if self.remaining == 0:
+                while (await self.reader.readline()).strip():
+                    pass  # trailers
+                self.eof = True
+                return b""
+        data = await self.reader.read(min(size, self.remaining))
+        if not data:
+            raise ConnectionError("client closed during request body")
+        self.remaining -= len(data)
+        if self.remaining == 0:
+            if self.chunked:
+                await self.reader.readexactly(2)  # CRLF after the chunk
+            else:
+                self.eof = True
+        return data
+
+    async def _read_all(self, limit=None):
+        parts = []
+        total = 0
+        while not self.eof:
+            data = await self._read(64 * 1024)
+            total += len(data)
+            if limit is not None and total > limit:
+                raise ConnectionError("request body too large to drain")
+            parts.append(data)
+        return b"".join(parts)
+
+    def read(self, size=-1):
+        if size == 0:
+            return b""
+        if size is None or size < 0:
+            coro = self._read_all()
+        else:
+            coro = self._read(size)
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def readline(self, size=-1):
+        line = b""
+        while not line.endswith(b"\n") and (size < 0 or len(line) < size):
+            c = self.read(1)
+            if not c:
+                break
+            line += c
+        return line
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+class AsyncServer:
+    def __init__(self, wsgi_app, host, port, workers=ASYNC_WORKERS,
+                 max_connections=ASYNC_MAX_CONNECTIONS, keepalive=ASYNC_KEEPALIVE_SECONDS):
+        self.app = wsgi_app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.keepalive = keepalive
+        self.max_connections = max_connections
+        self.connections = 0  # open on the loop, plus detached ones still being served
+        self.pool = futures.ThreadPoolExecutor(workers, thread_name_prefix="async-app")
+        self.streams = futures.ThreadPoolExecutor(max_connections, thread_name_prefix="async-stream")
+        self.detached = set()  # sockets handed to a stream thread
+
+    def serve_forever(self):
+        try:
+            asyncio.run(self._main())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._shutdown()
+
+    def _shutdown(self):
+        """Let the pools' threads end, since exiting waits for them."""
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.streams.shutdown(wait=False, cancel_futures=True)
+        for sock in list(self.detached):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        HUB.publish("shutdown", {})  # wakes /events streams waiting for their next event
+
+    async def _main(self):
+        server = await asyncio.start_server(self._connection, self.host, self.port,
+                                            limit=ASYNC_MAX_HEADER_BYTES, reuse_address=True)
+        async with server:
+            await server.serve_forever()
+
+    def _release(self, _=None):
+        self.connections -= 1
+
+    async def _connection(self, reader, writer):
+        if self.connections >= self.max_connections:
+            writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n"
+                         b"Connection: close\r\n\r\n")
+            await self._close(writer)
+            return
+        self.connections += 1
+        detached = False
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keepalive)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                        asyncio.LimitOverrunError, ConnectionError):
+                    return
+                keep, detached = await self._request(reader, writer, head)
+                if not keep:
+                    return
+        finally:
+            if not detached:  # else released once its thread is done
+                self._release()
+                await self._close(writer)
+
+    @staticmethod
+    async def _close(writer):
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    def _environ(self, writer, head):
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, version = lines[0].split(" ", 2)
+        path, _, query = target.partition("?")
+        peer = writer.get_extra_info("peername") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": urllib.parse.unquote(path, "latin-1"),
+            "QUERY_STRING": query,
+            "SERVER_NAME": self.host,
+            "SERVER_PORT": str(self.port),
+            "SERVER_PROTOCOL": version,
+            "REMOTE_ADDR": peer[0],
+            "REMOTE_PORT": str(peer[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+            "wsgi.input_terminated": True,
+        }
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, _, value = line.partition(":")
+            key = name.strip().upper().replace("-", "_")
+            if key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                environ[key] = value.strip()
+            else:
+                key = "HTTP_" + key
+                value = value.strip()
+                environ[key] = environ[key] + "," + value if key in environ else value
+        return environ
+
+    async def _request(self, reader, writer, head):
+        """Serve one request. Return (keep_alive, connection_detached)."""
+        loop = asyncio.get_running_loop()
+        try:
+            environ = self._environ(writer, head)
+        except ValueError:
+            writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            return False, False
+        version = environ["SERVER_PROTOCOL"]
+        conn_header = environ.get("HTTP_CONNECTION", "").lower()
+        keep = "close" not in conn_header if version == "HTTP/1.1" else "keep-alive" in conn_header
+        chunked = "chunked" in environ.get("HTTP_TRANSFER_ENCODING", "").lower()
+        try:
+            length = 0 if chunked else int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+        body = _AsyncBody(loop, reader, length, chunked)
+        environ["wsgi.input"] = body
+
+        if "upgrade" in conn_header and environ.get("HTTP_UPGRADE", "").lower() == "websocket":
+            # Hand the raw socket to a thread; the app speaks WebSocket on it.
+            writer.transport.pause_reading()
+            ts = writer.get_extra_info("socket")
+            sock = socket.socket(ts.family, ts.type, fileno=os.dup(ts.fileno()))
+            sock.setblocking(True)
+            writer.transport.abort()
+            environ["werkzeug.socket"] = sock
+            self.detached.add(sock)
+            loop.run_in_executor(self.streams, self._run_detached, environ, sock
+                                 ).add_done_callback(self._release)
+            return False, True
+
+        try:
+            status, headers, payload, stream = await loop.run_in_executor(
+                self.pool, self._call_app, environ)
+        except Exception as e:
+            print(f"Request failed: {e}", file=sys.stderr)
+            status, headers, payload, stream = "500 Internal Server Error", [
+                ("Content-Type", "text/plain")], b"Internal Server Error", None
+
+        names = {k.lower() for k, _ in headers}
+        chunked_out = stream is not None and "content-length" not in names
+        if chunked_out and version == "HTTP/1.1":
+            headers.append(("Transfer-Encoding", "chunked"))
+        elif chunked_out:
+            keep = chunked_out = False  # HTTP/1.0: the end of the body is the close
+        elif stream is None and "content-length" not in names:
+            headers.append(("Content-Length", str(len(payload))))
+        headers.append(("Connection", "keep-alive" if keep else "close"))
+        writer.write((f"{version} {status}\r\n" + "".join(
+            f"{k}: {v}\r\n" for k, v in headers) + "\r\n").encode("latin-1"))
+        head_only = environ["REQUEST_METHOD"] == "HEAD"
+        try:
+            if stream is None:
+                if not head_only:
+                    writer.write(payload)
+                await writer.drain()
+            else:
+                await self._write_stream(writer, stream, chunked_out, head_only)
+        except ConnectionError:
+            return False, False
+
+        if keep and not body.eof:
+            try:
+                await body._read_all(ASYNC_DRAIN_BYTES)
+            except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+                keep = False
+        return keep, False
+
+    async def _write_stream(self, writer, stream, chunked_out, head_only):
+        """Copy a streaming body to the client.
+
+        A producer thread iterates the app's response (which may block
+        between events) and hands chunks over through a small queue.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue(8)
+        stop = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                for chunk in stream:
+                    if stop.is_set():
+                        break
+                    asyncio.run_coroutine_threadsafe(chunks.put(chunk), loop).result()
+            except Exception as e:
+                print(f"Streaming response failed: {e}", file=sys.stderr)
+            finally:
+                if hasattr(stream, "close"):
+                    stream.close()
+                if not stop.is_set():
+                    asyncio.run_coroutine_threadsafe(chunks.put(done), loop)
+
+        loop.run_in_executor(self.streams, produce)
+        try:
+            while True:
+                chunk = await chunks.get()
+                if chunk is done:
+                    break
+                if not chunk or head_only:
+                    continue
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk) if chunked_out else chunk)
+                await writer.drain()
+            if chunked_out and not head_only:
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+        finally:
+            stop.set()
+            while not chunks.empty():
+                chunks.get_nowait()  # unblock a producer waiting on a full queue
+
+    def _call_app(self, environ):
+        """Run the app. Buffer the body if it has a Content-Length, else stream it."""
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = status
+            started["headers"] = list(headers)
+            return lambda data: started.setdefault("written", []).append(data)
+
+        result = self.app(environ, start_response)
+        headers = started["headers"]
+        if any(k.lower() == "content-length" for k, _ in headers) or isinstance(result, list):
+            try:
+                payload = b"".join(started.get("written", [])) + b"".join(result)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+            return started["status"], headers, payload, None
+        return started["status"], headers, None, result
+
+    def _run_detached(self, environ, sock):
+        try:
+            result = self.app(environ, lambda status, headers, exc_info=None: None)
+            if hasattr(result, "close"):
+                result.close()
+        except ConnectionError:
+            pass  # the app finished with the connection
+        except Exception as e:
+            print(f"WebSocket request failed: {e}", file=sys.stderr)
+        finally:
+            self.detached.discard(sock)
+            sock.close()
 
 
 def main():
-    global METHOD, USE_TOKEN, PERMANENT_LINK, AUTO_PASTE, TOKEN, PROFILE
+    global USE_TOKEN, PERMANENT_LINK, TOKEN, PROFILE_NAME, CLI_OVERRIDES
+    import argparse
     parser = argparse.ArgumentParser(description="Type on your phone, paste on your desktop.")
-    parser.add_argument("--method", choices=["clipboard", "type"], default=None,
-                        help="Override profile method. type: ydotool type. clipboard: wl-copy only.")
+    parser.add_argument("--method", choices=["clipboard", "type", "auto"], default=None,
+                        help="Override profile method. type: ydotool type. clipboard: wl-copy only. "
+                             "auto: type or paste each part of the text, whichever is quicker.")
+    parser.add_argument("--injector", choices=["auto", "socket", "subprocess"], default=None,
+                        help="Override profile injector. auto: ydotoold socket with ydotool "
+                             "fallback. socket: socket only. subprocess: spawn ydotool per send.")
+    parser.add_argument("--server", choices=["werkzeug", "async"], default=None,
+                        help="Override profile server. werkzeug: Flask's development server. "
+                             "async: built-in asyncio server with keep-alive and a bounded thread pool.")
     parser.add_argument("--port", type=int, default=None,
                         help="Override profile port (default: 5123)")
     parser.add_argument("--profile", default=None,
@@ -481,13 +5093,22 @@ def main():
     parser.add_argument("--permanent-link-refresh", action="store_true",
                         help="Replace the stored permanent token with a new one. "
                              "Implies --permanent-link.")
+    parser.add_argument("--startup-trace", action="store_true",
+                        help="Print how long each phase of startup took.")
     args = parser.parse_args()
+    trace = StartupTrace(args.startup_trace)
 
-    PROFILE, profile_name, full_config = load_or_create_config(args.profile)
+    profile, profile_name, full_config = load_or_create_config(args.profile)
 
     # CLI flags override profile, profile overrides built-in defaults
-    METHOD = args.method or PROFILE.get("method", "type")
-    AUTO_PASTE = PROFILE.get("auto_paste", False)
+    PROFILE_NAME = profile_name
+    CLI_OVERRIDES = {"method": args.method, "injector": args.injector}
+    try:
+        apply_profile(compile_profile(profile))
+    except ConfigError as e:
+        print(f"Error in profile '{profile_name}' of {CONFIG_PATH}: {e}", file=sys.stderr)
+        sys.exit(1)
+    trace.mark("config")
     USE_TOKEN = PROFILE.get("use_security_token", True)
     PERMANENT_LINK = args.permanent_link or args.permanent_link_refresh
 
@@ -515,6 +5136,7 @@ def main():
 
     host = get_lan_ip()
     port = args.port or PROFILE.get("port", 5123)
+    trace.mark("lan ip")
 
     base_url = f"http://{host}:{port}/"
     token_url = f"{base_url}?token={TOKEN}" if USE_TOKEN else base_url
@@ -534,13 +5156,26 @@ def main():
         qr_url = token_url
         print(f"\n  URL: {token_url}\n")
 
-    qr = qrcode.QRCode(box_size=1, border=1)
-    qr.add_data(qr_url)
-    qr.make(fit=True)
-    qr.print_ascii(invert=True)
+    sys.stdout.write(render_qr(qr_url, cache=qr_url == base_url))
     print()
+    sys.stdout.flush()
+    trace.mark("qr code")
 
-    app.run(host=host, port=port, debug=False)
+    watcher = ConfigWatcher(CONFIG_PATH, reload_config).start()
+    signal.signal(signal.SIGHUP, watcher.notify)
+    trace.mark("config watcher")
+    wsgi_app = app.load()
+    trace.mark("flask")
+
+    if (args.server or PROFILE.get("server", "werkzeug")) == "async":
+        server = AsyncServer(wsgi_app, host, port)
+        trace.mark("async server")
+        trace.report()
+        print(f"  Serving on http://{host}:{port}/ (async server)")
+        server.serve_forever()
+    else:
+        trace.report()
+        wsgi_app.run(host=host, port=port, debug=False)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,18 @@
+"""Fixtures shared by the tests: the server script, imported as a module."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+
+from harness import load_server  # noqa: E402
+
+
+@pytest.fixture
+def srv(tmp_path, monkeypatch):
+    """input-from-web.py as a module, keeping anything it writes in tmp_path."""
+    mod = load_server()
+    monkeypatch.setattr(mod, "HISTORY_DIR", str(tmp_path))
+    return mod
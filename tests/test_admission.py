@@ -0,0 +1,36 @@
+"""Which requests admission control applies to."""
+
+import pytest
+
+
+@pytest.fixture
+def client(srv, monkeypatch):
+    monkeypatch.setattr(srv, "USE_TOKEN", True)
+    monkeypatch.setattr(srv, "TOKEN", "secret")
+    monkeypatch.setattr(srv, "ADMISSION", srv.Admission())
+    return srv.app.test_client()
+
+
+def test_locked_out_address_can_still_load_the_page(srv, client):
+    for _ in range(srv.ADMISSION.lockout.after):
+        assert client.get("/clients?token=wrong").status_code == 403
+    assert client.get("/clients?token=secret").status_code == 429
+    assert client.get("/").status_code == 200
+    assert client.get("/config.js").status_code == 200
+    assert client.get("/ping").status_code == 200
+
+
+def test_missing_token_is_not_a_failed_attempt(srv, client):
+    for _ in range(3 * srv.ADMISSION.lockout.after):
+        assert client.get("/clients").status_code == 403
+        assert client.get("/clients?token=").status_code == 403
+    assert client.get("/clients?token=secret").status_code == 200
+    assert not srv.ADMISSION.lockout.misses
+
+
+def test_page_requests_skip_the_address_rate(srv, client):
+    srv.ADMISSION.configure(1, 1, 0, 0, 5, 900)
+    assert client.get("/clients?token=secret").status_code == 200
+    assert client.get("/clients?token=secret").status_code == 429
+    for _ in range(5):
+        assert client.get("/").status_code == 200
@@ -0,0 +1,65 @@
+"""Connection accounting of the asyncio server."""
+
+import base64
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+
+def upgrade(port):
+    s = socket.create_connection(("127.0.0.1", port))
+    key = base64.b64encode(os.urandom(16)).decode()
+    s.sendall(f"GET /stream HTTP/1.1\r\nHost: x\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+              f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n".encode())
+    assert s.recv(4096).startswith(b"HTTP/1.1 101")
+    return s
+
+
+def status(port):
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        s.sendall(b"GET /ping HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+        return s.recv(4096).split(b" ")[1]
+
+
+@pytest.fixture
+def server(srv, monkeypatch):
+    monkeypatch.setattr(srv, "USE_TOKEN", False)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = srv.AsyncServer(srv.app, "127.0.0.1", port, max_connections=2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            break
+        except OSError:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+    return server
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def test_websockets_count_against_the_connection_limit(server):
+    wait_for(lambda: server.connections == 0)
+    sockets = [upgrade(server.port), upgrade(server.port)]
+    try:
+        assert server.connections == 2
+        assert status(server.port) == b"503"
+        sockets.pop().close()
+        wait_for(lambda: server.connections == 1)
+        assert status(server.port) == b"200"
+    finally:
+        for s in sockets:
+            s.close()
+    wait_for(lambda: not server.detached)
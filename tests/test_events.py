@@ -0,0 +1,23 @@
+"""Access to the /events stream."""
+
+
+def test_events_need_the_token(srv, monkeypatch):
+    monkeypatch.setattr(srv, "USE_TOKEN", True)
+    monkeypatch.setattr(srv, "TOKEN", "secret")
+    client = srv.app.test_client()
+    assert client.get("/events").status_code == 403
+    assert client.get("/events?token=wrong").status_code == 403
+    r = client.get("/events?token=secret", buffered=False)
+    assert r.status_code == 200
+    r.close()
+
+
+def test_subscribers_are_capped(srv, monkeypatch):
+    monkeypatch.setattr(srv, "USE_TOKEN", False)
+    monkeypatch.setattr(srv.EventHub, "MAX_SUBSCRIBERS", 2)
+    held = [srv.HUB.subscribe() for _ in range(2)]
+    r = srv.app.test_client().get("/events")
+    assert r.status_code == 503
+    assert r.headers["Retry-After"]
+    srv.HUB.unsubscribe(held[0])
+    assert srv.HUB.subscribe() is not None
@@ -0,0 +1,108 @@
+"""The send history log and its offset index."""
+
+import os
+import time
+
+import pytest
+
+TEXTS = ["first", "with\nnewline", "ünïcödé 😀", "", "x" * 5000] + [f"entry {i}" for i in range(40)]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "history.log")
+
+
+def all_entries(log, limit=7, **search):
+    """Every entry, newest first, following "next" from page to page."""
+    entries, cursor = [], None
+    while True:
+        page = log.page(cursor, limit, **search)
+        entries += page["entries"]
+        cursor = page["next"]
+        if cursor is None:
+            return entries
+
+
+def check_index(path):
+    """The index holds exactly the offset of every line in the log."""
+    with open(path, "rb") as f:
+        lines = f.read().splitlines(keepends=True)
+    offsets = [sum(map(len, lines[:i])) for i in range(len(lines))]
+    with open(path + ".idx", "rb") as f:
+        data = f.read()
+    assert [int.from_bytes(data[i:i + 8], "little") for i in range(0, len(data), 8)] == offsets
+
+
+def test_pages_return_every_entry_in_order(srv, path):
+    log = srv.HistoryLog(path)
+    ids = [log.append(text, "c") for text in TEXTS]
+    assert ids == list(range(1, len(TEXTS) + 1))
+    check_index(path)
+    for reader in (log, srv.HistoryLog(path)):  # live, and loaded from the index
+        entries = all_entries(reader)
+        assert [e["text"] for e in entries] == TEXTS[::-1]
+        assert [e["id"] for e in entries] == ids[::-1]
+
+
+def test_search(srv, path):
+    log = srv.HistoryLog(path)
+    for text in TEXTS:
+        log.append(text)
+    assert [e["text"] for e in all_entries(log, 3, query="ENTRY 1")] == \
+        [t for t in TEXTS[::-1] if "entry 1" in t]
+    assert [e["text"] for e in all_entries(log, query="ü", prefix=True)] == ["ünïcödé 😀"]
+
+
+def test_torn_last_line_is_dropped_on_load(srv, path):
+    log = srv.HistoryLog(path)
+    for text in TEXTS[:3]:
+        log.append(text)
+    with open(path, "ab") as f:
+        f.write(b'{"id": 4, "te')  # crashed mid-write, before the index
+    reopened = srv.HistoryLog(path)
+    assert [e["text"] for e in all_entries(reopened)] == TEXTS[:3][::-1]
+    assert reopened.append("after") == 4
+    check_index(path)
+
+
+@pytest.mark.parametrize("damage", ["missing", "short", "garbage"])
+def test_bad_index_is_rebuilt(srv, path, damage):
+    log = srv.HistoryLog(path)
+    for text in TEXTS:
+        log.append(text)
+    if damage == "missing":
+        os.remove(path + ".idx")
+    else:
+        with open(path + ".idx", "r+b") as f:
+            if damage == "short":
+                f.truncate(os.path.getsize(path + ".idx") - 8)  # log written, index not
+            else:
+                f.write(b"\xff" * 8)
+    assert [e["text"] for e in all_entries(srv.HistoryLog(path))] == TEXTS[::-1]
+    check_index(path)
+
+
+def test_oldest_entries_are_dropped_past_max_entries(srv, path):
+    log = srv.HistoryLog(path, max_entries=10)
+    for text in TEXTS:
+        log.append(text)
+    check_index(path)
+    for reader in (log, srv.HistoryLog(path, max_entries=10)):
+        entries = all_entries(reader)
+        assert 10 <= len(entries) <= 12
+        assert [e["text"] for e in entries] == TEXTS[::-1][:len(entries)]
+        assert entries[0]["id"] == len(TEXTS)  # numbers are kept
+        assert reader.page()["first"] == entries[-1]["id"]
+
+
+def test_entries_past_max_age_are_dropped(srv, path):
+    log = srv.HistoryLog(path, max_age=0.2)
+    for text in TEXTS[:5]:
+        log.append(text)
+    time.sleep(0.3)
+    log.age_checked = 0  # don't wait for the hourly check
+    log.append("new")
+    assert [e["text"] for e in all_entries(log)] == ["new"]
+    assert log.page()["first"] == 6
+    check_index(path)
@@ -0,0 +1,57 @@
+"""The resident injector's fallback to the ydotool CLI."""
+
+import pytest
+
+
+class Recorder:
+    """Fallback injector that records what it is asked to type."""
+
+    def __init__(self):
+        self.calls = []
+
+    def type_text(self, text, key_delay=0.0):
+        self.calls.append(("type_text", text, key_delay))
+
+    def key(self, chord, count=1):
+        self.calls.append(("key", chord, count))
+
+
+def dying_socket(srv, writes):
+    """A YdotoolSocket whose connection breaks after `writes` writes."""
+    conn = srv.YdotoolSocket("/nonexistent")
+    conn.sock = object()
+    left = [writes]
+
+    def write(data):
+        if not left[0]:
+            raise BrokenPipeError("ydotoold went away")
+        left[0] -= 1
+
+    conn._write = write
+    conn.close = lambda: None
+    return conn
+
+
+@pytest.mark.parametrize("writes", [0, 3, 5])
+def test_fallback_types_only_what_the_socket_missed(srv, writes):
+    fallback = Recorder()
+    injector = srv.ResidentInjector(fallback=fallback)
+    injector.conn = dying_socket(srv, writes)
+    injector.type_text("hello")
+    assert fallback.calls == ([("type_text", "hello"[writes:], 0.0)] if writes < 5 else [])
+
+
+def test_fallback_counts_skipped_characters_as_done(srv):
+    fallback = Recorder()
+    injector = srv.ResidentInjector(fallback=fallback)
+    injector.conn = dying_socket(srv, 2)
+    injector.type_text("aébcd")  # é has no key and is skipped, not written
+    assert fallback.calls == [("type_text", "cd", 0.0)]
+
+
+def test_fallback_presses_the_remaining_keys(srv):
+    fallback = Recorder()
+    injector = srv.ResidentInjector(fallback=fallback)
+    injector.conn = dying_socket(srv, 2)
+    injector.key("backspace", 5)
+    assert fallback.calls == [("key", "backspace", 3)]
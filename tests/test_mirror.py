@@ -0,0 +1,101 @@
+"""Mirror mode: the diff and the keys that apply it."""
+
+import random
+
+import pytest
+
+
+class Field:
+    """A text field as the desktop app would see the keys edit_keys() sends."""
+
+    def __init__(self, text="", cursor=None):
+        self.text = text
+        self.cursor = len(text) if cursor is None else cursor
+
+    def key(self, name, count=1):
+        for _ in range(count):
+            if name == "left":
+                self.cursor = max(0, self.cursor - 1)
+            elif name == "right":
+                self.cursor = min(len(self.text), self.cursor + 1)
+            elif name == "ctrl+home":
+                self.cursor = 0
+            elif name == "ctrl+end":
+                self.cursor = len(self.text)
+            elif name == "backspace":
+                if self.cursor:
+                    self.text = self.text[:self.cursor - 1] + self.text[self.cursor:]
+                    self.cursor -= 1
+            else:
+                raise AssertionError(f"unexpected key {name}")
+
+    def type_text(self, text):
+        self.text = self.text[:self.cursor] + text + self.text[self.cursor:]
+        self.cursor += len(text)
+
+
+def apply(srv, old, new, cursor, jumps=True):
+    field = Field(old, cursor)
+    steps, end_cursor = srv.edit_keys(srv.diff_hunks(old, new), cursor, len(old), jumps)
+    for step in steps:
+        if step[0] == "type":
+            field.type_text(step[1])
+        else:
+            field.key(step[1], step[2])
+    assert field.text == new
+    assert field.cursor == end_cursor
+    return steps
+
+
+def lcs(a, b):
+    row = [0] * (len(b) + 1)
+    for x in a:
+        prev = 0
+        for j, y in enumerate(b):
+            prev, row[j + 1] = row[j + 1], prev + 1 if x == y else max(row[j + 1], row[j])
+    return row[-1]
+
+
+EDGE_CASES = [
+    ("", ""),
+    ("", "hello"),
+    ("hello", ""),
+    ("hello", "hello"),
+    ("hello", "hello world"),  # pure insert at the end
+    ("world", "hello world"),  # pure insert at the start
+    ("hello world", "hello"),  # pure delete
+    ("hello world", "world"),
+    ("the cat sat", "the bat sat"),
+    ("aaaa", "aa"),
+    ("abab", "baba"),
+    ("café", "cafe"),
+    ("naïve 😀 text", "naive 😀😀 text!"),
+    ("x" * 600, "y" * 600),  # past MIRROR_MAX_EDITS: retyped as one hunk
+]
+
+
+@pytest.mark.parametrize("old, new", EDGE_CASES)
+@pytest.mark.parametrize("jumps", [True, False])
+def test_edge_cases(srv, old, new, jumps):
+    for cursor in {0, len(old) // 2, len(old)}:
+        apply(srv, old, new, cursor, jumps)
+
+
+def test_random_edits_reproduce_the_text_with_a_shortest_diff(srv):
+    rng = random.Random(20)
+    for _ in range(2000):
+        old = "".join(rng.choice("abc é") for _ in range(rng.randint(0, 12)))
+        new = "".join(rng.choice("abc é") for _ in range(rng.randint(0, 12)))
+        apply(srv, old, new, rng.randint(0, len(old)), rng.random() < 0.5)
+        edits = sum(end - start + len(text) for start, end, text in srv.diff_hunks(old, new))
+        assert edits == len(old) + len(new) - 2 * lcs(old, new)
+
+
+def test_mirror_job_keeps_the_field_in_sync(srv, monkeypatch):
+    field = Field()
+    monkeypatch.setattr(srv, "INJECTOR", field)
+    client = srv.CLIENTS.get("mirror-test")
+    for text in ["helo wrld", "hello world", "hello wörld, again", "", "fresh start"]:
+        srv.MirrorJob(text, client).run()
+        # Characters without a key are left out, as the injector would skip them.
+        assert field.text == "".join(c for c in text if c in srv.KEYMAP)
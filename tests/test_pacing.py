@@ -0,0 +1,32 @@
+"""Typing pace with an injector that spawns ydotool per call."""
+
+import pytest
+
+
+class SpawningInjector:
+    """Records calls the way SubprocessInjector would make them."""
+
+    spawns = True
+
+    def __init__(self):
+        self.calls = []
+
+    def type_text(self, text, key_delay=0.0):
+        self.calls.append((text, key_delay))
+
+
+@pytest.mark.parametrize("mode", ["steady", "bursts"])
+def test_one_call_per_line_not_per_keystroke(srv, monkeypatch, mode):
+    injector = SpawningInjector()
+    monkeypatch.setattr(srv, "INJECTOR", injector)
+    monkeypatch.setattr(srv, "PACER", srv.TypingPacer(1000, burst=4, bursts=mode == "bursts"))
+    srv.type_paced("first line\nsecond")
+    assert injector.calls == [("first line\n", 0.001), ("second", 0.001)]
+
+
+def test_resident_injector_spawns_only_while_falling_back(srv):
+    assert not srv.ResidentInjector(fallback=srv.SubprocessInjector()).spawns
+    injector = srv.ResidentInjector(fallback=srv.SubprocessInjector())
+    injector._down_until = float("inf")
+    assert injector.spawns
+    assert not srv.ResidentInjector().spawns
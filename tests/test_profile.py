@@ -0,0 +1,46 @@
+"""Profile validation."""
+
+import copy
+
+import pytest
+
+INTEGER_FIELDS = [
+    ("port",),
+    ("history", "max_entries"),
+    ("coalesce", "max_batch"),
+    ("clients", "max_inflight_chars"),
+    ("admission", "address_burst"),
+    ("admission", "max_queued"),
+    ("relay", "retries"),
+    ("typing", "burst"),
+]
+
+
+def default_profile(srv):
+    return copy.deepcopy(srv.DEFAULT_CONFIG["profiles"]["default"])
+
+
+def test_default_profile_is_valid(srv):
+    srv.validate_profile(default_profile(srv))
+
+
+@pytest.mark.parametrize("path", INTEGER_FIELDS, ids=".".join)
+@pytest.mark.parametrize("value", [True, False])
+def test_integer_fields_reject_booleans(srv, path, value):
+    profile = default_profile(srv)
+    section = profile
+    for key in path[:-1]:
+        section = section.setdefault(key, {})
+    section[path[-1]] = value
+    with pytest.raises(srv.ConfigError):
+        srv.validate_profile(profile)
+
+
+@pytest.mark.parametrize("mode", ["streaming", "mirror"])
+def test_relay_only_profile_cannot_stream_or_mirror(srv, mode):
+    profile = default_profile(srv)
+    profile["relay"] = {"peers": ["http://127.0.0.1:9"], "local": False}
+    srv.validate_profile(profile)
+    profile.setdefault(mode, {})["enabled"] = True
+    with pytest.raises(srv.ConfigError):
+        srv.validate_profile(profile)
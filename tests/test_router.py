@@ -0,0 +1,84 @@
+"""Method "auto": route() against a brute-force search over all choices."""
+
+import itertools
+import random
+
+import pytest
+
+
+@pytest.fixture
+def costs(srv, monkeypatch):
+    monkeypatch.setattr(srv, "PACER", srv.TypingPacer())
+    return srv.CostModel()  # the uncalibrated defaults, the same on every machine
+
+
+def runs(srv, text):
+    """text split into (part, typable) runs, as route() splits it."""
+    out, pos = [], 0
+    for m in srv._UNTYPABLE.finditer(text):
+        if m.start() > pos:
+            out.append((text[pos:m.start()], True))
+        out.append((m.group(), False))
+        pos = m.end()
+    if pos < len(text):
+        out.append((text[pos:], True))
+    return out
+
+
+def cost(costs, segments):
+    return sum(costs.type_cost(len(part)) if method == "type"
+               else costs.paste_call + len(part) * costs.paste_char
+               for method, part in segments)
+
+
+def cheapest(srv, costs, text):
+    """The lowest cost of any valid type/paste choice per run."""
+    parts = runs(srv, text)
+    best = float("inf")
+    for choice in itertools.product(["type", "paste"], repeat=len(parts)):
+        if any(method == "type" and not typable for method, (_, typable) in zip(choice, parts)):
+            continue
+        segments = []
+        for method, (part, _) in zip(choice, parts):
+            if segments and segments[-1][0] == method:
+                segments[-1] = (method, segments[-1][1] + part)
+            else:
+                segments.append((method, part))
+        best = min(best, cost(costs, segments))
+    return best
+
+
+def check(srv, costs, text):
+    segments = srv.route(text, costs)
+    assert "".join(part for _, part in segments) == text
+    assert all(method == "paste" or not srv._UNTYPABLE.search(part) for method, part in segments)
+    assert all(a[0] != b[0] for a, b in zip(segments, segments[1:]))  # neighbours merged
+    return segments
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("", []),
+    ("hello world", [("type", "hello world")]),
+    ("😀", [("paste", "😀")]),
+    # Once something must be pasted, adding the plain text to it is cheaper than typing.
+    ("ok 😀", [("paste", "ok 😀")]),
+    ("é a é", [("paste", "é a é")]),
+])
+def test_simple_texts(srv, costs, text, expected):
+    assert check(srv, costs, text) == expected
+
+
+def test_random_mixtures_get_the_cheapest_route(srv, costs):
+    rng = random.Random(23)
+    for _ in range(300):
+        text = "".join(rng.choice(["a" * rng.randint(1, 400), "é" * rng.randint(1, 3)])
+                       for _ in range(rng.randint(1, 7)))
+        segments = check(srv, costs, text)
+        assert cost(costs, segments) == pytest.approx(cheapest(srv, costs, text))
+
+
+def test_slow_typing_pastes_long_plain_text(srv, costs, monkeypatch):
+    text = "plain text " * 20
+    assert check(srv, costs, text) == [("type", text)]
+    monkeypatch.setattr(srv, "PACER", srv.TypingPacer(20))  # 20 keys per second
+    assert check(srv, costs, text) == [("paste", text)]
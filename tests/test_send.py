@@ -0,0 +1,71 @@
+"""Request validation of /send and the other routes that take a JSON body."""
+
+import pytest
+
+
+@pytest.fixture
+def client(srv, monkeypatch):
+    monkeypatch.setattr(srv, "USE_TOKEN", False)
+    return srv.app.test_client()
+
+
+@pytest.mark.parametrize("body", [{"text": 5}, {"text": ["a"]}, ["hello"], "hello", 5])
+def test_malformed_body_is_a_400(client, body):
+    r = client.post("/send", json=body)
+    assert r.status_code == 400
+    assert "error" in r.get_json()
+
+
+@pytest.mark.parametrize("route", ["/paste", "/mirror", "/macro"])
+def test_relay_only_instance_refuses_local_routes(srv, client, monkeypatch, route):
+    monkeypatch.setattr(srv, "RELAY", srv.Relay(["http://127.0.0.1:9"], local=False))
+    r = client.post(route, json={"text": "hi", "steps": [["type", "hi"]]})
+    assert r.status_code == 409
+    assert not srv.QUEUE.jobs
+
+
+@pytest.mark.parametrize("body", [{"text": 5}, ["hello"], "hello", 5])
+def test_malformed_mirror_body_is_a_400(client, body):
+    r = client.post("/mirror", json=body)
+    assert r.status_code == 400
+    assert "error" in r.get_json()
+
+
+@pytest.mark.parametrize("body", [{"name": ["x"]}, {"name": 5}, ["x"], "x", 5])
+def test_malformed_macro_body_is_a_400(client, body):
+    r = client.post("/macro", json=body)
+    assert r.status_code == 400
+    assert "error" in r.get_json()
+
+
+@pytest.mark.parametrize("body", [{"text": 5}, ["hello"], "hello", 5])
+def test_malformed_route_body_is_a_400(client, body):
+    r = client.post("/route", json=body)
+    assert r.status_code == 400
+    assert "error" in r.get_json()
+
+
+@pytest.mark.parametrize("body", [{"text": 5}, ["hello"], "hello", 5])
+def test_malformed_substitute_body_is_a_400(client, body):
+    r = client.post("/substitute", json=body)
+    assert r.status_code == 400
+    assert "error" in r.get_json()
+
+
+@pytest.mark.parametrize("body", [{"text": 5}, ["hello"], "hello", 5])
+def test_malformed_history_body_is_a_400(client, body):
+    r = client.post("/history", json=body)
+    assert r.status_code == 400
+    assert "error" in r.get_json()
+
+
+@pytest.mark.parametrize("body", [{"name": 5}, {"name": ["x"]}, ["x"], "x", 5])
+def test_malformed_register_body_is_a_400(client, body):
+    r = client.post("/register", json=body)
+    assert r.status_code == 400
+    assert "error" in r.get_json()
+
+
+def test_register_issues_a_client_id(srv, client):
+    issued = client.post("/register", json={"name": "phone"}).get_json()["client"]
+    assert srv.CLIENTS.get(issued).name == "phone"
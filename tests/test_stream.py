@@ -0,0 +1,73 @@
+"""The /stream WebSocket loop, driven through a stand-in socket."""
+
+import json
+import threading
+import time
+
+
+class FakeWebSocket:
+    """Hands serve_stream() the queued messages, then reports the close."""
+
+    def __init__(self, *messages):
+        self.incoming = [json.dumps(m) for m in messages]
+        self.sent = []
+
+    def receive(self):
+        return self.incoming.pop(0) if self.incoming else None
+
+    def send(self, message):
+        self.sent.append(message)
+
+
+def test_full_queue_rejects_the_message_not_the_stream(srv, monkeypatch):
+    monkeypatch.setattr(srv, "QUEUE_MAX_JOBS", 0)
+    ws = FakeWebSocket(
+        {"type": "hello", "session": "full-queue"},
+        {"type": "text", "seq": 1, "text": "hello"},
+    )
+    srv.serve_stream(ws, srv.CLIENTS.get("stream-test"))
+    assert ws.sent[0]["type"] == "hello"
+    assert ws.sent[1] == {"type": "error", "seq": 1, "error": "queue_full", "retry_after": 1}
+
+
+def test_non_string_text_is_an_error_frame(srv):
+    ws = FakeWebSocket(
+        [1, 2],
+        {"type": "hello", "session": "bad-text"},
+        {"type": "text", "seq": 1, "text": 5},
+    )
+    srv.serve_stream(ws, srv.CLIENTS.get("stream-test"))
+    assert ws.sent[1] == {"type": "error", "seq": 1, "error": "text must be a string"}
+
+
+def test_push_resent_while_typing_is_typed_once(srv, monkeypatch):
+    typed, release = [], threading.Event()
+
+    def inject_text(text):
+        release.wait(5)
+        typed.append(text)
+
+    monkeypatch.setattr(srv, "inject_text", inject_text)
+    client = srv.CLIENTS.get("stream-test")
+    first = FakeWebSocket({"type": "hello", "session": "resend"}, {"type": "text", "seq": 1, "text": "hello "})
+    second = FakeWebSocket({"type": "hello", "session": "resend"}, {"type": "text", "seq": 1, "text": "hello "})
+    threads = [threading.Thread(target=srv.serve_stream, args=(ws, client)) for ws in (first, second)]
+    threads[0].start()
+    while not srv.QUEUE.jobs:
+        time.sleep(0.01)
+    threads[1].start()  # the phone reconnected before the push was acked
+    time.sleep(0.2)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert typed == ["hello "]
+    assert second.sent[0]["last"] == 0
+    assert first.sent[-1] == second.sent[-1] == {"type": "ack", "seq": 1}
+
+
+def test_closed_socket_ends_the_session(srv):
+    class Gone(FakeWebSocket):
+        def send(self, message):
+            raise BrokenPipeError()
+
+    srv.serve_stream(Gone({"type": "hello", "session": "gone"}), srv.CLIENTS.get("stream-test"))
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Compare resident-socket injection with spawning ydotool, against a fake ydotoold.
+
+    tools/bench_injector.py [--rounds 200] [--json]
+
+The subprocess column is only measured when a `ydotool` binary that honours
+$YDOTOOL_SOCKET is on PATH.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from fake_ydotoold import FakeYdotoold
+from harness import load_server, percentiles
+
+PHRASES = {
+    "short": "hello world",
+    "sentence": "The quick brown fox jumps over the lazy dog, twice!",
+    "paragraph": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 8,
+}
+
+
+def bench(inject, daemon, text, rounds):
+    samples = []
+    for _ in range(rounds):
+        daemon.reset()
+        t0 = time.perf_counter()
+        inject(text)
+        daemon.wait_for(len(text))
+        samples.append((time.perf_counter() - t0) * 1000)
+    return {k: round(v, 3) for k, v in percentiles(samples).items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--protocol", choices=["dgram", "stream"], default="dgram")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    srv = load_server()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ydotool.sock")
+        daemon = FakeYdotoold(path, args.protocol).start()
+        injector = srv.make_injector("socket", path)
+        for name, text in PHRASES.items():
+            results[f"socket/{name}"] = bench(injector.type_text, daemon, text, args.rounds)
+        if shutil.which("ydotool"):
+            env = dict(os.environ, YDOTOOL_SOCKET=path)
+
+            def spawn(text):
+                subprocess.run(["ydotool", "type", "--key-delay", "0", "--", text],
+                               check=True, timeout=30, env=env)
+
+            for name, text in PHRASES.items():
+                results[f"subprocess/{name}"] = bench(spawn, daemon, text, max(1, args.rounds // 10))
+        daemon.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, stats in results.items():
+            print(f"{name:24} " + "  ".join(f"{k}={v:.3f}ms" for k, v in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
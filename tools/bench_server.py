@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""Benchmark the server's request handling with ydotool and wl-copy stubbed out.
+
+    tools/bench_server.py [--stub inprocess|path|both] [--requests 200] [--json]
+    tools/bench_server.py --json > new.json && tools/bench_server.py --compare old.json new.json
+
+Drives the Flask app in-process through its WSGI interface, so the numbers
+are the cost of the handlers, the queue and the injection path, not of the
+network. Two kinds of stub:
+
+  inprocess  a fake injector object, and wl-copy answered without spawning
+  path       tiny ydotool / wl-copy scripts first on $PATH, with the
+             subprocess injector, so every injection pays a real fork+exec
+
+For /send, `latency` is the HTTP round trip (the text is only queued) and
+`complete` is from the request to the job finishing. `per_sec` counts
+messages typed per second for /send, responses for everything else.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from harness import REPO_DIR, load_server, percentiles
+
+PAYLOADS = {
+    "word": "hello",
+    "sentence": "The quick brown fox jumps over the lazy dog, twice!",
+    "paragraph": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 16,
+}
+METHODS = {
+    "type": ("type", False),
+    "clipboard": ("clipboard", False),
+    "clipboard+paste": ("clipboard", True),
+}
+PAGES = ["/", "/ping", "/icon.png"]
+
+STUB_SCRIPT = """#!/bin/sh
+# Stand-in for {name}: swallow whatever arrives on stdin and succeed.
+case " $* " in
+  *" --file "*|*" -o "*) exec cat >/dev/null ;;
+esac
+exit 0
+"""
+
+
+class FakeInjector:
+    """Injector that accepts everything at once."""
+
+    def __init__(self):
+        self.chars = 0
+        self.keys = 0
+
+    def type_text(self, text):
+        self.chars += len(text)
+
+    def key(self, chord, count=1):
+        self.keys += count
+
+    def type_chunks(self, chunks):
+        for chunk in chunks:
+            self.chars += len(chunk)
+
+
+class StubSubprocess:
+    """Stands in for the server's subprocess module: wl-copy returns at once."""
+
+    def __init__(self, real):
+        self._real = real
+
+    def __getattr__(self, name):
+        return getattr(self._real, name)
+
+    def run(self, args, **kwargs):
+        if args[0] == "wl-copy":
+            return self._real.CompletedProcess(args, 0)
+        return self._real.run(args, **kwargs)
+
+
+def install_stubs(srv, kind, tmp):
+    """Point the server at stubs of the given kind."""
+    if kind == "inprocess":
+        srv.INJECTOR = FakeInjector()
+        srv.subprocess = StubSubprocess(subprocess)
+        return
+    srv.subprocess = subprocess
+    bindir = os.path.join(tmp, "bin")
+    os.makedirs(bindir, exist_ok=True)
+    for name in ("ydotool", "wl-copy"):
+        path = os.path.join(bindir, name)
+        with open(path, "w") as f:
+            f.write(STUB_SCRIPT.format(name=name))
+        os.chmod(path, 0o755)
+    if not os.environ["PATH"].startswith(bindir + os.pathsep):
+        os.environ["PATH"] = bindir + os.pathsep + os.environ["PATH"]
+    srv.INJECTOR = srv.make_injector("subprocess")
+
+
+def run_clients(srv, concurrency, requests, request_once):
+    """Closed loop: each client issues its share of requests back to back."""
+    barrier = threading.Barrier(concurrency + 1)
+    results = [[] for _ in range(concurrency)]
+
+    def client(i):
+        c = srv.app.test_client()
+        barrier.wait()
+        for _ in range(i, requests, concurrency):
+            t0 = time.perf_counter()
+            extra = request_once(c)
+            results[i].append((t0, time.perf_counter(), extra))
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start, wall = time.perf_counter(), time.time()
+    for t in threads:
+        t.join()
+    return start, wall, [r for rs in results for r in rs]
+
+
+def bench_send(srv, text, concurrency, requests):
+    body = {"text": text}
+
+    def send(c):
+        started = time.time()
+        r = c.post("/send", json=body)
+        assert r.status_code == 202, r.status_code
+        return started, r.get_json()["job"]
+
+    _, wall, samples = run_clients(srv, concurrency, requests, send)
+    jobs = []
+    for _, _, (started, job_id) in samples:
+        job = srv.QUEUE.get(job_id)
+        job.done.wait(120)
+        assert job.status == "done", job.status
+        jobs.append((started, job))
+    elapsed = max(job.finished for _, job in jobs) - wall
+    return {
+        "latency_ms": stats((t1 - t0) * 1000 for t0, t1, _ in samples),
+        "complete_ms": stats((job.finished - started) * 1000 for started, job in jobs),
+        "batch_mean": round(sum(job.batch for _, job in jobs) / len(jobs), 2),
+        "per_sec": round(len(jobs) / elapsed, 1),
+    }
+
+
+def bench_page(srv, path, concurrency, requests):
+    def get(c):
+        r = c.get(path)
+        assert r.status_code == 200, r.status_code
+        r.close()
+
+    start, _, samples = run_clients(srv, concurrency, requests, get)
+    elapsed = max(t1 for _, t1, _ in samples) - start
+    return {
+        "latency_ms": stats((t1 - t0) * 1000 for t0, t1, _ in samples),
+        "per_sec": round(len(samples) / elapsed, 1),
+    }
+
+
+def stats(samples):
+    return {k: round(v, 3) for k, v in percentiles(list(samples)).items()}
+
+
+def run(args):
+    srv = load_server()
+    srv.USE_TOKEN = False
+    srv.PROFILE = dict(srv.DEFAULT_CONFIG["profiles"]["default"])
+    srv.COALESCE_MAX_BATCH = args.coalesce
+    srv.HUB.publish = lambda event, data: None  # no pages connected
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for stub in (["inprocess", "path"] if args.stub == "both" else [args.stub]):
+            install_stubs(srv, stub, tmp)
+            for conc in args.concurrency:
+                for path in PAGES:
+                    rows.append({"stub": stub, "endpoint": path, "concurrency": conc,
+                                 **bench_page(srv, path, conc, args.requests)})
+                for method in args.methods:
+                    srv.METHOD, srv.AUTO_PASTE = METHODS[method]
+                    for payload in args.payloads:
+                        # Sleep-based pastes take 100 ms each; keep those runs short.
+                        n = args.requests if not srv.AUTO_PASTE else max(conc, args.requests // 10)
+                        rows.append({"stub": stub, "endpoint": "/send", "method": method,
+                                     "payload": payload, "chars": len(PAYLOADS[payload]),
+                                     "concurrency": conc,
+                                     **bench_send(srv, PAYLOADS[payload], conc, n)})
+    return {
+        "version": git_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "requests": args.requests,
+        "coalesce": args.coalesce,
+        "results": rows,
+    }
+
+
+def git_version():
+    try:
+        return subprocess.run(["git", "-C", REPO_DIR, "describe", "--always", "--dirty"],
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def row_key(row):
+    return tuple(row.get(k) for k in ("stub", "endpoint", "method", "payload", "concurrency"))
+
+
+def row_name(row):
+    parts = [row["stub"], row["endpoint"], row.get("method"), row.get("payload"),
+             f"c{row['concurrency']}"]
+    return " ".join(p for p in parts if p)
+
+
+def print_table(report):
+    print(f"version {report['version']}, python {report['python']}")
+    for row in report["results"]:
+        lat = row["latency_ms"]
+        line = (f"{row_name(row):48} p50={lat['p50']:.3f} p95={lat['p95']:.3f} "
+                f"p99={lat['p99']:.3f} ms  {row['per_sec']:>9}/s")
+        if "complete_ms" in row:
+            line += f"  complete p95={row['complete_ms']['p95']:.1f} ms batch={row['batch_mean']}"
+        print(line)
+
+
+def compare(old_path, new_path):
+    """Print the change in p95 latency and throughput between two --json runs."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    before = {row_key(r): r for r in old["results"]}
+    print(f"{old['version']} -> {new['version']}")
+    for row in new["results"]:
+        prev = before.get(row_key(row))
+        if prev is None:
+            continue
+        p95 = row["latency_ms"]["p95"] / prev["latency_ms"]["p95"] - 1
+        rate = row["per_sec"] / prev["per_sec"] - 1
+        flag = "  <-- slower" if p95 > 0.2 or rate < -0.2 else ""
+        print(f"{row_name(row):48} p95 {p95:+7.1%}  rate {rate:+7.1%}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stub", choices=["inprocess", "path", "both"], default="both")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per cell")
+    parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")],
+                        default=[1, 4, 16], help="Comma-separated client counts")
+    parser.add_argument("--methods", type=lambda s: s.split(","), default=list(METHODS),
+                        help="Comma-separated subset of " + ", ".join(METHODS))
+    parser.add_argument("--payloads", type=lambda s: s.split(","), default=list(PAYLOADS),
+                        help="Comma-separated subset of " + ", ".join(PAYLOADS))
+    parser.add_argument("--coalesce", type=int, default=1,
+                        help="Queue coalescing max_batch (default 1: every send injected alone)")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="Compare two --json result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    for name in args.methods:
+        if name not in METHODS:
+            parser.error(f"unknown method {name!r}")
+    for name in args.payloads:
+        if name not in PAYLOADS:
+            parser.error(f"unknown payload {name!r}")
+    report = run(args)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_table(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Benchmark the server-side substitution engine against per-phrase regexes.
+
+    tools/bench_substitutions.py [--sizes 10,100,1000,10000,50000] [--json]
+
+The regex column mirrors what the page did before: one case-insensitive
+regex per phrase, each rescanning the whole text. It's skipped above
+--regex-max phrases because it gets too slow to wait for.
+"""
+
+import argparse
+import json
+import random
+import re
+import string
+import time
+
+from harness import load_server
+
+WORDS = ("the quick brown fox jumps over lazy dog and then some more words "
+         "appear in dictated text full stop comma new line").split()
+
+
+def make_dictionary(size, rng):
+    subs = {"full stop": ".", "comma": ",", "new line": "\n"}
+    while len(subs) < size:
+        n = rng.randint(1, 3)
+        phrase = " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9)))
+                          for _ in range(n))
+        subs[phrase] = phrase.upper()
+    return subs
+
+
+def make_text(subs, chars, rng):
+    phrases = list(subs)
+    out = []
+    length = 0
+    while length < chars:
+        word = rng.choice(phrases) if rng.random() < 0.1 else rng.choice(WORDS)
+        out.append(word)
+        length += len(word) + 1
+    return " ".join(out)
+
+
+def regex_apply(compiled, text):
+    for regex, replacement in compiled:
+        text = regex.sub(lambda m, r=replacement: m.group(1) + r, text)
+    return text
+
+
+def timed(fn, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return round(best * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,1000,10000,50000")
+    parser.add_argument("--chars", type=int, default=10000, help="Text length")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--regex-max", type=int, default=2000)
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    srv = load_server()
+    rng = random.Random(1)
+    results = []
+    for size in (int(x) for x in args.sizes.split(",")):
+        subs = make_dictionary(size, rng)
+        text = make_text(subs, args.chars, rng)
+        t0 = time.perf_counter()
+        engine = srv.SubstitutionEngine(subs)
+        row = {
+            "entries": size,
+            "chars": len(text),
+            "compile_ms": round((time.perf_counter() - t0) * 1000, 3),
+            "apply_ms": timed(lambda: engine.apply(text), args.rounds),
+            "regex_ms": None,
+        }
+        if size <= args.regex_max:
+            ordered = sorted(subs.items(), key=lambda kv: -len(kv[0]))
+            compiled = [(re.compile(r"(^|\s)" + re.escape(p) + r"(?=\s|$)", re.I), r)
+                        for p, r in ordered]
+            row["regex_ms"] = timed(lambda: regex_apply(compiled, text), args.rounds)
+        results.append(row)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'entries':>8} {'chars':>7} {'compile':>10} {'apply':>10} {'regex':>10}")
+        for r in results:
+            regex = f"{r['regex_ms']:.3f}ms" if r["regex_ms"] is not None else "-"
+            print(f"{r['entries']:>8} {r['chars']:>7} {r['compile_ms']:>8.3f}ms "
+                  f"{r['apply_ms']:>8.3f}ms {regex:>10}")
+
+
+if __name__ == "__main__":
+    main()
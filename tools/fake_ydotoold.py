@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""Fake ydotoold: accepts the daemon's socket protocol without /dev/uinput.
+
+Decodes the key events it receives back into text so the resident injector
+can be exercised and benchmarked on machines without uinput access:
+
+    tools/fake_ydotoold.py --socket /tmp/fake.sock &
+    YDOTOOL_SOCKET=/tmp/fake.sock ./input-from-web.py --injector socket
+"""
+
+import argparse
+import os
+import socket
+import sys
+import threading
+
+from harness import load_server
+
+
+class FakeYdotoold:
+    """Listens on a unix socket and reassembles typed text from key events.
+
+    protocol is "dgram" (ydotool >= 1.0) or "stream" (ydotool 0.1.x).
+    """
+
+    def __init__(self, path, protocol="dgram", echo=False):
+        self.srv = load_server()
+        self.path = path
+        self.protocol = protocol
+        self.echo = echo
+        self.text = []
+        self.chords = []
+        self.events = 0
+        self.changed = threading.Condition()
+        self._reverse = {v: k for k, v in self.srv.KEYMAP.items()}
+        self._held = []
+        self._pressed = []
+        self._closing = False
+        if os.path.exists(path):
+            os.unlink(path)
+        kind = socket.SOCK_DGRAM if protocol == "dgram" else socket.SOCK_STREAM
+        self.sock = socket.socket(socket.AF_UNIX, kind)
+        self.sock.bind(path)
+        if protocol == "stream":
+            self.sock.listen(8)
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def close(self):
+        self._closing = True
+        self.sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def serve(self):
+        try:
+            if self.protocol == "dgram":
+                size = self.srv._INPUT_EVENT.size
+                while True:
+                    data = self.sock.recv(size)
+                    _, _, t, c, v = self.srv._INPUT_EVENT.unpack(data)
+                    self.feed(t, c, v)
+            else:
+                while True:
+                    conn, _ = self.sock.accept()
+                    threading.Thread(target=self._serve_stream, args=(conn,), daemon=True).start()
+        except OSError:
+            if not self._closing:
+                raise
+
+    def _serve_stream(self, conn):
+        size = self.srv._RAW_EVENT.size
+        buf = b""
+        with conn:
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    return
+                buf += data
+                usable = len(buf) - len(buf) % size
+                for t, c, v in self.srv._RAW_EVENT.iter_unpack(buf[:usable]):
+                    self.feed(t, c, v)
+                buf = buf[usable:]
+
+    def feed(self, etype, code, value):
+        """Track key state; a release completes a character or a chord."""
+        if etype != self.srv.EV_KEY:
+            return
+        with self.changed:
+            self.events += 1
+            if value:
+                self._held.append(code)
+                self._pressed.append(code)
+                return
+            if code in self._held:
+                self._held.remove(code)
+            if self._held:
+                return
+            pressed, self._pressed = self._pressed, []
+            shift = self.srv.KEY_CODES["shift"]
+            keys = [k for k in pressed if k != shift]
+            char = self._reverse.get((keys[0], shift in pressed)) if len(keys) == 1 else None
+            if char is not None:
+                self.text.append(char)
+                if self.echo:
+                    sys.stdout.write(char)
+                    sys.stdout.flush()
+            else:
+                self.chords.append(pressed)
+                if self.echo:
+                    print(f"<chord {pressed}>")
+            self.changed.notify_all()
+
+    def typed(self):
+        with self.changed:
+            return "".join(self.text)
+
+    def wait_for(self, length, timeout=10.0):
+        """Block until at least length characters have been decoded."""
+        with self.changed:
+            return self.changed.wait_for(lambda: len(self.text) >= length, timeout)
+
+    def reset(self):
+        with self.changed:
+            self.text.clear()
+            self.chords.clear()
+            self.events = 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--socket", default="/tmp/.fake_ydotool_socket",
+                        help="Socket path to listen on")
+    parser.add_argument("--protocol", choices=["dgram", "stream"], default="dgram",
+                        help="dgram: ydotool >= 1.0. stream: ydotool 0.1.x")
+    parser.add_argument("--quiet", action="store_true", help="Don't print what would be typed")
+    args = parser.parse_args()
+    daemon = FakeYdotoold(args.socket, args.protocol, echo=not args.quiet)
+    print(f"Fake ydotoold listening on {args.socket} ({args.protocol})", file=sys.stderr)
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""Shared helpers for the scripts in tools/ (not installed with the package)."""
+
+import importlib.util
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SCRIPT = os.path.join(REPO_DIR, "input-from-web.py")
+
+
+def load_server():
+    """Import input-from-web.py as a module (its name isn't importable as-is)."""
+    mod = sys.modules.get("input_from_web")
+    if mod is None:
+        spec = importlib.util.spec_from_file_location("input_from_web", SERVER_SCRIPT)
+        mod = importlib.util.module_from_spec(spec)
+        sys.modules["input_from_web"] = mod
+        spec.loader.exec_module(mod)
+    return mod
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    """Nearest-rank percentiles of a list of numbers, as {"p50": ...}."""
+    if not samples:
+        return {f"p{p}": None for p in points}
+    ordered = sorted(samples)
+    out = {}
+    for p in points:
+        idx = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered))) - 1))
+        out[f"p{p}"] = ordered[idx]
+    return out
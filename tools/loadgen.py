@@ -0,0 +1,639 @@
+#!/usr/bin/env python3
+"""Load test the server with simulated phones replaying dictation traces.
+
+    tools/loadgen.py [--phones 1,10,50] [--duration 30] [--trace FILE] [--json]
+    tools/loadgen.py --write-trace trace.jsonl     # the synthetic trace, to edit or reuse
+    tools/loadgen.py --url 'http://HOST:PORT/?token=...' [--pid PID]
+
+Unless --url is given, it starts input-from-web.py itself with a scratch
+HOME and profile, the resident injector writing to tools/fake_ydotoold.py,
+and stub wl-copy / ydotool scripts first on $PATH, so nothing is typed and
+nothing leaves the machine.
+
+Each phone does what the page does. It loads /, /config.js, the assets and
+the first page of history with the token, and keeps /events open, reconnecting
+when heartbeats stop as the page's watchdog does. It applies the
+substitutions as text arrives. Once the text ends in a send word and nothing
+more arrives for voice_send.delay_seconds, it strips the word and POSTs /send
+with an Idempotency-Key; a clear word empties the text. Latency runs from the
+input event that ended in the send word to the job event saying the text was
+injected, so it includes that delay. The server's request rate comes from
+/metrics, its CPU time and RSS from /proc.
+
+A trace is JSON lines of {"t": seconds from the start, "data": "text"}: what
+a dictation keyboard inserted at that moment, usually a few words. Each phone
+replays it from a random point, looping, for --duration seconds.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from bench_server import STUB_SCRIPT
+from harness import REPO_DIR, SERVER_SCRIPT, load_server, percentiles
+
+WORDS = """the be to of and a in that have it for not on with he as you do at this but his
+by from they we say her she or an will my one all would there their what so up out if about
+who get which go me when make can like time no just him know take people into year your good
+some could them see other than then now look only come its over think also back after use two
+how our work first well way even new want because any these give day most us meeting tomorrow
+please check the draft send later message thanks again""".split()
+SERVER_START_SECONDS = 30
+DRAIN_SECONDS = 15  # after the run, for sends still being typed
+EARLY_KEEP = 64  # job events that beat their /send response, per phone
+
+
+def synthetic_trace(config, utterances=40, seed=1):
+    """Utterances of a few words at a time, with some spoken punctuation, each
+    ending in a send word (or now and then a clear word) and a pause longer
+    than voice_send.delay_seconds."""
+    rng = random.Random(seed)
+    voice = config.get("voice_send", {})
+    send_words = voice.get("send_words") or ["send"]
+    clear_words = voice.get("clear_words") or send_words
+    delay = voice.get("delay_seconds", 1.5)
+    phrases = list(config.get("substitutions", {}))
+    events, t = [], 0.0
+    for _ in range(utterances):
+        words = []
+        for _ in range(rng.randint(3, 25)):
+            words.append(rng.choice(WORDS))
+            if phrases and rng.random() < 0.12:
+                words.append(rng.choice(phrases))
+        words.append(rng.choice(clear_words if rng.random() < 0.05 else send_words))
+        first = True
+        while words:
+            n = rng.randint(1, 4)
+            chunk, words = words[:n], words[n:]
+            events.append({"t": round(t, 3), "data": ("" if first else " ") + " ".join(chunk)})
+            first = False
+            t += rng.uniform(0.3, 1.0)
+        t += delay + rng.uniform(1.0, 5.0)
+    return events
+
+
+def load_trace(path):
+    events = []
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if not isinstance(event.get("t"), (int, float)) or not isinstance(event.get("data"), str):
+                raise ValueError(f"{path}:{n}: expected {{\"t\": seconds, \"data\": text}}")
+            if events and event["t"] < events[-1]["t"]:
+                raise ValueError(f"{path}:{n}: events must be in time order")
+            events.append(event)
+    if not events:
+        raise ValueError(f"{path}: no events")
+    return events
+
+
+def replay(trace, start, offset, gap):
+    """(when, data) for the trace looped forever, starting offset seconds in."""
+    length = trace[-1]["t"] + gap
+    base = start - offset
+    while True:
+        for event in trace:
+            when = base + event["t"]
+            if when >= start:
+                yield when, event["data"]
+        base += length
+
+
+def voice_command(text, send_words, clear_words):
+    """The page's voice command check: (action, word) if text ends in one, else None."""
+    m = re.search(r"(\S+)\s*$", text)
+    if not m:
+        return None
+    word = m.group(1).lower()
+    if word in send_words:
+        return "send", m.group(1)
+    if word in clear_words:
+        return "clear", m.group(1)
+    return None
+
+
+class Target:
+    """Where the server is, with the token and profile its page would get."""
+
+    def __init__(self, url):
+        parts = urllib.parse.urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.token = urllib.parse.parse_qs(parts.query).get("token", [""])[0]
+        self.config = {}
+
+    def connect(self, timeout=10):
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def get(self, path):
+        conn = self.connect()
+        try:
+            conn.request("GET", path)
+            resp = conn.getresponse()
+            return resp.status, resp.read()
+        finally:
+            conn.close()
+
+    def wait_ready(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if self.get("/ping")[0] == 200:
+                    return
+            except OSError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"server at {self.host}:{self.port} did not come up")
+            time.sleep(0.1)
+
+    def load_config(self):
+        status, body = self.get("/config.js")
+        if status != 200:
+            raise RuntimeError(f"/config.js: HTTP {status}")
+        self.config = json.loads(body.decode().strip().removeprefix("var CONFIG = ").rstrip(";"))
+
+    def requests_served(self):
+        """Requests the server has answered, from its /metrics."""
+        status, body = self.get("/metrics?token=" + urllib.parse.quote(self.token))
+        if status != 200:
+            return None
+        total = 0
+        for line in body.decode().splitlines():
+            if line.startswith("input_from_web_request_seconds_count"):
+                total += float(line.rsplit(" ", 1)[1])
+        return total
+
+
+class Stats:
+    """What all phones of one run saw, behind one lock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []
+        self.counts = {}
+
+    def count(self, what, n=1):
+        with self.lock:
+            self.counts[what] = self.counts.get(what, 0) + n
+
+    def add(self, sample):
+        with self.lock:
+            self.samples.append(sample)
+
+
+class Phone:
+    """One simulated page: its own client id, keep-alive connection and /events stream."""
+
+    def __init__(self, n, target, stats, subs):
+        self.target = target
+        self.stats = stats
+        self.subs = subs
+        self.client_id = f"loadgen-{n}-{os.urandom(4).hex()}"
+        self.query = (f"?token={urllib.parse.quote(target.token)}"
+                      f"&client={urllib.parse.quote(self.client_id)}")
+        self.conn = target.connect()
+        self.events_conn = None
+        self.lock = threading.Lock()
+        self.outstanding = {}  # job id -> sample waiting for its job event
+        self.early = {}  # job id -> (when, job) for events that beat the /send response
+        self.closed = False
+        self.keepalive = 15
+        self.listener = threading.Thread(target=self.listen, daemon=True)
+
+    def request(self, method, path, body=None, headers=None):
+        try:
+            self.conn.request(method, path, body, headers or {})
+            resp = self.conn.getresponse()
+            data = resp.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.stats.count("network error")
+            return None, None
+        if resp.status >= 400:
+            self.stats.count(f"HTTP {resp.status}")
+        return resp.status, data
+
+    def load(self):
+        """Fetch the page and what it pulls in, then open /events."""
+        status, page = self.request("GET", "/?token=" + urllib.parse.quote(self.target.token))
+        if status == 200:
+            for path in dict.fromkeys(re.findall(r'(?:src|href)="(/[^"]*)"', page.decode())):
+                self.request("GET", path)
+        self.request("GET", "/sw.js")
+        self.request("GET", "/history" + self.query + "&limit=20")
+        self.listener.start()
+
+    def listen(self):
+        while not self.closed:
+            conn = self.events_conn = self.target.connect(self.keepalive * 2.5 + 2)
+            try:
+                conn.request("GET", "/events" + self.query)
+                resp = conn.getresponse()
+                event = None
+                while not self.closed:
+                    line = resp.readline()
+                    if not line:
+                        break
+                    line = line.decode().rstrip("\n")
+                    if line.startswith("event: "):
+                        event = line[7:]
+                    elif line.startswith("data: "):
+                        self.on_event(event, json.loads(line[6:]))
+            except (OSError, http.client.HTTPException, ValueError):
+                pass
+            finally:
+                conn.close()
+            if not self.closed:
+                # Heartbeats stopped or the stream broke: the page's red dot.
+                self.stats.count("events reconnect")
+                time.sleep(1)
+
+    def on_event(self, event, data):
+        if event == "heartbeat":
+            self.keepalive = data.get("keepalive", self.keepalive)
+            return
+        if event != "job" or data.get("client") != self.client_id:
+            return
+        if data["status"] not in ("done", "failed", "cancelled"):
+            return
+        now = time.monotonic()
+        with self.lock:
+            sample = self.outstanding.pop(data["id"], None)
+            if sample is None:
+                self.early[data["id"]] = (now, data)
+                while len(self.early) > EARLY_KEEP:
+                    self.early.pop(next(iter(self.early)))
+                return
+        self.finish(sample, now, data)
+
+    def finish(self, sample, done, job):
+        if job["status"] != "done":
+            self.stats.count(f"job {job['status']}")
+            return
+        sample.update(
+            latency_ms=(done - sample.pop("said")) * 1000,
+            queue_ms=job.get("queued_ms") or 0,
+            inject_ms=job.get("inject_ms") or 0,
+        )
+        self.stats.add(sample)
+
+    def send(self, text, said):
+        headers = {"Content-Type": "application/json", "Idempotency-Key": os.urandom(8).hex()}
+        t0 = time.monotonic()
+        status, data = self.request("POST", "/send" + self.query,
+                                    json.dumps({"text": text}).encode(), headers)
+        rtt = (time.monotonic() - t0) * 1000
+        if status not in (200, 202):
+            return
+        self.stats.count("sends")
+        job_id = json.loads(data)["job"]
+        sample = {"said": said, "rtt_ms": rtt}
+        with self.lock:
+            early = self.early.pop(job_id, None)
+            if early is None:
+                self.outstanding[job_id] = sample
+                return
+        self.finish(sample, *early)
+
+    def dictate(self, trace, start, stop_at, rng):
+        """Replay the trace until stop_at, acting on voice commands like the page."""
+        voice = self.target.config.get("voice_send", {})
+        enabled = voice.get("enabled", False)
+        delay = voice.get("delay_seconds", 1.5)
+        send_words = {w.lower() for w in voice.get("send_words", [])}
+        clear_words = {w.lower() for w in voice.get("clear_words", [])}
+        events = replay(trace, start, rng.uniform(0, trace[-1]["t"]), delay + 2)
+        when, data = next(events)
+        text = ""
+        timer = None  # (due, said, action, word)
+        while True:
+            due = min(when, timer[0]) if timer else when
+            if due >= stop_at:
+                return
+            time.sleep(max(0.0, due - time.monotonic()))
+            if timer and timer[0] <= when:
+                _, said, action, word = timer
+                timer = None
+                text = re.sub(r"\s*" + re.escape(word) + r"\s*$", "", text, flags=re.I)
+                if action == "send" and text:
+                    self.send(text, said)
+                elif action == "clear":
+                    self.stats.count("clears")
+                text = ""
+                continue
+            text = self.subs.apply(text + data)
+            command = enabled and voice_command(text, send_words, clear_words)
+            now = time.monotonic()
+            timer = (now + delay, now, *command) if command else None
+            when, data = next(events)
+
+    def pending(self):
+        with self.lock:
+            return len(self.outstanding)
+
+    def close(self):
+        self.closed = True
+        self.conn.close()
+        conn = self.events_conn
+        if conn is not None and conn.sock is not None:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class ProcessMonitor:
+    """Samples a process's CPU time (its own and its reaped children's) and RSS."""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []  # (monotonic, cpu seconds, rss bytes)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def read(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = sum(int(x) for x in fields[11:15]) / os.sysconf("SC_CLK_TCK")
+        rss = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+        return time.monotonic(), cpu, rss
+
+    def start(self):
+        self.samples.append(self.read())
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.samples.append(self.read())
+            except OSError:
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        try:
+            self.samples.append(self.read())
+        except OSError:
+            pass
+        (t0, c0, _), (t1, c1, rss) = self.samples[0], self.samples[-1]
+        # Short intervals are a clock tick or two, too coarse to rate.
+        peaks = [(b[1] - a[1]) / (b[0] - a[0]) for a, b in zip(self.samples, self.samples[1:])
+                 if b[0] - a[0] >= self.interval / 2]
+        return {
+            "cpu_percent": round((c1 - c0) / max(t1 - t0, 1e-6) * 100, 1),
+            "cpu_peak_percent": round(max(peaks, default=0) * 100, 1),
+            "rss_mb": round(rss / 2**20, 1),
+            "rss_peak_mb": round(max(s[2] for s in self.samples) / 2**20, 1),
+        }
+
+
+class LocalServer:
+    """input-from-web.py in a scratch HOME, injecting into stubs."""
+
+    def __init__(self, srv, args):
+        self.srv = srv
+        self.args = args
+        self.procs = []
+
+    def __enter__(self):
+        self.tmp = tempfile.TemporaryDirectory(prefix="loadgen-")
+        home = self.tmp.name
+        bindir = os.path.join(home, "bin")
+        os.makedirs(bindir)
+        for name in ("ydotool", "wl-copy"):
+            path = os.path.join(bindir, name)
+            with open(path, "w") as f:
+                f.write(STUB_SCRIPT.format(name=name))
+            os.chmod(path, 0o755)
+        sock = os.path.join(home, "ydotool.sock")
+        env = dict(os.environ, HOME=home, XDG_DATA_HOME=os.path.join(home, "data"),
+                   XDG_CACHE_HOME=os.path.join(home, "cache"), YDOTOOL_SOCKET=sock,
+                   PATH=bindir + os.pathsep + os.environ["PATH"])
+        if self.args.injector == "socket":
+            self.procs.append(subprocess.Popen(
+                [sys.executable, os.path.join(REPO_DIR, "tools", "fake_ydotoold.py"),
+                 "--socket", sock, "--quiet"], stderr=subprocess.DEVNULL))
+            deadline = time.monotonic() + 10
+            while not os.path.exists(sock):
+                if time.monotonic() > deadline:
+                    raise RuntimeError("fake ydotoold did not start")
+                time.sleep(0.05)
+
+        profile = json.loads(json.dumps(self.srv.DEFAULT_CONFIG["profiles"]["default"]))
+        with socket.socket() as s:
+            s.bind(("", 0))
+            port = s.getsockname()[1]
+        profile.update(port=port, server=self.args.server, injector=self.args.injector,
+                       method=self.args.method)
+        if self.args.delay is not None:
+            profile["voice_send"]["delay_seconds"] = self.args.delay
+        # Every phone comes from 127.0.0.1, so the per-address limit would
+        # count them all as one.
+        profile["admission"]["address_rate"] = 0
+        if self.args.no_limits:
+            profile["admission"].update(token_rate=0, max_queued=0)
+        config = {"default_profile": "loadgen", "profiles": {"loadgen": profile}}
+        with open(os.path.join(home, ".input-from-web-conf.json"), "w") as f:
+            json.dump(config, f)
+
+        self.log = open(os.path.join(home, "server.log"), "w")
+        server = subprocess.Popen([sys.executable, SERVER_SCRIPT, "--profile", "loadgen"],
+                                  env=env, stdout=subprocess.PIPE, stderr=self.log, text=True)
+        self.procs.append(server)
+        self.pid = server.pid
+        url = None
+        for line in server.stdout:
+            m = re.search(r"URL: (\S+)", line)
+            if m:
+                url = m.group(1)
+                break
+        if url is None:
+            raise RuntimeError("server exited: " + self.tail())
+        # Keep reading so the server never blocks on a full pipe.
+        threading.Thread(target=server.stdout.read, daemon=True).start()
+        self.target = Target(url)
+        try:
+            self.target.wait_ready(SERVER_START_SECONDS)
+        except RuntimeError:
+            raise RuntimeError("server did not come up: " + self.tail()) from None
+        return self
+
+    def tail(self):
+        self.log.flush()
+        with open(self.log.name) as f:
+            return f.read()[-2000:]
+
+    def __exit__(self, *exc):
+        for proc in reversed(self.procs):
+            proc.terminate()
+            try:
+                proc.wait(5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+        self.log.close()
+        self.tmp.cleanup()
+
+
+def run_level(target, pid, phones, trace, args, subs):
+    """Run `phones` phones for args.duration seconds and summarise what they saw."""
+    stats = Stats()
+    rng = random.Random(phones)
+    served0 = target.requests_served()
+    monitor = ProcessMonitor(pid).start() if pid else None
+    own0 = os.times()
+    start = time.monotonic()
+    stop_at = start + args.duration
+    fleet = [Phone(i, target, stats, subs) for i in range(phones)]
+
+    def run(i, phone):
+        time.sleep(args.ramp * i / phones)
+        phone.load()
+        phone.dictate(trace, time.monotonic(), stop_at, random.Random(rng.random()))
+
+    threads = [threading.Thread(target=run, args=(i, p), daemon=True) for i, p in enumerate(fleet)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    deadline = time.monotonic() + DRAIN_SECONDS
+    while any(p.pending() for p in fleet) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    elapsed = time.monotonic() - start
+    own1 = os.times()
+    lost = sum(p.pending() for p in fleet)
+    for phone in fleet:
+        phone.close()
+    served1 = target.requests_served()
+    server = monitor.stop() if monitor else {}
+    if served0 is not None and served1 is not None:
+        server["requests_per_sec"] = round((served1 - served0) / elapsed, 1)
+
+    samples = stats.samples
+    counts = dict(stats.counts)
+    sends = counts.pop("sends", 0)
+    return {
+        "phones": phones,
+        "seconds": round(elapsed, 1),
+        "sends": sends,
+        "sends_per_sec": round(sends / args.duration, 2),
+        "clears": counts.pop("clears", 0),
+        "latency_ms": summary(s["latency_ms"] for s in samples),
+        "rtt_ms": summary(s["rtt_ms"] for s in samples),
+        "queue_ms": summary(s["queue_ms"] for s in samples),
+        "inject_ms": summary(s["inject_ms"] for s in samples),
+        "lost": lost,
+        "errors": counts,
+        "server": server,
+        "loadgen_cpu_percent": round((own1.user + own1.system - own0.user - own0.system)
+                                     / elapsed * 100, 1),
+    }
+
+
+def summary(values):
+    return {k: None if v is None else round(v, 1) for k, v in percentiles(list(values)).items()}
+
+
+def print_report(report):
+    print(f"server {report['server']}, injector {report['injector']}, method {report['method']}; "
+          f"latency includes the {report['delay_ms']:.0f} ms voice_send delay")
+    for row in report["results"]:
+        lat, server = row["latency_ms"], row["server"]
+        line = (f"{row['phones']:>4} phones {row['sends_per_sec']:6.2f} sends/s  "
+                f"latency p50={lat['p50']} p95={lat['p95']} p99={lat['p99']} ms  "
+                f"rtt p95={row['rtt_ms']['p95']} queue p95={row['queue_ms']['p95']} "
+                f"inject p95={row['inject_ms']['p95']} ms")
+        if server:
+            line += (f"  | server {server.get('requests_per_sec')} req/s "
+                     f"cpu {server['cpu_percent']}% (peak {server['cpu_peak_percent']}%) "
+                     f"rss {server['rss_mb']} MB (peak {server['rss_peak_mb']})")
+        print(line)
+        problems = dict(row["errors"], lost=row["lost"]) if row["lost"] else row["errors"]
+        if problems:
+            print("     " + ", ".join(f"{k}: {v}" for k, v in sorted(problems.items())))
+        if row["loadgen_cpu_percent"] > 80:
+            print(f"     loadgen itself used {row['loadgen_cpu_percent']}% CPU; "
+                  f"its timings may be late")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--phones", type=lambda s: [int(x) for x in s.split(",")], default=[1, 10, 50],
+                        help="Comma-separated numbers of simulated phones, one run each")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per run")
+    parser.add_argument("--ramp", type=float, default=2,
+                        help="Seconds over which the phones of a run open the page")
+    parser.add_argument("--trace", help="JSON-lines trace to replay (default: a synthetic one)")
+    parser.add_argument("--write-trace", metavar="FILE",
+                        help="Write the synthetic trace to FILE and exit")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the synthetic trace")
+    parser.add_argument("--url", help="Test the server at this URL (with ?token=...) "
+                                      "instead of starting one")
+    parser.add_argument("--pid", type=int, help="With --url: the server's pid, for CPU and RSS")
+    parser.add_argument("--server", choices=["werkzeug", "async"], default="werkzeug")
+    parser.add_argument("--injector", choices=["socket", "subprocess"], default="socket",
+                        help="socket: resident injector and a fake ydotoold. "
+                             "subprocess: a stub ydotool spawned per send")
+    parser.add_argument("--method", choices=["type", "clipboard", "auto"], default="type")
+    parser.add_argument("--delay", type=float, help="voice_send.delay_seconds (default: the profile's)")
+    parser.add_argument("--no-limits", action="store_true",
+                        help="Also turn off the token rate limit and the queue cap")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    srv = load_server()
+    if args.write_trace:
+        config = dict(srv.DEFAULT_CONFIG["profiles"]["default"])
+        if args.delay is not None:
+            config["voice_send"] = dict(config["voice_send"], delay_seconds=args.delay)
+        with open(args.write_trace, "w") as f:
+            for event in synthetic_trace(config, seed=args.seed):
+                f.write(json.dumps(event) + "\n")
+        return
+
+    def run(target, pid):
+        target.load_config()
+        if not target.config.get("voice_send", {}).get("enabled"):
+            parser.error("the profile has voice_send disabled; phones would never send")
+        trace = load_trace(args.trace) if args.trace else synthetic_trace(target.config, seed=args.seed)
+        subs = srv.SubstitutionEngine(target.config.get("substitutions", {}))
+        return {
+            "server": args.server if not args.url else "external",
+            "injector": args.injector if not args.url else "external",
+            "method": target.config.get("method", "type"),
+            "delay_ms": target.config["voice_send"].get("delay_seconds", 1.5) * 1000,
+            "duration": args.duration,
+            "results": [run_level(target, pid, n, trace, args, subs) for n in args.phones],
+        }
+
+    if args.url:
+        target = Target(args.url)
+        target.wait_ready(5)
+        report = run(target, args.pid)
+    else:
+        with LocalServer(srv, args) as local:
+            report = run(local.target, local.pid)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()